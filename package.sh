@@ -19,12 +19,15 @@ fi
 mkdir -p lib package
 
 # Pull down Python dependencies
-pip3 install -r requirements.txt -t lib --no-binary :all: --prefix ""  --no-cache-dir --upgrade
+pip3 install -r requirements.txt -t lib --no-binary :all: --only-binary numpy --prefix ""  --no-cache-dir --upgrade # NumPy takes far too long to compile, its wheel is used instead
 
 wget -O oui.csv http://standards-oui.ieee.org/oui/oui.csv
+wget -O mam.csv http://standards-oui.ieee.org/oui28/mam.csv
+wget -O oui36.csv http://standards-oui.ieee.org/oui36/oui36.csv
+python3 -c 'from pkg.oui_index import build_index; build_index(["oui.csv", "mam.csv", "oui36.csv"], "oui.index")'
 
 # Put package together
-cp -r pkg LICENSE manifest.json *.py oui.csv js images views css README.md lib package/
+cp -r pkg LICENSE manifest.json *.py oui.csv mam.csv oui36.csv oui.index js images views css README.md lib package/
 find package -type f -name '*.pyc' -delete
 find package -type f -name '._*' -delete
 find package -type d -empty -delete
@@ -0,0 +1,160 @@
+"""ARP sweeper. Sends who-has requests for a whole range of addresses over one AF_PACKET socket, instead of calling arping for each address."""
+
+import time
+import fcntl
+import select
+import socket
+import struct
+
+
+ETH_P_ARP = 0x0806
+ETH_P_IP = 0x0800
+ARP_REQUEST = 1
+ARP_REPLY = 2
+
+SIOCGIFADDR = 0x8915
+
+BROADCAST_MAC = b'\xff' * 6
+ZERO_MAC = b'\x00' * 6
+MINIMUM_FRAME_SIZE = 60 # Ethernet frames are padded to 60 bytes (without the checksum)
+
+
+
+def mac_to_bytes(mac):
+    return bytes(int(part, 16) for part in mac.replace('-', ':').split(':'))
+
+
+def bytes_to_mac(data):
+    return ':'.join('{:02x}'.format(b) for b in data)
+
+
+def build_arp_request(source_mac, source_ip, target_ip):
+    """ Returns a complete broadcast Ethernet frame asking who has target_ip """
+    if isinstance(source_mac, str):
+        source_mac = mac_to_bytes(source_mac)
+    ethernet_header = BROADCAST_MAC + source_mac + struct.pack('!H', ETH_P_ARP)
+    arp_packet = struct.pack('!HHBBH', 1, ETH_P_IP, 6, 4, ARP_REQUEST) + \
+                 source_mac + socket.inet_aton(source_ip) + \
+                 ZERO_MAC + socket.inet_aton(target_ip)
+    frame = ethernet_header + arp_packet
+    return frame + b'\x00' * (MINIMUM_FRAME_SIZE - len(frame))
+
+
+def parse_arp_reply(frame):
+    """ Returns (ip, mac) of the sender if the frame is an ARP is-at reply, otherwise None """
+    try:
+        if len(frame) < 42:
+            return None
+        if struct.unpack('!H', frame[12:14])[0] != ETH_P_ARP:
+            return None
+        hardware_type, protocol_type, hardware_size, protocol_size, operation = struct.unpack('!HHBBH', frame[14:22])
+        if protocol_type != ETH_P_IP or hardware_size != 6 or protocol_size != 4 or operation != ARP_REPLY:
+            return None
+        sender_mac = bytes_to_mac(frame[22:28])
+        sender_ip = socket.inet_ntoa(frame[28:32])
+        return sender_ip, sender_mac
+    except Exception:
+        return None
+
+
+def get_interface_mac(interface):
+    with open('/sys/class/net/' + str(interface) + '/address') as f:
+        return f.read().strip()
+
+
+def get_interface_ip(interface):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        data = fcntl.ioctl(sock.fileno(), SIOCGIFADDR, struct.pack('256s', str(interface)[:15].encode()))
+        return socket.inet_ntoa(data[20:24])
+    finally:
+        sock.close()
+
+
+
+class ArpSweeper:
+    """ Asks the entire target range who-has in one burst and collects the is-at replies """
+
+    def __init__(self, interface=None, debug=False):
+        self.interface = interface
+        self.DEBUG = debug
+        self.available = None # None means: not tested yet
+
+    def open_socket(self):
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ARP))
+        try:
+            sock.bind((str(self.interface), ETH_P_ARP))
+            sock.setblocking(False)
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+
+    def is_available(self):
+        """ Checks if a packet socket can be opened (this requires CAP_NET_RAW). Checked again when the interface changes. """
+        if self.available is None or self.available[0] != self.interface:
+            try:
+                sock = self.open_socket()
+                sock.close()
+                self.available = (self.interface, True)
+            except Exception as ex:
+                if self.DEBUG:
+                    print("arp sweep: no packet socket available, will fall back to arping: " + str(ex))
+                self.available = (self.interface, False)
+        return self.available[1]
+
+
+    def sweep(self, addresses, timeout=1.0, pace=None, source_ip=None):
+        """ Returns a dictionary with the ip -> mac address pairs of all addresses that replied within the timeout.
+        pace -- optional function that is called before every frame is sent, and can block to limit the send rate """
+        found = {}
+        targets = set(str(a) for a in addresses)
+        if len(targets) == 0:
+            return found
+
+        source_mac = mac_to_bytes(get_interface_mac(self.interface))
+        if source_ip == None:
+            source_ip = get_interface_ip(self.interface)
+
+        sock = self.open_socket()
+        try:
+            for address in targets:
+                if pace != None:
+                    pace()
+                try:
+                    sock.send(build_arp_request(source_mac, source_ip, address))
+                except OSError as ex:
+                    if self.DEBUG:
+                        print("arp sweep: send to " + str(address) + " failed: " + str(ex))
+                self._receive(sock, targets, found, 0)
+
+            deadline = time.time() + timeout
+            while len(found) < len(targets):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._receive(sock, targets, found, remaining)
+        finally:
+            sock.close()
+
+        if self.DEBUG:
+            print("arp sweep: " + str(len(found)) + " of " + str(len(targets)) + " addresses replied")
+        return found
+
+
+    def _receive(self, sock, targets, found, wait):
+        readable, _, _ = select.select([sock], [], [], wait)
+        while readable:
+            try:
+                frame = sock.recv(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            reply = parse_arp_reply(frame)
+            if reply != None:
+                ip_address, mac_address = reply
+                if ip_address in targets and ip_address not in found:
+                    found[ip_address] = mac_address
+            readable, _, _ = select.select([sock], [], [], 0)
@@ -0,0 +1,173 @@
+"""Avahi browser. Keeps a long-running 'avahi-browse' process, and turns its output into records as they arrive, so the mDNS services on the network are always known without waiting for a fresh browse."""
+
+import re
+import time
+import threading
+import subprocess
+from collections import namedtuple
+
+
+# avahi-browse -p -r prints lines like:
+# +;eth0;IPv4;My\032Printer;_ipp._tcp;local
+# =;eth0;IPv4;My\032Printer;_ipp._tcp;local;printer.local;192.168.1.20;631;"txtvers=1"
+# -;eth0;IPv4;My\032Printer;_ipp._tcp;local
+AvahiRecord = namedtuple('AvahiRecord', ['event', 'interface', 'protocol', 'name', 'service_type', 'domain', 'hostname', 'address', 'port', 'txt', 'line'])
+
+BROWSE_COMMAND = ["avahi-browse","-p","-l","-a","-r","-k"]
+
+# avahi escapes special characters as a backslash and a three digit decimal code (e.g. \032 is a space), and a dot or backslash inside a label with a backslash.
+# The codes are bytes, so a character like ’ is escaped as the three bytes of its UTF-8 encoding: \226\128\153
+ESCAPE_PATTERN = re.compile(rb'\\(\d{3}|.)')
+
+
+
+def _unescape_match(match):
+    escaped = match.group(1)
+    if len(escaped) == 3:
+        code = int(escaped)
+        if code < 256:
+            return bytes((code,))
+        return match.group(0)
+    return escaped
+
+
+def unescape(data):
+    """ Replaces all the escape sequences by the bytes they stand for, in a single pass, and then decodes the result as UTF-8 """
+    if isinstance(data, str):
+        data = data.encode('utf-8', errors='surrogateescape')
+    if b'\\' in data:
+        data = ESCAPE_PATTERN.sub(_unescape_match, data)
+    return data.decode('utf-8', errors='replace')
+
+
+def decode_avahi_output(data):
+    """ Turns the raw output of 'avahi-browse -p' into a list of unescaped lines """
+    if isinstance(data, str):
+        data = data.encode('utf-8', errors='surrogateescape')
+    return [unescape(line) for line in data.split(b'\n')]
+
+
+def parse_avahi_line(line):
+    """ Turns a line of 'avahi-browse -p -r' output (bytes, or a string) into an AvahiRecord. Returns None for lines that are not a new, resolved or removed service. """
+    if isinstance(line, str):
+        line = line.encode('utf-8', errors='surrogateescape')
+    parts = line.rstrip(b'\r\n').split(b';')
+    if len(parts) < 6 or parts[0] not in (b'+', b'=', b'-'):
+        return None
+    parts = [unescape(part) for part in parts]
+    hostname = address = port = txt = None
+    if parts[0] == '=' and len(parts) >= 9:
+        hostname = parts[6]
+        address = parts[7]
+        port = parts[8]
+        txt = ';'.join(parts[9:]) # the TXT data may contain escaped semicolons, which are unescaped by now
+    return AvahiRecord(parts[0], parts[1], parts[2], parts[3], parts[4], parts[5], hostname, address, port, txt, ';'.join(parts))
+
+
+class AvahiBrowser:
+    """ Runs 'avahi-browse' without -t, so it keeps reporting services as they come and go. Keeps a table of all the services that are currently resolved.
+    callback -- optional function that is called with (record, previous record) for every resolved or removed service. For a removed service, the previous record is the one that was resolved before.
+    source -- optional iterable of output lines to replay instead of starting avahi-browse """
+
+    def __init__(self, callback=None, source=None, debug=False):
+        self.DEBUG = debug
+        self.callback = callback
+        self.source = source
+        self.lock = threading.Lock()
+        self.services = {} # (interface, protocol, name, service type, domain) -> resolved AvahiRecord
+        self.process = None
+        self.thread = None
+        self.running = False
+        self.started = None
+        self.restarts = 0
+
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.started = time.time()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+
+    def run(self):
+        """ Reads the output of avahi-browse. If the process stops (e.g. because the avahi daemon restarted), it is started again. """
+        if self.source != None:
+            for line in self.source:
+                if not self.running:
+                    break
+                self.handle_line(line)
+            return
+
+        delay = 1
+        while self.running:
+            try:
+                self.process = subprocess.Popen(BROWSE_COMMAND, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+                for raw_line in self.process.stdout:
+                    if not self.running:
+                        break
+                    self.handle_line(raw_line) # unescaped and decoded by parse_avahi_line
+                    delay = 1
+                self.process.wait()
+            except Exception as ex:
+                if self.DEBUG:
+                    print("avahi browser: error: " + str(ex))
+            if not self.running:
+                break
+            # avahi-browse stopped by itself. The services it reported can no longer be trusted.
+            with self.lock:
+                self.services = {}
+            self.restarts += 1
+            if self.DEBUG:
+                print("avahi browser: avahi-browse stopped, restarting it in " + str(delay) + " seconds")
+            time.sleep(delay)
+            delay = min(delay * 2, 60)
+
+
+    def handle_line(self, line):
+        record = parse_avahi_line(line)
+        if record == None or record.event == '+':
+            return
+        key = (record.interface, record.protocol, record.name, record.service_type, record.domain)
+        with self.lock:
+            previous = self.services.get(key)
+            if record.event == '=':
+                self.services[key] = record
+            else:
+                self.services.pop(key, None)
+        if record.event == '-' and previous == None:
+            return
+        if self.callback != None:
+            try:
+                self.callback(record, previous)
+            except Exception as ex:
+                if self.DEBUG:
+                    print("avahi browser: callback error: " + str(ex))
+
+
+    def snapshot(self):
+        """ Returns a list of all the services that are currently resolved """
+        with self.lock:
+            return list(self.services.values())
+
+
+    def lines(self):
+        """ Returns the resolved services as unescaped avahi-browse lines, like 'avahi-browse -p -r -t' would have printed them """
+        return [record.line for record in self.snapshot()]
+
+
+    def is_warmed_up(self, warmup=5):
+        """ Right after starting, avahi-browse has not reported all the services yet """
+        return self.running and self.started != None and time.time() - self.started > warmup
+
+
+    def stop(self):
+        self.running = False
+        if self.process != None:
+            try:
+                self.process.terminate()
+            except Exception:
+                pass
+
@@ -0,0 +1,99 @@
+"""Deadline scheduler. Keeps a priority queue of things that need to happen at a certain time, so the clock thread can sleep until the earliest one."""
+
+import time
+import heapq
+import threading
+
+
+
+class DeadlineScheduler:
+    """ A heap of (time, key, kind) deadlines. Every key can have one deadline of each kind, e.g. ('presence-aa-bb', 'probe').
+    Scheduling a deadline again replaces the old one. Replaced deadlines stay in the heap until they are popped, and are then ignored. """
+
+    def __init__(self, debug=False):
+        self.DEBUG = debug
+        self.condition = threading.Condition()
+        self.heap = []
+        self.entries = {}   # (key, kind) -> (time, sequence) of the deadline that is still valid
+        self.sequence = 0
+
+
+    def schedule(self, key, kind, when):
+        """ Sets the deadline of a key and kind. Wakes up wait() if this is now the earliest deadline. """
+        with self.condition:
+            self.sequence += 1
+            self.entries[(key, kind)] = (when, self.sequence)
+            heapq.heappush(self.heap, (when, self.sequence, key, kind))
+            if len(self.heap) > 2 * len(self.entries) + 64:
+                self._compact()
+            if self.heap[0][1] == self.sequence:
+                self.condition.notify_all()
+
+
+    def cancel(self, key, kind=None):
+        """ Removes the deadline of a key and kind, or all the deadlines of the key if no kind is given """
+        with self.condition:
+            if kind != None:
+                self.entries.pop((key, kind), None)
+            else:
+                for entry in [entry for entry in self.entries if entry[0] == key]:
+                    del self.entries[entry]
+
+
+    def deadline(self, key, kind):
+        """ Returns the time of a deadline, or None """
+        with self.condition:
+            current = self.entries.get((key, kind))
+            if current == None:
+                return None
+            return current[0]
+
+
+    def pop_due(self, now=None):
+        """ Removes and returns all the (key, kind) tuples whose deadline has passed, earliest first """
+        if now == None:
+            now = time.time()
+        due = []
+        with self.condition:
+            while len(self.heap) > 0 and self.heap[0][0] <= now:
+                when, sequence, key, kind = heapq.heappop(self.heap)
+                if self.entries.get((key, kind)) == (when, sequence):
+                    del self.entries[(key, kind)]
+                    due.append((key, kind))
+        return due
+
+
+    def wait(self, max_wait=None):
+        """ Sleeps until the earliest deadline, until an earlier deadline is scheduled, or until wake() is called """
+        with self.condition:
+            self._drop_stale()
+            timeout = max_wait
+            if len(self.heap) > 0:
+                timeout = self.heap[0][0] - time.time()
+                if max_wait != None:
+                    timeout = min(timeout, max_wait)
+                if timeout <= 0:
+                    return
+            self.condition.wait(timeout)
+
+
+    def wake(self):
+        with self.condition:
+            self.condition.notify_all()
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    def _drop_stale(self):
+        while len(self.heap) > 0:
+            when, sequence, key, kind = self.heap[0]
+            if self.entries.get((key, kind)) == (when, sequence):
+                return
+            heapq.heappop(self.heap)
+
+
+    def _compact(self):
+        self.heap = [(when, sequence, key, kind) for (key, kind), (when, sequence) in self.entries.items()]
+        heapq.heapify(self.heap)
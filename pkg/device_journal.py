@@ -0,0 +1,160 @@
+"""Device journal. Stores the found devices as a snapshot plus an append-only journal of changes, so a save only writes the devices that changed."""
+
+import os
+import json
+import hashlib
+import threading
+
+
+
+def device_hash(device):
+    """ A short hash of the JSON of a device, to find out if it changed since the last save """
+    return hashlib.blake2b(json.dumps(device, sort_keys=True).encode('utf-8'), digest_size=16).digest()
+
+
+
+class DeviceJournal:
+    """ The snapshot is the persistence.json file, in the same format as before. Changes since the snapshot are appended to persistence.json.journal, one JSON line per changed or removed device.
+    When the journal gets long, it is compacted: a new snapshot is written to a temporary file and renamed over the old one, so a crash never leaves a truncated file behind. """
+
+    def __init__(self, path, compact_after=500, debug=False):
+        self.DEBUG = debug
+        self.path = path
+        self.journal_path = path + '.journal'
+        self.compact_after = compact_after # How many journal records are allowed before the snapshot is rewritten
+        self.lock = threading.Lock()
+        self.hashes = {} # device id -> hash of the device as it was last written
+        self.journal_records = 0
+        self.generation = 0 # goes up with every new snapshot. The journal starts with the generation of the snapshot it belongs to.
+        self.incomplete_line = False # a crash cut off the last line of the journal
+        self.needs_snapshot = True # the journal can only be used once there is a snapshot with devices to apply it to
+
+        self.saves = 0
+        self.skipped = 0
+        self.records_written = 0
+        self.compactions = 0
+
+
+    def load(self):
+        """ Reads the snapshot and replays the journal on top of it. Returns the snapshot data, which has the devices under 'devices'.
+        Raises IOError or ValueError if there is no usable snapshot. """
+        with self.lock:
+            with open(self.path) as file:
+                data = json.load(file)
+            devices = data['devices'] if 'devices' in data else None
+            self.generation = data.get('journal_generation', 0)
+
+            self.journal_records = 0
+            self.needs_snapshot = devices == None
+            if devices != None:
+                try:
+                    with open(self.journal_path) as file:
+                        for line in file:
+                            try:
+                                record = json.loads(line)
+                            except ValueError:
+                                # the last line may have been cut off by a crash
+                                if self.DEBUG:
+                                    print("device journal: skipping an incomplete record")
+                                self.incomplete_line = not line.endswith('\n')
+                                continue
+                            if 'generation' in record:
+                                if record['generation'] != self.generation:
+                                    # The add-on stopped after writing a new snapshot, but before emptying the journal. The snapshot already has these changes.
+                                    if self.DEBUG:
+                                        print("device journal: ignoring the journal of an older snapshot")
+                                    break
+                                continue
+                            if 'set' in record:
+                                devices[record['set']] = record['device']
+                            elif 'delete' in record:
+                                devices.pop(record['delete'], None)
+                            self.journal_records += 1
+                except IOError:
+                    pass
+                self.hashes = {_id: device_hash(devices[_id]) for _id in devices}
+            if self.DEBUG:
+                print("device journal: loaded the snapshot and " + str(self.journal_records) + " journal records")
+            return data
+
+
+    def save(self, devices, metadata=None):
+        """ Appends the devices that changed since the last save to the journal. Nothing is written if nothing changed.
+        Returns how many records were written. """
+        with self.lock:
+            devices = dict(devices)
+            hashes = {}
+            records = []
+            for _id in devices:
+                hashes[_id] = device_hash(devices[_id])
+                if self.hashes.get(_id) != hashes[_id]:
+                    records.append({'set':_id, 'device':devices[_id]})
+            for _id in self.hashes:
+                if _id not in devices:
+                    records.append({'delete':_id})
+
+            self.saves += 1
+            if len(records) == 0:
+                self.skipped += 1
+                return 0
+
+            if self.needs_snapshot or not os.path.isfile(self.path) or self.journal_records + len(records) > self.compact_after:
+                self.write_snapshot(devices, metadata)
+            else:
+                with open(self.journal_path, 'a') as file:
+                    if file.tell() == 0:
+                        file.write(json.dumps({'generation':self.generation}) + '\n')
+                    elif self.incomplete_line:
+                        file.write('\n')
+                    self.incomplete_line = False
+                    for record in records:
+                        file.write(json.dumps(record) + '\n')
+                    file.flush()
+                    os.fsync(file.fileno())
+                self.journal_records += len(records)
+            self.hashes = hashes
+            self.records_written += len(records)
+            if self.DEBUG:
+                print("device journal: saved " + str(len(records)) + " changed devices")
+            return len(records)
+
+
+    def compact(self, devices, metadata=None):
+        """ Writes a fresh snapshot and empties the journal """
+        with self.lock:
+            devices = dict(devices)
+            self.write_snapshot(devices, metadata)
+            self.hashes = {_id: device_hash(devices[_id]) for _id in devices}
+
+
+    def write_snapshot(self, devices, metadata):
+        self.generation += 1
+        data = dict(metadata or {})
+        data['journal_generation'] = self.generation
+        data['devices'] = devices
+        temporary_path = self.path + '.tmp'
+        with open(temporary_path, 'w') as file:
+            json.dump(data, file, indent=4)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, self.path)
+        with open(self.journal_path, 'w') as file:
+            file.write(json.dumps({'generation':self.generation}) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+        self.journal_records = 0
+        self.incomplete_line = False
+        self.needs_snapshot = False
+        self.compactions += 1
+        if self.DEBUG:
+            print("device journal: wrote a new snapshot with " + str(len(devices)) + " devices")
+
+
+    def statistics(self):
+        with self.lock:
+            return {'saves':self.saves,
+                    'skipped':self.skipped,
+                    'records_written':self.records_written,
+                    'journal_records':self.journal_records,
+                    'compactions':self.compactions
+                    }
@@ -0,0 +1,159 @@
+"""Device store. Keeps the found devices in an SQLite database instead of the json file. Can be used in place of the device journal."""
+
+import os
+import json
+import sqlite3
+import threading
+
+from .device_journal import DeviceJournal, device_hash
+
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS devices (
+        id TEXT PRIMARY KEY,
+        mac TEXT,
+        ip TEXT,
+        name TEXT,
+        first_seen INTEGER,
+        last_seen INTEGER,
+        thing INTEGER,
+        candle INTEGER,
+        randomized INTEGER,
+        data TEXT NOT NULL
+    )""",
+    "CREATE INDEX IF NOT EXISTS devices_mac ON devices (mac)",
+    "CREATE INDEX IF NOT EXISTS devices_ip ON devices (ip)",
+    "CREATE INDEX IF NOT EXISTS devices_name ON devices (name)",
+    "CREATE INDEX IF NOT EXISTS devices_first_seen ON devices (first_seen)",
+    "CREATE INDEX IF NOT EXISTS devices_last_seen ON devices (last_seen)",
+    "CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, value TEXT)",
+]
+
+UPSERT = """INSERT INTO devices (id, mac, ip, name, first_seen, last_seen, thing, candle, randomized, data) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET mac=excluded.mac, ip=excluded.ip, name=excluded.name, first_seen=excluded.first_seen, last_seen=excluded.last_seen,
+            thing=excluded.thing, candle=excluded.candle, randomized=excluded.randomized, data=excluded.data"""
+
+
+
+def device_row(_id, device):
+    """ The indexed columns, plus the whole device as json so fields without a column are kept too """
+    mac_address = device.get('mac_address')
+    if mac_address != None:
+        mac_address = str(mac_address).lower()
+    return (_id,
+            mac_address,
+            device.get('ip'),
+            device.get('name'),
+            device.get('first_seen'),
+            device.get('last_seen') or device.get('last_active'),
+            1 if device.get('thing') else 0,
+            1 if device.get('candle') else 0,
+            1 if device.get('randomized') else 0,
+            json.dumps(device))
+
+
+
+class SqliteDeviceStore:
+    """ One connection, owned by the adapter, in WAL mode. A save writes the devices that changed since the last save in a single transaction.
+    On first start, the devices from persistence.json (and its journal) are copied into the database. """
+
+    def __init__(self, path, migrate_from=None, debug=False):
+        self.DEBUG = debug
+        self.path = path
+        self.migrate_from = migrate_from
+        self.lock = threading.Lock()
+        self.hashes = {} # device id -> hash of the device as it was last written
+
+        self.connection = sqlite3.connect(path, check_same_thread=False) # the clock thread and the property handlers both save
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+
+        self.saves = 0
+        self.skipped = 0
+        self.rows_written = 0
+
+
+    def load(self):
+        """ Returns the stored data in the same shape as persistence.json: the metadata, with the devices under 'devices' """
+        with self.lock:
+            data = {key: json.loads(value) for key, value in self.connection.execute("SELECT key, value FROM metadata")}
+            if 'migrated' not in data:
+                data = self.migrate(data)
+            devices = {}
+            for _id, device_json in self.connection.execute("SELECT id, data FROM devices"):
+                try:
+                    devices[_id] = json.loads(device_json)
+                except ValueError:
+                    if self.DEBUG:
+                        print("device store: skipping a device that could not be read: " + str(_id))
+            data.pop('migrated', None)
+            data['devices'] = devices
+            self.hashes = {_id: device_hash(devices[_id]) for _id in devices}
+            if self.DEBUG:
+                print("device store: loaded " + str(len(devices)) + " devices")
+            return data
+
+
+    def migrate(self, data):
+        """ Copies persistence.json into the database, once. The json file is left as it was. """
+        migrated = {}
+        if self.migrate_from != None and os.path.isfile(self.migrate_from):
+            try:
+                migrated = DeviceJournal(self.migrate_from).load()
+            except Exception as ex:
+                print("device store: could not read " + str(self.migrate_from) + ", starting with an empty database: " + str(ex))
+        if 'mayor_version' not in migrated:
+            migrated = {} # version 1.0 data is not compatible
+        devices = migrated.pop('devices', {})
+        with self.connection:
+            self.connection.executemany(UPSERT, [device_row(_id, devices[_id]) for _id in devices])
+            migrated['migrated'] = True
+            self.connection.executemany("INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)", [(key, json.dumps(migrated[key])) for key in migrated])
+        print("device store: copied " + str(len(devices)) + " devices from the json file into the database")
+        return migrated
+
+
+    def save(self, devices, metadata=None):
+        """ Writes the devices that changed since the last save, and removes the ones that are gone, in one transaction. Returns how many rows changed. """
+        with self.lock:
+            devices = dict(devices)
+            hashes = {}
+            changed = []
+            for _id in devices:
+                hashes[_id] = device_hash(devices[_id])
+                if self.hashes.get(_id) != hashes[_id]:
+                    changed.append(device_row(_id, devices[_id]))
+            removed = [(_id,) for _id in self.hashes if _id not in devices]
+
+            self.saves += 1
+            if len(changed) == 0 and len(removed) == 0:
+                self.skipped += 1
+                return 0
+
+            with self.connection:
+                self.connection.executemany(UPSERT, changed)
+                self.connection.executemany("DELETE FROM devices WHERE id = ?", removed)
+                if metadata != None:
+                    self.connection.executemany("INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)", [(key, json.dumps(metadata[key])) for key in metadata])
+            self.hashes = hashes
+            self.rows_written += len(changed) + len(removed)
+            if self.DEBUG:
+                print("device store: saved " + str(len(changed)) + " changed and " + str(len(removed)) + " removed devices")
+            return len(changed) + len(removed)
+
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+    def statistics(self):
+        with self.lock:
+            return {'saves':self.saves,
+                    'skipped':self.skipped,
+                    'rows_written':self.rows_written,
+                    'devices':len(self.hashes)
+                    }
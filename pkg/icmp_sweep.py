@@ -0,0 +1,163 @@
+"""ICMP echo sweeper. Pings many addresses from a single socket instead of forking ping for each one."""
+
+import os
+import time
+import random
+import select
+import socket
+import struct
+
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+
+SO_BINDTODEVICE = getattr(socket, 'SO_BINDTODEVICE', 25)
+
+
+
+def icmp_checksum(data):
+    """ Internet checksum (RFC 1071) of a bytes object """
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack('!%dH' % (len(data) // 2), data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def build_echo_request(identifier, sequence, payload=b''):
+    """ Returns an ICMP echo request packet (without IP header) """
+    header = struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, 0, identifier & 0xffff, sequence & 0xffff)
+    checksum = icmp_checksum(header + payload)
+    return struct.pack('!BBHHH', ICMP_ECHO_REQUEST, 0, checksum, identifier & 0xffff, sequence & 0xffff) + payload
+
+
+def parse_echo_reply(data, has_ip_header=False):
+    """ Returns (identifier, sequence) if the data is an echo reply, otherwise None """
+    try:
+        if has_ip_header:
+            header_length = (data[0] & 0x0f) * 4
+            data = data[header_length:]
+        if len(data) < 8:
+            return None
+        icmp_type, code, checksum, identifier, sequence = struct.unpack('!BBHHH', data[:8])
+        if icmp_type != ICMP_ECHO_REPLY:
+            return None
+        return identifier, sequence
+    except Exception:
+        return None
+
+
+
+class IcmpSweeper:
+    """ Sends echo requests to a list of addresses and collects the replies on one socket """
+
+    def __init__(self, interface=None, debug=False):
+        self.interface = interface
+        self.DEBUG = debug
+        self.available = None # None means: not tested yet
+        self.raw = False
+
+    def open_socket(self):
+        """ Datagram ICMP is preferred (allowed through net.ipv4.ping_group_range), raw sockets need root or CAP_NET_RAW """
+        sock = None
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+            self.raw = False
+        except OSError:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+            self.raw = True
+
+        if self.interface:
+            try:
+                sock.setsockopt(socket.SOL_SOCKET, SO_BINDTODEVICE, str(self.interface).encode() + b'\x00')
+            except OSError as ex:
+                if self.DEBUG:
+                    print("icmp sweep: could not bind to interface " + str(self.interface) + ": " + str(ex))
+        sock.setblocking(False)
+        return sock
+
+
+    def is_available(self):
+        """ Checks once if an ICMP socket can be created """
+        if self.available is None:
+            try:
+                sock = self.open_socket()
+                sock.close()
+                self.available = True
+            except Exception as ex:
+                if self.DEBUG:
+                    print("icmp sweep: no ICMP socket available, will fall back to ping: " + str(ex))
+                self.available = False
+        return self.available
+
+
+    def sweep(self, addresses, timeout=1.0, pace=None):
+        """ Pings all addresses and returns the set of addresses that replied within the timeout.
+        pace -- optional function that is called before every packet is sent, and can block to limit the send rate """
+        alive = set()
+        addresses = [str(a) for a in addresses]
+        if len(addresses) == 0:
+            return alive
+
+        sock = self.open_socket()
+        try:
+            identifier = random.randint(1, 0xffff)
+            if not self.raw:
+                # For datagram ICMP sockets the kernel replaces the identifier with the local port.
+                sock.bind(('', 0))
+                identifier = sock.getsockname()[1]
+
+            payload = struct.pack('!d', time.time()) + os.urandom(8)
+            pending = {}
+            deadline = time.time() + timeout
+
+            for index, address in enumerate(addresses):
+                sequence = index & 0xffff
+                pending[sequence] = address
+                if pace != None:
+                    pace()
+                try:
+                    sock.sendto(build_echo_request(identifier, sequence, payload), (address, 0))
+                except OSError as ex:
+                    if self.DEBUG:
+                        print("icmp sweep: send to " + str(address) + " failed: " + str(ex))
+                    pending.pop(sequence, None)
+                # read replies while still sending, so the receive buffer does not overflow on large sweeps
+                self._receive(sock, identifier, pending, alive, 0)
+
+            # a slow sender should still get a full timeout period after the last packet
+            deadline = max(deadline, time.time() + min(timeout, 1.0))
+            while len(pending) > 0:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._receive(sock, identifier, pending, alive, remaining)
+        finally:
+            sock.close()
+
+        if self.DEBUG:
+            print("icmp sweep: " + str(len(alive)) + " of " + str(len(addresses)) + " addresses replied")
+        return alive
+
+
+    def _receive(self, sock, identifier, pending, alive, wait):
+        """ Reads all replies that are available (or arrive within the wait period) """
+        readable, _, _ = select.select([sock], [], [], wait)
+        while readable:
+            try:
+                data, source = sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            reply = self.parse(data)
+            if reply != None:
+                reply_identifier, sequence = reply
+                if (self.raw == False or reply_identifier == identifier) and pending.get(sequence) == source[0]:
+                    alive.add(pending.pop(sequence))
+            readable, _, _ = select.select([sock], [], [], 0)
+
+
+    def parse(self, data):
+        return parse_echo_reply(data, has_ip_header=self.raw)
@@ -0,0 +1,246 @@
+"""Identity merger. Phones and laptops use randomized (locally administered) mac addresses that change from time to time. This keeps those changes from turning one device into many."""
+
+import re
+import time
+
+from .util import mac_to_id
+
+
+# Default hostnames that many unrelated devices share. A match on one of these says nothing about whether two addresses belong to the same device.
+GENERIC_HOSTNAMES = set([
+    'android', 'iphone', 'ipad', 'ipod', 'watch', 'applewatch', 'macbook', 'macbookpro', 'macbookair', 'imac',
+    'galaxy', 'pixel', 'samsung', 'xiaomi', 'redmi', 'huawei', 'oneplus', 'oppo', 'phone', 'tablet',
+    'localhost', 'espressif', 'esp32', 'esp8266', 'raspberrypi', 'ubuntu', 'debian', 'linux', 'windows',
+    'desktop', 'laptop', 'pc', 'chromecast', 'googlehome', 'amazon', 'echo', 'kindle',
+    'unknown', 'unnamed', 'none', 'host', 'device',
+])
+
+
+
+def is_locally_administered(mac_address):
+    """ The second bit of the first byte is set for addresses that were not assigned by a manufacturer """
+    try:
+        return int(str(mac_address).replace('-', ':').split(':')[0], 16) & 0x02 == 0x02
+    except ValueError:
+        return False
+
+
+def is_randomized(mac_address):
+    """ A locally administered unicast address, like the private Wi-Fi addresses of iOS, Android and Windows """
+    try:
+        first_byte = int(str(mac_address).replace('-', ':').split(':')[0], 16)
+    except ValueError:
+        return False
+    return first_byte & 0x02 == 0x02 and first_byte & 0x01 == 0
+
+
+def normalize_hostname(hostname):
+    """ 'Johns-iPhone.local' -> 'johns-iphone' """
+    if hostname == None:
+        return None
+    return str(hostname).strip().lower().split('.')[0]
+
+
+def is_generic_hostname(hostname):
+    """ True for names like 'iPhone', 'android', 'MacBook-Pro' or 'iPhone-2'. The number is what mDNS adds to resolve a name conflict. """
+    name = re.sub(r'[^a-z0-9]', '', normalize_hostname(hostname) or '')
+    return name == '' or name in GENERIC_HOSTNAMES or re.sub(r'[0-9]+$', '', name) in GENERIC_HOSTNAMES
+
+
+class IdentityMerger:
+    """ Links randomized mac addresses to an existing device in previously_found.
+    A new randomized address belongs to an existing device if it has the same hostname (from avahi, DHCP, NetBIOS, etc), and something else points the same way:
+    it got the same IP address, it sent the same DHCP client id or vendor class, or the old address recently went silent. Generic hostnames like 'iPhone' don't count as a match.
+    Without a hostname, an address that got the IP address of a randomized device that recently disappeared is also linked to it (DHCP lease continuity).
+    A guest can get the same IP address though, so a device the user accepted as a thing also needs the same DHCP client id or vendor class for that.
+    The old addresses of a device are kept in its 'mac_aliases' list, so the link survives a restart.
+    Randomized devices that the user did not accept as things are removed quickly once they are gone. """
+
+    def __init__(self, active_window=300, lease_window=86400, short_lived_span=3600, short_lived_max_age=21600, max_age=604800, max_aliases=32, debug=False):
+        self.DEBUG = debug
+        self.active_window = active_window             # A device seen this recently is still around, so another address can't be its new one
+        self.lease_window = lease_window               # How long an IP address is assumed to stay reserved for a device that left
+        self.short_lived_span = short_lived_span       # Devices that were only around for less than this...
+        self.short_lived_max_age = short_lived_max_age # ...are forgotten after being gone for this long
+        self.max_age = max_age                         # Other randomized devices are forgotten after being gone for this long
+        self.max_aliases = max_aliases
+        self.aliases = {} # id of an old address -> id of the device it belongs to
+
+        self.merged = 0
+        self.aged_out = 0
+
+
+    def load(self, previously_found):
+        """ Rebuilds the alias table from the 'mac_aliases' of the devices """
+        self.aliases = {}
+        for _id in previously_found:
+            for mac_address in previously_found[_id].get('mac_aliases', []):
+                self.aliases[mac_to_id(mac_address)] = _id
+
+
+    def resolve(self, _id):
+        """ Returns the id of the device that an address id belongs to """
+        return self.aliases.get(_id, _id)
+
+
+    def last_active(self, device):
+        if device.get('last_seen'):
+            return device['last_seen']
+        return device.get('last_active') or device.get('first_seen') or 0
+
+
+    def is_active(self, device, now):
+        return bool(device.get('last_seen')) and now - device['last_seen'] < self.active_window
+
+
+    def dhcp_matches(self, device, dhcp):
+        """ True if the device sent the same DHCP client id or vendor class. dhcp is a dictionary with 'client_id' and 'vendor_class'. """
+        if dhcp == None:
+            return False
+        for key in ('client_id', 'vendor_class'):
+            if dhcp.get(key) and device.get('dhcp_' + key) == dhcp[key]:
+                return True
+        return False
+
+
+    def find_identity(self, previously_found, mac_address, ip_address=None, hostname=None, now=None, dhcp=None, protected=None):
+        """ Returns the id of the existing device that a new randomized mac address most likely belongs to, or None
+        dhcp -- optional dictionary with the 'client_id' and 'vendor_class' that the new address sent in its DHCP request
+        protected -- optional ids of the devices the user accepted as things. The same lease alone is not enough to link an address to one of them. """
+        if not is_randomized(mac_address):
+            return None
+        if now == None:
+            now = time.time()
+        new_id = mac_to_id(mac_address)
+        hostname = None if is_generic_hostname(hostname) else normalize_hostname(hostname) # a generic hostname is as good as none
+
+        by_hostname = None
+        by_lease = None
+        for _id in previously_found:
+            device = previously_found[_id]
+            if _id == new_id or not device.get('randomized'):
+                continue
+            same_ip = ip_address != None and device.get('ip') == ip_address
+            silent = not self.is_active(device, now)
+            if not silent and not same_ip:
+                continue # both addresses are around at the same time, so they are different devices
+            device_hostname = None if is_generic_hostname(device.get('hostname')) else normalize_hostname(device.get('hostname'))
+            recent = now - self.last_active(device) < self.lease_window
+            leased = same_ip and recent
+
+            if hostname != None and device_hostname == hostname:
+                # the hostname alone is not enough, something else has to point to the same device: the same lease, the same DHCP identity, or the old address went silent recently, as it does when a device picks a new address
+                if not (leased or self.dhcp_matches(device, dhcp) or (silent and recent)):
+                    continue
+                if by_hostname == None or self.last_active(device) > self.last_active(previously_found[by_hostname]):
+                    by_hostname = _id
+            elif leased and (hostname == None or device_hostname == None):
+                if protected != None and _id in protected and not self.dhcp_matches(device, dhcp):
+                    continue # could be a guest that got the same address, which would make the thing look present
+                if by_lease == None or self.last_active(device) > self.last_active(previously_found[by_lease]):
+                    by_lease = _id
+
+        if by_hostname != None:
+            return by_hostname
+        return by_lease
+
+
+    def merge(self, previously_found, _id, mac_address):
+        """ Makes a new mac address the current address of an existing device """
+        device = previously_found[_id]
+        aliases = device.setdefault('mac_aliases', [])
+        old_mac_address = device.get('mac_address')
+        if old_mac_address != None and old_mac_address != mac_address and old_mac_address not in aliases:
+            aliases.append(old_mac_address)
+        if mac_address in aliases:
+            aliases.remove(mac_address)
+        device['mac_address'] = mac_address
+        self.aliases[mac_to_id(mac_address)] = _id
+        self.aliases.pop(_id, None)
+        while len(aliases) > self.max_aliases:
+            self.aliases.pop(mac_to_id(aliases.pop(0)), None)
+        self.merged += 1
+        if self.DEBUG:
+            print("identity merger: " + str(mac_address) + " is the new address of " + str(device.get('name')))
+
+
+    def absorb(self, previously_found, _id, other_id):
+        """ Moves the addresses of a duplicate device into a device, and removes the duplicate """
+        device = previously_found[_id]
+        other = previously_found.pop(other_id)
+        aliases = device.setdefault('mac_aliases', [])
+        for mac_address in other.get('mac_aliases', []) + [other.get('mac_address')]:
+            if mac_address != None and mac_address != device.get('mac_address') and mac_address not in aliases:
+                aliases.append(mac_address)
+            if mac_address != None:
+                self.aliases[mac_to_id(mac_address)] = _id
+        for alias_id in [alias_id for alias_id in self.aliases if self.aliases[alias_id] == other_id]:
+            self.aliases[alias_id] = _id
+        if other.get('first_seen') and (not device.get('first_seen') or other['first_seen'] < device['first_seen']):
+            device['first_seen'] = other['first_seen']
+        while len(aliases) > self.max_aliases:
+            self.aliases.pop(mac_to_id(aliases.pop(0)), None)
+        self.merged += 1
+        if self.DEBUG:
+            print("identity merger: merged " + str(other.get('name')) + " into " + str(device.get('name')))
+
+
+    def merge_duplicates(self, previously_found, protected, now=None):
+        """ Merges randomized devices that share a hostname that isn't generic, once all but one of them went silent. Devices the user accepted as things are never merged into each other.
+        Returns the ids that were removed. """
+        if now == None:
+            now = time.time()
+        groups = {}
+        for _id in previously_found:
+            device = previously_found[_id]
+            if device.get('randomized') and device.get('hostname') and not is_generic_hostname(device['hostname']):
+                groups.setdefault(normalize_hostname(device['hostname']), []).append(_id)
+
+        removed = []
+        for ids in groups.values():
+            if len(ids) < 2:
+                continue
+            # The device to keep is a thing if there is one, otherwise the one that was seen most recently
+            ids.sort(key=lambda _id: (_id in protected, self.last_active(previously_found[_id])), reverse=True)
+            keep = ids[0]
+            for other_id in ids[1:]:
+                if other_id in protected or self.is_active(previously_found[other_id], now):
+                    continue
+                self.absorb(previously_found, keep, other_id)
+                removed.append(other_id)
+        return removed
+
+
+    def age_out(self, previously_found, protected, now=None):
+        """ Removes randomized devices that are not things and have been gone for a while. Returns the ids that were removed. """
+        if now == None:
+            now = time.time()
+        removed = []
+        for _id in list(previously_found.keys()):
+            device = previously_found[_id]
+            if not device.get('randomized'):
+                continue
+            if device.get('last_seen'):
+                device['last_active'] = device['last_seen'] # last_seen is cleared at startup, this is kept
+            if _id in protected:
+                continue
+            last_active = self.last_active(device)
+            lifespan = last_active - (device.get('first_seen') or last_active)
+            max_age = self.short_lived_max_age if lifespan < self.short_lived_span else self.max_age
+            if now - last_active > max_age:
+                del previously_found[_id]
+                removed.append(_id)
+                self.aged_out += 1
+        if len(removed) > 0:
+            for alias_id in [alias_id for alias_id in self.aliases if self.aliases[alias_id] in removed]:
+                del self.aliases[alias_id]
+            if self.DEBUG:
+                print("identity merger: forgot " + str(len(removed)) + " randomized devices that are gone")
+        return removed
+
+
+    def statistics(self):
+        return {'aliases':len(self.aliases),
+                'merged':self.merged,
+                'aged_out':self.aged_out
+                }
@@ -0,0 +1,100 @@
+"""Liveness cache. Remembers which devices recently proved they are present, so that they are not probed again and again by the different scans."""
+
+import time
+import threading
+from collections import namedtuple
+
+
+Liveness = namedtuple('Liveness', ['time', 'source'])
+
+
+
+class LivenessCache:
+    """ Keeps the time and source (ping, arping, neighbor, passive, etc) of the most recent sign of life of every IP address and mac address.
+    Entries are valid for `ttl` seconds. """
+
+    def __init__(self, ttl=60, debug=False):
+        self.DEBUG = debug
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.by_ip = {}
+        self.by_mac = {}
+        self.ip_of_mac = {}
+
+        self.hits = 0
+        self.misses = 0
+
+
+    def record(self, ip_address=None, mac_address=None, source='ping', when=None):
+        """ Remembers that a device responded or was seen """
+        if when == None:
+            when = time.time()
+        entry = Liveness(when, source)
+        with self.lock:
+            if ip_address != None:
+                ip_address = str(ip_address)
+                if ip_address not in self.by_ip or self.by_ip[ip_address].time <= when:
+                    self.by_ip[ip_address] = entry
+            if mac_address != None:
+                mac_address = str(mac_address).lower()
+                if mac_address not in self.by_mac or self.by_mac[mac_address].time <= when:
+                    self.by_mac[mac_address] = entry
+                    if ip_address != None:
+                        self.ip_of_mac[mac_address] = ip_address
+
+
+    def lookup(self, ip_address=None, mac_address=None, now=None):
+        """ Returns the most recent Liveness of the IP or mac address if it is still valid, otherwise None. Counts as a hit or a miss. """
+        if now == None:
+            now = time.time()
+        found = None
+        with self.lock:
+            if ip_address != None:
+                entry = self.by_ip.get(str(ip_address))
+                if entry != None and now - entry.time < self.ttl:
+                    found = entry
+            if found == None and mac_address != None:
+                mac_address = str(mac_address).lower()
+                entry = self.by_mac.get(mac_address)
+                # a mac address only counts if it was seen at the same IP address, since the probe is about that address
+                if entry != None and now - entry.time < self.ttl and (ip_address == None or self.ip_of_mac.get(mac_address) == str(ip_address)):
+                    found = entry
+            if found != None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return found
+
+
+    def is_alive(self, ip_address=None, mac_address=None):
+        return self.lookup(ip_address, mac_address) != None
+
+
+    def recent_addresses(self, now=None):
+        """ Returns the IP addresses that showed a sign of life within the TTL """
+        if now == None:
+            now = time.time()
+        with self.lock:
+            return [ip_address for ip_address in self.by_ip if now - self.by_ip[ip_address].time < self.ttl]
+
+
+    def expire(self, now=None):
+        """ Removes the entries that are no longer valid """
+        if now == None:
+            now = time.time()
+        with self.lock:
+            for table in (self.by_ip, self.by_mac):
+                for key in [key for key in table if now - table[key].time >= self.ttl]:
+                    del table[key]
+            for mac_address in [mac_address for mac_address in self.ip_of_mac if mac_address not in self.by_mac]:
+                del self.ip_of_mac[mac_address]
+
+
+    def statistics(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {'hits':self.hits,
+                    'misses':self.misses,
+                    'hit_rate':(float(self.hits) / total) if total > 0 else None,
+                    'entries':len(self.by_ip)
+                    }
@@ -0,0 +1,136 @@
+"""Name resolver. Keeps the hostnames that the different sources (avahi, DHCP, NetBIOS, etc) reported for each IP address, and picks the best one."""
+
+import time
+import threading
+from collections import namedtuple
+
+
+NameEntry = namedtuple('NameEntry', ['name', 'source', 'time', 'expires'])
+
+# Lower is better. A name that a device announces itself (mDNS, DHCP) is preferred over one that is looked up elsewhere.
+SOURCE_PRIORITY = {
+    'avahi':1,
+    'dhcp':2,
+    'netbios':3,
+    'dns':4,
+    'llmnr':5,
+}
+
+# How many seconds a name stays valid
+SOURCE_TTL = {
+    'avahi':3600,
+    'dhcp':86400,
+    'netbios':21600,
+    'dns':3600,
+    'llmnr':3600,
+}
+
+DEFAULT_TTL = 3600
+
+
+
+def parse_nbtscan_output(text):
+    """ Parses the output of 'nbtscan -q -e', which has lines like '192.168.1.5\\tLAPTOP\\t<server>'. Returns a dictionary of ip -> name. """
+    names = {}
+    for line in str(text).split('\n'):
+        parts = line.rstrip().split('\t')
+        if len(parts) > 1 and parts[1].strip() != '':
+            names[parts[0].strip()] = parts[1].strip()
+    return names
+
+
+
+class NameResolver:
+    """ An index of ip address -> source -> NameEntry. Lookups are a dictionary access, entries expire after the TTL of their source. """
+
+    def __init__(self, priorities=None, ttls=None, debug=False):
+        self.DEBUG = debug
+        self.priorities = dict(SOURCE_PRIORITY)
+        if priorities != None:
+            self.priorities.update(priorities)
+        self.ttls = dict(SOURCE_TTL)
+        if ttls != None:
+            self.ttls.update(ttls)
+        self.lock = threading.Lock()
+        self.entries = {} # ip -> {source: NameEntry}
+
+
+    def set(self, ip_address, name, source, when=None, ttl=None):
+        """ Remembers the name that a source reported for an IP address """
+        if name == None or str(name).strip() == '':
+            return
+        if when == None:
+            when = time.time()
+        if ttl == None:
+            ttl = self.ttls.get(source, DEFAULT_TTL)
+        with self.lock:
+            self.entries.setdefault(str(ip_address), {})[source] = NameEntry(str(name).strip(), source, when, when + ttl)
+
+
+    def set_many(self, names, source, when=None):
+        """ Remembers a dictionary of ip -> name from a single source """
+        for ip_address in names:
+            self.set(ip_address, names[ip_address], source, when)
+
+
+    def remove(self, ip_address, source=None):
+        """ Forgets the name of an IP address from one source, or from all sources """
+        with self.lock:
+            ip_address = str(ip_address)
+            if ip_address not in self.entries:
+                return
+            if source == None:
+                del self.entries[ip_address]
+                return
+            self.entries[ip_address].pop(source, None)
+            if len(self.entries[ip_address]) == 0:
+                del self.entries[ip_address]
+
+
+    def lookup_entry(self, ip_address, now=None):
+        """ Returns the NameEntry with the best priority that has not expired, or None """
+        if now == None:
+            now = time.time()
+        with self.lock:
+            sources = self.entries.get(str(ip_address))
+            if not sources:
+                return None
+            best = None
+            for entry in sources.values():
+                if entry.expires <= now:
+                    continue
+                if best == None or self.priorities.get(entry.source, 100) < self.priorities.get(best.source, 100):
+                    best = entry
+            return best
+
+
+    def lookup(self, ip_address, now=None):
+        """ Returns the best name for an IP address, or None """
+        entry = self.lookup_entry(ip_address, now)
+        if entry == None:
+            return None
+        return entry.name
+
+
+    def expire(self, now=None):
+        """ Removes the names that are no longer valid """
+        if now == None:
+            now = time.time()
+        with self.lock:
+            for ip_address in list(self.entries.keys()):
+                sources = self.entries[ip_address]
+                for source in [source for source in sources if sources[source].expires <= now]:
+                    del sources[source]
+                if len(sources) == 0:
+                    del self.entries[ip_address]
+
+
+    def statistics(self):
+        with self.lock:
+            per_source = {}
+            for sources in self.entries.values():
+                for source in sources:
+                    per_source[source] = per_source.get(source, 0) + 1
+            return {'addresses':len(self.entries),
+                    'sources':per_source
+                    }
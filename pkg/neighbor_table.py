@@ -0,0 +1,278 @@
+"""Neighbor table reader. Gets the kernel's ARP / neighbor table over rtnetlink, or from /proc/net/arp, instead of parsing the output of 'arp' and 'ip neighbor'."""
+
+import os
+import socket
+import struct
+from collections import namedtuple
+
+
+NETLINK_ROUTE = 0
+
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWNEIGH = 28
+RTM_DELNEIGH = 29
+RTM_GETNEIGH = 30
+
+NLM_F_REQUEST = 0x01
+NLM_F_DUMP = 0x300
+
+NDA_DST = 1
+NDA_LLADDR = 2
+
+RTMGRP_NEIGH = 1 << (3 - 1) # multicast group RTNLGRP_NEIGH
+
+NLMSG_HEADER = struct.Struct('=IHHII')   # length, type, flags, sequence, port id
+NDMSG = struct.Struct('=BxxxiHBB')       # family, (padding), ifindex, state, flags, type
+RTATTR_HEADER = struct.Struct('=HH')     # length, type
+
+NUD_STATES = {
+    0x01:'INCOMPLETE',
+    0x02:'REACHABLE',
+    0x04:'STALE',
+    0x08:'DELAY',
+    0x10:'PROBE',
+    0x20:'FAILED',
+    0x40:'NOARP',
+    0x80:'PERMANENT',
+}
+
+# states in which the neighbor was recently heard from, or is still considered to be there
+PRESENT_STATES = ('REACHABLE', 'STALE', 'DELAY', 'PROBE', 'PERMANENT')
+
+
+NeighborEntry = namedtuple('NeighborEntry', ['ip', 'mac', 'interface', 'state'])
+
+
+
+def align(length):
+    return (length + 3) & ~3
+
+
+def state_name(state):
+    return NUD_STATES.get(state, 'NONE')
+
+
+def interface_name(index, cache={}):
+    if index not in cache:
+        try:
+            cache[index] = socket.if_indextoname(index)
+        except OSError:
+            return str(index)
+    return cache[index]
+
+
+def build_dump_request(sequence=1, family=socket.AF_INET):
+    """ Returns the netlink message that asks the kernel for its complete neighbor table """
+    body = NDMSG.pack(family, 0, 0, 0, 0)
+    header = NLMSG_HEADER.pack(NLMSG_HEADER.size + len(body), RTM_GETNEIGH, NLM_F_REQUEST | NLM_F_DUMP, sequence, 0)
+    return header + body
+
+
+def parse_neighbor_message(message_type, payload):
+    """ Turns the payload of a single RTM_NEWNEIGH or RTM_DELNEIGH message into a NeighborEntry. Returns None if it has no address. """
+    if len(payload) < NDMSG.size:
+        return None
+    family, ifindex, state, flags, _ = NDMSG.unpack_from(payload, 0)
+    ip_address = None
+    mac_address = None
+    offset = NDMSG.size
+    while offset + RTATTR_HEADER.size <= len(payload):
+        attribute_length, attribute_type = RTATTR_HEADER.unpack_from(payload, offset)
+        if attribute_length < RTATTR_HEADER.size:
+            break
+        value = payload[offset + RTATTR_HEADER.size:offset + attribute_length]
+        if attribute_type == NDA_DST:
+            try:
+                ip_address = socket.inet_ntop(family, value)
+            except (ValueError, OSError):
+                pass
+        elif attribute_type == NDA_LLADDR and len(value) == 6:
+            mac_address = ':'.join('{:02x}'.format(b) for b in value)
+        offset += align(attribute_length)
+
+    if ip_address == None:
+        return None
+    if message_type == RTM_DELNEIGH:
+        state = 0x20 # a deleted entry is as good as failed
+    return NeighborEntry(ip_address, mac_address, interface_name(ifindex), state_name(state))
+
+
+def parse_neighbor_messages(data):
+    """ Parses a buffer of netlink messages. Returns a list of (message type, NeighborEntry) and whether the end of a dump was reached. """
+    entries = []
+    done = False
+    offset = 0
+    while offset + NLMSG_HEADER.size <= len(data):
+        length, message_type, flags, sequence, port_id = NLMSG_HEADER.unpack_from(data, offset)
+        if length < NLMSG_HEADER.size or offset + length > len(data):
+            break
+        payload = data[offset + NLMSG_HEADER.size:offset + length]
+        if message_type == NLMSG_DONE:
+            done = True
+        elif message_type == NLMSG_ERROR:
+            error = struct.unpack_from('=i', payload, 0)[0] if len(payload) >= 4 else 0
+            if error != 0:
+                raise OSError(-error, os.strerror(-error))
+        elif message_type in (RTM_NEWNEIGH, RTM_DELNEIGH):
+            entry = parse_neighbor_message(message_type, payload)
+            if entry != None:
+                entries.append((message_type, entry))
+        offset += align(length)
+    return entries, done
+
+
+def parse_proc_arp(text):
+    """ Parses the contents of /proc/net/arp """
+    entries = []
+    for line in text.splitlines()[1:]:
+        parts = line.split()
+        if len(parts) < 6:
+            continue
+        ip_address, hardware_type, flags, mac_address, mask, interface = parts[:6]
+        flags = int(flags, 16)
+        if flags & 0x04:
+            state = 'PERMANENT'
+        elif flags & 0x02:
+            state = 'STALE' # /proc/net/arp only knows complete and incomplete entries, so a complete one doesn't prove the device answered recently
+        else:
+            state = 'INCOMPLETE'
+        if mac_address == '00:00:00:00:00:00':
+            mac_address = None
+        entries.append(NeighborEntry(ip_address, mac_address, interface, state))
+    return entries
+
+
+
+class NeighborTable:
+    """ Reads the kernel's neighbor table in one request """
+
+    def __init__(self, debug=False):
+        self.DEBUG = debug
+        self.sequence = 0
+        self.use_netlink = True
+
+
+    def read(self, family=socket.AF_INET, interface=None):
+        """ Returns a list of NeighborEntry objects, optionally only those on one interface """
+        entries = None
+        if self.use_netlink:
+            try:
+                entries = self.read_netlink(family)
+            except Exception as ex:
+                if self.DEBUG:
+                    print("neighbor table: netlink failed, falling back to /proc/net/arp: " + str(ex))
+                self.use_netlink = False
+        if entries == None:
+            if family != socket.AF_INET:
+                return []
+            with open('/proc/net/arp') as f:
+                entries = parse_proc_arp(f.read())
+        if interface != None:
+            entries = [entry for entry in entries if entry.interface == interface]
+        return entries
+
+
+    def read_netlink(self, family=socket.AF_INET):
+        self.sequence += 1
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+        try:
+            sock.settimeout(2)
+            sock.bind((0, 0))
+            sock.send(build_dump_request(self.sequence, family))
+            entries = []
+            done = False
+            while not done:
+                data = sock.recv(65536)
+                if len(data) == 0:
+                    break
+                messages, done = parse_neighbor_messages(data)
+                entries.extend(entry for message_type, entry in messages if message_type == RTM_NEWNEIGH)
+        finally:
+            sock.close()
+        return entries
+
+
+    def lookup(self, ip_address, interface=None):
+        """ Returns the entry for a single IP address, or None """
+        for entry in self.read(interface=interface):
+            if entry.ip == str(ip_address) and entry.mac != None:
+                return entry
+        return None
+
+
+
+class NeighborMonitor:
+    """ Listens to the kernel's neighbor events (an entry became REACHABLE, STALE, FAILED, etc).
+    source -- optional iterable of recorded netlink message buffers. If provided, these are replayed instead of listening to the kernel. """
+
+    def __init__(self, source=None, debug=False):
+        self.DEBUG = debug
+        self.source = source
+        self.sock = None
+        self.running = False
+
+
+    def open(self):
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+        try:
+            sock.bind((0, RTMGRP_NEIGH))
+            sock.settimeout(1) # so that stop() is noticed
+        except Exception:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+    def buffers(self):
+        if self.source != None:
+            for data in self.source:
+                if not self.running:
+                    return
+                yield data
+            return
+
+        if self.sock == None:
+            self.open()
+        while self.running:
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                continue
+            except OSError as ex:
+                if ex.errno == 105: # ENOBUFS: events were lost, but listening can continue
+                    if self.DEBUG:
+                        print("neighbor monitor: receive buffer overflowed, some events were lost")
+                    continue
+                raise
+            yield data
+
+
+    def events(self):
+        """ Generator that yields a NeighborEntry for every change. A deleted entry has the state FAILED. """
+        self.running = True
+        try:
+            for data in self.buffers():
+                try:
+                    messages, _ = parse_neighbor_messages(data)
+                except Exception as ex:
+                    if self.DEBUG:
+                        print("neighbor monitor: could not parse message: " + str(ex))
+                    continue
+                for message_type, entry in messages:
+                    yield entry
+        finally:
+            self.close()
+
+
+    def stop(self):
+        self.running = False
+
+
+    def close(self):
+        if self.sock != None:
+            try:
+                self.sock.close()
+            except Exception:
+                pass
+            self.sock = None
@@ -0,0 +1,275 @@
+"""NetBIOS name service client. Asks many addresses for their NetBIOS names from a single UDP socket, instead of forking nbtscan or nmblookup."""
+
+import time
+import random
+import select
+import socket
+import struct
+from collections import namedtuple
+
+
+NETBIOS_PORT = 137
+
+TYPE_NB = 0x0020
+TYPE_NBSTAT = 0x0021
+CLASS_IN = 0x0001
+
+FLAG_RESPONSE = 0x8000
+FLAG_BROADCAST = 0x0010
+FLAG_RECURSION_DESIRED = 0x0100
+
+NAME_FLAG_GROUP = 0x8000
+
+SUFFIX_WORKSTATION = 0x00
+
+HEADER = struct.Struct('!HHHHHH') # transaction id, flags, questions, answers, authority records, additional records
+
+NodeStatus = namedtuple('NodeStatus', ['ip', 'name', 'group', 'mac', 'names'])
+
+
+
+def encode_name(name, suffix=SUFFIX_WORKSTATION):
+    """ First level encoding (RFC 1001): the name is padded to 15 characters, followed by the suffix byte, and every nibble becomes a letter from A to P """
+    if name == '*':
+        raw = b'*' + b'\x00' * 15
+    else:
+        raw = name.upper().encode('ascii', errors='replace')[:15].ljust(15, b' ') + bytes([suffix])
+    encoded = bytearray()
+    for byte in raw:
+        encoded.append(ord('A') + (byte >> 4))
+        encoded.append(ord('A') + (byte & 0x0f))
+    return bytes([32]) + bytes(encoded) + b'\x00'
+
+
+def build_node_status_request(transaction_id):
+    """ Returns a node status (NBSTAT) request, which asks a host for all of its names """
+    return HEADER.pack(transaction_id & 0xffff, 0, 1, 0, 0, 0) + encode_name('*') + struct.pack('!HH', TYPE_NBSTAT, CLASS_IN)
+
+
+def build_name_query(transaction_id, name, suffix=SUFFIX_WORKSTATION, broadcast=True):
+    """ Returns a name query, which asks who has a certain name """
+    flags = FLAG_RECURSION_DESIRED
+    if broadcast:
+        flags |= FLAG_BROADCAST
+    return HEADER.pack(transaction_id & 0xffff, flags, 1, 0, 0, 0) + encode_name(name, suffix) + struct.pack('!HH', TYPE_NB, CLASS_IN)
+
+
+def skip_name(data, offset):
+    """ Returns the offset just after an encoded name, which may be a (compression) pointer """
+    while offset < len(data):
+        length = data[offset]
+        if length == 0:
+            return offset + 1
+        if length & 0xc0 == 0xc0:
+            return offset + 2
+        offset += 1 + length
+    raise ValueError('name runs past the end of the packet')
+
+
+def parse_answer(data):
+    """ Returns (transaction id, record type, rdata) of the first answer in a response, or None """
+    if len(data) < HEADER.size:
+        return None
+    transaction_id, flags, questions, answers, authority, additional = HEADER.unpack_from(data, 0)
+    if not flags & FLAG_RESPONSE or answers == 0:
+        return None
+    offset = HEADER.size
+    for _ in range(questions):
+        offset = skip_name(data, offset) + 4
+    offset = skip_name(data, offset)
+    if offset + 10 > len(data):
+        return None
+    record_type, record_class, ttl, length = struct.unpack_from('!HHIH', data, offset)
+    offset += 10
+    return transaction_id, record_type, data[offset:offset + length]
+
+
+def parse_node_status_response(data, ip_address=None):
+    """ Turns a node status response into a NodeStatus. Returns None if it isn't one. """
+    try:
+        answer = parse_answer(data)
+        if answer == None or answer[1] != TYPE_NBSTAT:
+            return None
+        rdata = answer[2]
+        count = rdata[0]
+        names = []
+        offset = 1
+        for _ in range(count):
+            if offset + 18 > len(rdata):
+                break
+            name = rdata[offset:offset + 15].decode('ascii', errors='replace').rstrip(' \x00')
+            suffix = rdata[offset + 15]
+            flags = struct.unpack_from('!H', rdata, offset + 16)[0]
+            names.append((name, suffix, bool(flags & NAME_FLAG_GROUP)))
+            offset += 18
+
+        mac_address = None
+        if offset + 6 <= len(rdata):
+            mac_address = ':'.join('{:02x}'.format(b) for b in rdata[offset:offset + 6])
+            if mac_address == '00:00:00:00:00:00': # Samba does not report a mac address
+                mac_address = None
+
+        hostname = None
+        group = None
+        for name, suffix, is_group in names:
+            if suffix == SUFFIX_WORKSTATION and not is_group and hostname == None:
+                hostname = name
+            elif suffix == SUFFIX_WORKSTATION and is_group and group == None:
+                group = name
+        if hostname == None and len(names) > 0:
+            hostname = names[0][0]
+        return NodeStatus(ip_address, hostname, group, mac_address, names)
+    except Exception:
+        return None
+
+
+def parse_name_query_response(data):
+    """ Returns the list of IP addresses in a positive name query response """
+    try:
+        answer = parse_answer(data)
+        if answer == None or answer[1] != TYPE_NB:
+            return []
+        rdata = answer[2]
+        return [socket.inet_ntoa(rdata[offset + 2:offset + 6]) for offset in range(0, len(rdata) - 5, 6)]
+    except Exception:
+        return []
+
+
+def build_node_status_response(transaction_id, names, mac_address=None):
+    """ Builds the response a Windows host would send to a node status request. Can be used to stand in for real hosts.
+    names -- list of (name, suffix, is group) """
+    rdata = bytes([len(names)])
+    for name, suffix, is_group in names:
+        flags = 0x0400 # active
+        if is_group:
+            flags |= NAME_FLAG_GROUP
+        rdata += name.upper().encode('ascii')[:15].ljust(15, b' ') + bytes([suffix]) + struct.pack('!H', flags)
+    if mac_address != None:
+        rdata += bytes(int(part, 16) for part in mac_address.split(':'))
+    else:
+        rdata += b'\x00' * 6
+    rdata += b'\x00' * 40 # statistics
+    return (HEADER.pack(transaction_id & 0xffff, FLAG_RESPONSE | 0x0400, 0, 1, 0, 0)
+            + encode_name('*') + struct.pack('!HHIH', TYPE_NBSTAT, CLASS_IN, 0, len(rdata)) + rdata)
+
+
+
+class NetbiosClient:
+    """ Sends NetBIOS node status requests to a list of addresses and collects the replies on one socket """
+
+    def __init__(self, port=NETBIOS_PORT, debug=False):
+        self.port = port
+        self.DEBUG = debug
+        self.available = None
+
+
+    def open_socket(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        sock.bind(('', 0))
+        sock.setblocking(False)
+        return sock
+
+
+    def is_available(self):
+        """ Checks once if a UDP socket for broadcasts can be created """
+        if self.available is None:
+            try:
+                sock = self.open_socket()
+                sock.close()
+                self.available = True
+            except Exception as ex:
+                if self.DEBUG:
+                    print("netbios: no UDP socket available, will fall back to nbtscan: " + str(ex))
+                self.available = False
+        return self.available
+
+
+    def sweep(self, addresses, timeout=1.5, pace=None, cancel=None):
+        """ Asks every address for its names. Returns a dictionary of ip -> NodeStatus for the addresses that replied.
+        pace -- optional function that is called before every packet is sent, and can block to limit the send rate
+        cancel -- optional threading.Event. Once it is set, no more requests are sent, and the replies that arrived so far are returned. """
+        results = {}
+        addresses = [str(a) for a in addresses]
+        if len(addresses) == 0:
+            return results
+
+        sock = self.open_socket()
+        try:
+            first_id = random.randint(0, 0xffff)
+            pending = {}
+            for index, address in enumerate(addresses):
+                if cancel != None and cancel.is_set():
+                    break
+                transaction_id = (first_id + index) & 0xffff
+                pending[transaction_id] = address
+                if pace != None:
+                    pace()
+                try:
+                    sock.sendto(build_node_status_request(transaction_id), (address, self.port))
+                except OSError as ex:
+                    if self.DEBUG:
+                        print("netbios: send to " + str(address) + " failed: " + str(ex))
+                    pending.pop(transaction_id, None)
+                self._receive(sock, pending, results, 0)
+
+            deadline = time.time() + timeout
+            while len(pending) > 0:
+                remaining = deadline - time.time()
+                if remaining <= 0 or (cancel != None and cancel.is_set()):
+                    break
+                self._receive(sock, pending, results, min(remaining, 0.5))
+        finally:
+            sock.close()
+
+        if self.DEBUG:
+            print("netbios: " + str(len(results)) + " of " + str(len(addresses)) + " addresses replied")
+        return results
+
+
+    def node_status(self, ip_address, timeout=1.5):
+        """ Returns the NodeStatus of a single address, or None """
+        return self.sweep([ip_address], timeout).get(str(ip_address))
+
+
+    def query_name(self, name, broadcast_address='255.255.255.255', timeout=1.5):
+        """ Broadcasts a name query. Returns the set of IP addresses that claim the name. """
+        addresses = set()
+        sock = self.open_socket()
+        try:
+            transaction_id = random.randint(0, 0xffff)
+            sock.sendto(build_name_query(transaction_id, name), (str(broadcast_address), self.port))
+            deadline = time.time() + timeout
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                readable, _, _ = select.select([sock], [], [], remaining)
+                if not readable:
+                    break
+                data, source = sock.recvfrom(2048)
+                if len(data) >= 2 and struct.unpack_from('!H', data, 0)[0] == transaction_id:
+                    addresses.update(parse_name_query_response(data))
+        finally:
+            sock.close()
+        return addresses
+
+
+    def _receive(self, sock, pending, results, wait):
+        """ Reads all replies that are available (or arrive within the wait period) """
+        readable, _, _ = select.select([sock], [], [], wait)
+        while readable:
+            try:
+                data, source = sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            if len(data) >= 2:
+                transaction_id = struct.unpack_from('!H', data, 0)[0]
+                if pending.get(transaction_id) == source[0]:
+                    status = parse_node_status_response(data, source[0])
+                    if status != None:
+                        results[pending.pop(transaction_id)] = status
+            readable, _, _ = select.select([sock], [], [], 0)
+
@@ -0,0 +1,229 @@
+"""Target network handling. Works out which network to scan, and walks large networks in chunks."""
+
+import fcntl
+import socket
+import struct
+import ipaddress
+
+
+SIOCGIFADDR = 0x8915
+SIOCGIFNETMASK = 0x891b
+
+SMALLEST_PREFIX = 16 # Networks larger than a /16 are limited to the /16 around the controller's own address
+
+
+
+def get_interface_network(interface):
+    """ Returns the IPv4Interface (address and prefix) of a network interface, e.g. 192.168.1.5/22 """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        request = struct.pack('256s', str(interface)[:15].encode())
+        address = socket.inet_ntoa(fcntl.ioctl(sock.fileno(), SIOCGIFADDR, request)[20:24])
+        netmask = socket.inet_ntoa(fcntl.ioctl(sock.fileno(), SIOCGIFNETMASK, request)[20:24])
+    finally:
+        sock.close()
+    return ipaddress.IPv4Interface(address + '/' + netmask)
+
+
+def parse_target(value):
+    """ Turns the 'Target IP' setting into a network. A plain IP address means the /24 it is in, like in older versions. Returns None if the value is not understood. """
+    value = str(value).strip()
+    try:
+        if '/' in value:
+            return limit_network(ipaddress.IPv4Network(value, strict=False))
+        return ipaddress.IPv4Network(value + '/24', strict=False)
+    except ValueError:
+        return None
+
+
+def limit_network(network, own_ip=None):
+    """ Makes sure a network is not too big to ever finish scanning """
+    if network.prefixlen >= SMALLEST_PREFIX:
+        return network
+    if own_ip != None:
+        return ipaddress.IPv4Network(str(own_ip) + '/' + str(SMALLEST_PREFIX), strict=False)
+    return ipaddress.IPv4Network(str(network.network_address) + '/' + str(SMALLEST_PREFIX), strict=False)
+
+
+def host_range(network):
+    """ Returns the first and last usable host address of a network, as integers """
+    first = int(network.network_address)
+    last = int(network.broadcast_address)
+    if network.prefixlen < 31:
+        first += 1 # skip the network address
+        last -= 1  # skip the broadcast address
+    return first, last
+
+
+
+class SweepRange:
+    """ Walks all the host addresses of a network in chunks. Known addresses go first. If a cycle is interrupted (e.g. because its time budget ran out), the next cycle continues where it stopped. """
+
+    def __init__(self, network, chunk_size=256):
+        self.network = network
+        self.chunk_size = max(1, int(chunk_size))
+        self.first, self.last = host_range(network)
+        self.size = self.last - self.first + 1
+        self.cursor = 0 # offset from the first address where the next cycle starts
+        self.completed_cycles = 0
+
+
+    def __contains__(self, ip_address):
+        try:
+            return self.first <= int(ipaddress.IPv4Address(str(ip_address))) <= self.last
+        except ValueError:
+            return False
+
+
+    def chunks(self, priority_addresses=(), exclude=()):
+        """ Generator that yields lists of addresses. First the priority addresses that are inside the network, then all the others, starting at the cursor. """
+        exclude = set(str(a) for a in exclude)
+        priority = []
+        skip = set(exclude)
+        for address in priority_addresses:
+            address = str(address)
+            if address not in skip and address in self:
+                priority.append(address)
+                skip.add(address)
+
+        for index in range(0, len(priority), self.chunk_size):
+            yield priority[index:index + self.chunk_size]
+
+        start = self.cursor
+        done = 0
+        while done < self.size:
+            chunk = []
+            while done < self.size and len(chunk) < self.chunk_size:
+                address = str(ipaddress.IPv4Address(self.first + (start + done) % self.size))
+                done += 1
+                if address not in skip:
+                    chunk.append(address)
+            # the cursor moves before the chunk is handed out, since a caller only stops between chunks
+            self.cursor = (start + done) % self.size
+            if done >= self.size:
+                self.completed_cycles += 1
+            if len(chunk) > 0:
+                yield chunk
+
+
+
+def parse_address_range(value):
+    """ Turns a range like '192.168.1.100-192.168.1.200' (or a CIDR network) into a (first, last) tuple of integers. Returns None if the value is not understood. """
+    value = str(value).strip()
+    try:
+        if '-' in value:
+            first, last = value.split('-', 1)
+            first = int(ipaddress.IPv4Address(first.strip()))
+            last = int(ipaddress.IPv4Address(last.strip()))
+            return (min(first, last), max(first, last))
+        if '/' in value:
+            network = ipaddress.IPv4Network(value, strict=False)
+            return (int(network.network_address), int(network.broadcast_address))
+    except ValueError:
+        pass
+    return None
+
+
+
+class RollingSweep:
+    """ Sweeps a network a small slice at a time, e.g. one slice per clock tick.
+    The network is split into blocks. Blocks where devices have been seen before, or that are inside the DHCP pool, are visited first in every round.
+    Blocks that stay empty are visited less and less often. """
+
+    def __init__(self, network, block_size=16, max_skipped_rounds=32):
+        self.network = network
+        self.block_size = max(1, int(block_size))
+        self.max_skipped_rounds = max_skipped_rounds
+        self.first, self.last = host_range(network)
+        self.size = self.last - self.first + 1
+        self.block_count = (self.size + self.block_size - 1) // self.block_size
+
+        self.round = 0
+        self.next_due = {}      # block -> round in which it should be visited next. Missing means: due now.
+        self.empty_count = {}   # block -> how many visits in a row nothing was found
+        self.visited_round = {} # block -> the last round in which it was visited
+        self.history = set()    # blocks where devices have been found
+        self.dhcp_pool = None   # (first, last) as integers
+
+
+    def block_of(self, ip_address):
+        try:
+            value = int(ipaddress.IPv4Address(str(ip_address)))
+        except ValueError:
+            return None
+        if value < self.first or value > self.last:
+            return None
+        return (value - self.first) // self.block_size
+
+
+    def block_addresses(self, block):
+        start = self.first + block * self.block_size
+        end = min(start + self.block_size - 1, self.last)
+        return [str(ipaddress.IPv4Address(value)) for value in range(start, end + 1)]
+
+
+    def set_history(self, ip_addresses):
+        """ Remembers where devices have been found before """
+        for ip_address in ip_addresses:
+            block = self.block_of(ip_address)
+            if block != None:
+                self.history.add(block)
+
+
+    def set_dhcp_pool(self, address_range):
+        self.dhcp_pool = address_range
+
+
+    def is_preferred(self, block):
+        if block in self.history:
+            return True
+        if self.dhcp_pool != None:
+            start = self.first + block * self.block_size
+            end = start + self.block_size - 1
+            if start <= self.dhcp_pool[1] and end >= self.dhcp_pool[0]:
+                return True
+        return False
+
+
+    def next_slice(self, slice_size=64, exclude=()):
+        """ Returns the list of addresses to probe now, and the list of blocks they belong to """
+        exclude = set(str(a) for a in exclude)
+        for attempt in range(2):
+            due = [block for block in range(self.block_count) if self.next_due.get(block, 0) <= self.round and self.visited_round.get(block) != self.round]
+            if len(due) > 0:
+                break
+            # every block that was due has been visited, so a new round starts
+            self.round += 1
+        else:
+            return [], []
+
+        # preferred blocks first, then the blocks that have not been visited for the longest time
+        due.sort(key=lambda block: (not self.is_preferred(block), self.visited_round.get(block, -1)))
+
+        addresses = []
+        blocks = []
+        for block in due:
+            if len(addresses) > 0 and len(addresses) + self.block_size > slice_size:
+                break
+            blocks.append(block)
+            addresses.extend(a for a in self.block_addresses(block) if a not in exclude)
+        return addresses, blocks
+
+
+    def record_results(self, blocks, found_addresses):
+        """ Updates the statistics of the visited blocks with the addresses where a device responded """
+        found_blocks = set(self.block_of(a) for a in found_addresses)
+        for block in blocks:
+            self.visited_round[block] = self.round
+            if block in found_blocks:
+                self.history.add(block)
+                self.empty_count[block] = 0
+                self.next_due[block] = self.round + 1
+            else:
+                self.empty_count[block] = self.empty_count.get(block, 0) + 1
+                skipped_rounds = 0
+                if self.empty_count[block] >= 3:
+                    skipped_rounds = min(2 ** (self.empty_count[block] - 3), self.max_skipped_rounds)
+                if self.is_preferred(block):
+                    skipped_rounds = min(skipped_rounds, 1)
+                self.next_due[block] = self.round + 1 + skipped_rounds
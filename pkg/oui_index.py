@@ -0,0 +1,200 @@
+"""OUI index. Turns the IEEE registry files (oui.csv, mam.csv, oui36.csv) into a compact binary file, which is memory-mapped and binary-searched to find the vendor of a mac address."""
+
+import os
+import csv
+import mmap
+import struct
+import threading
+
+
+MAGIC = b'OUI1'
+INDEX_HEADER = struct.Struct('<4sII')  # magic, number of tables, offset of the names
+TABLE_HEADER = struct.Struct('<III')   # prefix length in bits, number of records, offset of the first record
+RECORD = struct.Struct('<QI')          # prefix, offset of the organization name
+
+PREFIX_LENGTHS = (36, 28, 24) # MA-S, MA-M, MA-L. Longest first, since a MA-S or MA-M block is carved out of a MA-L block.
+
+SEPARATORS = ('-', ':', '.')
+
+
+
+def mac_to_int(mac):
+    """ Returns the mac address as an integer, or None if it isn't a (partial) mac address of at least 6 hex digits """
+    mac_clean = str(mac)
+    for separator in SEPARATORS:
+        mac_clean = mac_clean.replace(separator, '')
+    if len(mac_clean) < 6 or len(mac_clean) > 12:
+        return None
+    try:
+        return int(mac_clean.ljust(12, '0'), 16)
+    except ValueError:
+        return None
+
+
+def read_registry_csv(path):
+    """ Yields (prefix length in bits, prefix, organization name) for every row of an IEEE registry CSV file """
+    with open(path, newline='', encoding='utf-8', errors='replace') as file:
+        reader = csv.reader(file)
+        for row in reader:
+            if len(row) < 3 or not row[0].startswith('MA-'):
+                continue
+            assignment = row[1].strip()
+            try:
+                prefix = int(assignment, 16)
+            except ValueError:
+                continue
+            yield len(assignment) * 4, prefix, row[2].strip()
+
+
+def build_index(csv_paths, index_path=None):
+    """ Builds the binary index from one or more registry CSV files. Writes it to index_path (atomically) if given. Returns the bytes. """
+    tables = {}
+    for path in csv_paths:
+        if not os.path.isfile(path):
+            continue
+        for bits, prefix, name in read_registry_csv(path):
+            tables.setdefault(bits, {})[prefix] = name
+
+    names = bytearray()
+    name_offsets = {}
+    prefix_lengths = sorted(tables.keys(), reverse=True)
+    records_offset = INDEX_HEADER.size + TABLE_HEADER.size * len(prefix_lengths)
+    table_headers = b''
+    records = bytearray()
+    for bits in prefix_lengths:
+        table = tables[bits]
+        table_headers += TABLE_HEADER.pack(bits, len(table), records_offset + len(records))
+        for prefix in sorted(table.keys()):
+            name = table[prefix]
+            if name not in name_offsets:
+                name_offsets[name] = len(names)
+                names += name.encode('utf-8') + b'\x00'
+            records += RECORD.pack(prefix, name_offsets[name])
+
+    data = INDEX_HEADER.pack(MAGIC, len(prefix_lengths), records_offset + len(records)) + table_headers + bytes(records) + bytes(names)
+    if index_path != None:
+        temporary_path = index_path + '.tmp'
+        with open(temporary_path, 'wb') as file:
+            file.write(data)
+        os.replace(temporary_path, index_path)
+    return data
+
+
+
+class OuiIndex:
+    """ Looks up vendors in a binary index. The file is memory-mapped, so only the pages that a lookup touches are read, and they are shared with other processes.
+    data -- optional bytes of an index, for when it could not be written to disk """
+
+    def __init__(self, index_path=None, data=None):
+        self.file = None
+        self.buffer = None
+        if data != None:
+            self.buffer = data
+        else:
+            self.file = open(index_path, 'rb')
+            self.buffer = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, table_count, self.names_offset = INDEX_HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError('Not an OUI index')
+        self.tables = []
+        for index in range(table_count):
+            self.tables.append(TABLE_HEADER.unpack_from(self.buffer, INDEX_HEADER.size + index * TABLE_HEADER.size))
+
+
+    def find(self, bits, count, offset, prefix):
+        """ Binary search for a prefix in one table. Returns the offset of its name, or None. """
+        low = 0
+        high = count
+        while low < high:
+            middle = (low + high) // 2
+            record_prefix, name_offset = RECORD.unpack_from(self.buffer, offset + middle * RECORD.size)
+            if record_prefix < prefix:
+                low = middle + 1
+            elif record_prefix > prefix:
+                high = middle
+            else:
+                return name_offset
+        return None
+
+
+    def read_name(self, name_offset):
+        start = self.names_offset + name_offset
+        end = self.buffer.find(b'\x00', start)
+        return self.buffer[start:end].decode('utf-8', errors='replace')
+
+
+    def lookup(self, mac):
+        """ Returns the organization that the longest matching prefix of the mac address is assigned to, or None """
+        mac_int = mac_to_int(mac)
+        if mac_int == None:
+            return None
+        for bits, count, offset in self.tables:
+            name_offset = self.find(bits, count, offset, mac_int >> (48 - bits))
+            if name_offset != None:
+                return self.read_name(name_offset)
+        return None
+
+
+    def lookup_many(self, macs):
+        """ Returns a dictionary of mac -> organization (or None). Each distinct 36 bit prefix is only searched once. """
+        results = {}
+        seen = {}
+        for mac in macs:
+            mac_int = mac_to_int(mac)
+            if mac_int == None:
+                results[mac] = None
+                continue
+            key = mac_int >> 12
+            if key not in seen:
+                seen[key] = self.lookup(mac)
+            results[mac] = seen[key]
+        return results
+
+
+    def __len__(self):
+        return sum(count for bits, count, offset in self.tables)
+
+
+    def close(self):
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+        if self.file != None:
+            self.file.close()
+            self.file = None
+
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def open_oui_index(csv_paths, index_path):
+    """ Returns the index for the CSV files. It is (re)built if it is missing or older than one of the CSV files. If it can't be written, it is kept in memory. """
+    try:
+        index_time = os.path.getmtime(index_path)
+    except OSError:
+        index_time = None
+    csv_times = [os.path.getmtime(path) for path in csv_paths if os.path.isfile(path)]
+    if index_time != None and all(csv_time <= index_time for csv_time in csv_times):
+        try:
+            return OuiIndex(index_path)
+        except Exception as ex:
+            print("OUI index could not be opened, rebuilding it: " + str(ex))
+    try:
+        build_index(csv_paths, index_path)
+        return OuiIndex(index_path)
+    except OSError as ex:
+        print("OUI index could not be saved, keeping it in memory: " + str(ex))
+        return OuiIndex(data=build_index(csv_paths))
+
+
+def get_oui_index(csv_paths, index_path):
+    """ Opens the index once, and shares it between all the lookups """
+    global _index
+    with _index_lock:
+        if _index == None:
+            _index = open_oui_index(csv_paths, index_path)
+        return _index
+
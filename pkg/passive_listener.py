@@ -0,0 +1,231 @@
+"""Passive presence detection. Listens for the ARP and DHCP packets that devices send by themselves, without probing them."""
+
+import time
+import ctypes
+import select
+import socket
+import struct
+from collections import namedtuple
+
+
+ETH_P_ALL = 0x0003
+ETH_P_ARP = 0x0806
+ETH_P_IP = 0x0800
+
+SO_ATTACH_FILTER = 26
+
+DHCP_MAGIC_COOKIE = b'\x63\x82\x53\x63'
+DHCP_OPTION_HOSTNAME = 12
+DHCP_OPTION_REQUESTED_IP = 50
+DHCP_OPTION_MESSAGE_TYPE = 53
+DHCP_OPTION_VENDOR_CLASS = 60
+DHCP_OPTION_CLIENT_ID = 61
+DHCP_ACK = 5
+
+# Classic BPF program, equivalent to the tcpdump filter "arp or (udp and (port 67 or port 68))" (unfragmented IPv4 over Ethernet)
+# Each instruction is (code, jump if true, jump if false, k)
+ARP_DHCP_FILTER = [
+    (0x28, 0, 0, 12),         # 0  ldh [12]                 ethertype
+    (0x15, 12, 0, 0x0806),    # 1  jeq ARP                  -> accept
+    (0x15, 0, 12, 0x0800),    # 2  jeq IPv4, else           -> reject
+    (0x30, 0, 0, 23),         # 3  ldb [23]                 IP protocol
+    (0x15, 0, 10, 17),        # 4  jeq UDP, else            -> reject
+    (0x28, 0, 0, 20),         # 5  ldh [20]                 flags and fragment offset
+    (0x45, 8, 0, 0x1fff),     # 6  jset fragment offset     -> reject
+    (0xb1, 0, 0, 14),         # 7  ldxb 4*([14]&0xf)        IP header length
+    (0x48, 0, 0, 14),         # 8  ldh [x+14]               source port
+    (0x15, 4, 0, 67),         # 9  jeq 67                   -> accept
+    (0x15, 3, 0, 68),         # 10 jeq 68                   -> accept
+    (0x48, 0, 0, 16),         # 11 ldh [x+16]               destination port
+    (0x15, 1, 0, 67),         # 12 jeq 67                   -> accept
+    (0x15, 0, 1, 68),         # 13 jeq 68, else             -> reject
+    (0x06, 0, 0, 0x40000),    # 14 accept
+    (0x06, 0, 0, 0),          # 15 reject
+]
+
+
+Sighting = namedtuple('Sighting', ['mac', 'ip', 'hostname', 'kind', 'time', 'client_id', 'vendor_class'], defaults=(None, None))
+
+
+
+def bytes_to_mac(data):
+    return ':'.join('{:02x}'.format(b) for b in data)
+
+
+def parse_dhcp_options(data):
+    options = {}
+    offset = 0
+    while offset < len(data):
+        code = data[offset]
+        if code == 255: # end
+            break
+        if code == 0: # padding
+            offset += 1
+            continue
+        if offset + 1 >= len(data):
+            break
+        length = data[offset + 1]
+        options[code] = data[offset + 2:offset + 2 + length]
+        offset += 2 + length
+    return options
+
+
+def parse_frame(frame, timestamp=None):
+    """ Turns an Ethernet frame with an ARP or DHCP packet into a Sighting. Returns None for anything else. """
+    if timestamp == None:
+        timestamp = time.time()
+    try:
+        if len(frame) < 14:
+            return None
+        ethertype = struct.unpack('!H', frame[12:14])[0]
+
+        if ethertype == ETH_P_ARP:
+            if len(frame) < 42:
+                return None
+            sender_mac = bytes_to_mac(frame[22:28])
+            sender_ip = socket.inet_ntoa(frame[28:32])
+            if sender_ip == '0.0.0.0': # ARP probe of a device that is still checking if its new address is free
+                sender_ip = None
+            return Sighting(sender_mac, sender_ip, None, 'arp', timestamp)
+
+        if ethertype == ETH_P_IP:
+            header_length = (frame[14] & 0x0f) * 4
+            if frame[23] != 17: # UDP
+                return None
+            udp = 14 + header_length
+            source_port, destination_port = struct.unpack('!HH', frame[udp:udp + 4])
+            bootp = frame[udp + 8:]
+            if len(bootp) < 240 or bootp[236:240] != DHCP_MAGIC_COOKIE:
+                return None
+            client_mac = bytes_to_mac(bootp[28:34])
+            options = parse_dhcp_options(bootp[240:])
+
+            hostname = None
+            if DHCP_OPTION_HOSTNAME in options:
+                hostname = options[DHCP_OPTION_HOSTNAME].decode('utf-8', errors='replace').strip('\x00').strip()
+            client_id = None
+            vendor_class = None
+            if source_port == 68:
+                # what the client says about itself. These help to recognize a device that switched to a new randomized mac address.
+                if DHCP_OPTION_CLIENT_ID in options:
+                    client_id = options[DHCP_OPTION_CLIENT_ID].hex()
+                if DHCP_OPTION_VENDOR_CLASS in options:
+                    vendor_class = options[DHCP_OPTION_VENDOR_CLASS].decode('utf-8', errors='replace').strip('\x00').strip()
+
+            client_ip = socket.inet_ntoa(bootp[12:16]) # ciaddr
+            if source_port == 67:
+                # A reply from the DHCP server. Only an acknowledgement means the client really has that address now.
+                if options.get(DHCP_OPTION_MESSAGE_TYPE) != bytes([DHCP_ACK]):
+                    return Sighting(client_mac, None, hostname, 'dhcp', timestamp)
+                client_ip = socket.inet_ntoa(bootp[16:20]) # yiaddr
+            elif client_ip == '0.0.0.0' and DHCP_OPTION_REQUESTED_IP in options and len(options[DHCP_OPTION_REQUESTED_IP]) == 4:
+                client_ip = socket.inet_ntoa(options[DHCP_OPTION_REQUESTED_IP])
+
+            if client_ip == '0.0.0.0':
+                client_ip = None
+            return Sighting(client_mac, client_ip, hostname, 'dhcp', timestamp, client_id, vendor_class)
+    except Exception:
+        return None
+    return None
+
+
+def read_pcap(path):
+    """ Generator that yields (timestamp, frame) for every packet in a pcap file with Ethernet frames """
+    with open(path, 'rb') as f:
+        header = f.read(24)
+        if len(header) < 24:
+            return
+        magic = header[:4]
+        if magic in (b'\xd4\xc3\xb2\xa1', b'\x4d\x3c\xb2\xa1'):
+            endian = '<'
+        elif magic in (b'\xa1\xb2\xc3\xd4', b'\xa1\xb2\x3c\x4d'):
+            endian = '>'
+        else:
+            raise ValueError('Not a pcap file')
+        fraction = 1e9 if magic in (b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d') else 1e6
+        link_type = struct.unpack(endian + 'I', header[20:24])[0]
+        if link_type != 1:
+            raise ValueError('Only Ethernet captures are supported')
+
+        while True:
+            record = f.read(16)
+            if len(record) < 16:
+                return
+            seconds, fractional, captured_length, original_length = struct.unpack(endian + 'IIII', record)
+            frame = f.read(captured_length)
+            if len(frame) < captured_length:
+                return
+            yield seconds + fractional / fraction, frame
+
+
+
+class PassiveListener:
+    """ Captures ARP and DHCP packets on an interface, and turns them into sightings.
+    source -- optional path to a pcap file, or an iterable of (timestamp, frame), to replay instead of capturing live """
+
+    def __init__(self, interface=None, source=None, debug=False):
+        self.interface = interface
+        self.source = source
+        self.DEBUG = debug
+        self.sock = None
+        self.running = False
+
+
+    def open(self):
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        try:
+            program = b''.join(struct.pack('HBBI', *instruction) for instruction in ARP_DHCP_FILTER)
+            buffer = ctypes.create_string_buffer(program)
+            fprog = struct.pack('HL', len(ARP_DHCP_FILTER), ctypes.addressof(buffer))
+            sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+            sock.bind((str(self.interface), ETH_P_ALL))
+        except Exception:
+            sock.close()
+            raise
+        self.sock = sock
+
+
+    def frames(self):
+        if self.source != None:
+            source = self.source
+            if isinstance(source, str):
+                source = read_pcap(source)
+            for timestamp, frame in source:
+                if not self.running:
+                    return
+                yield timestamp, frame
+            return
+
+        if self.sock == None:
+            self.open()
+        while self.running:
+            readable, _, _ = select.select([self.sock], [], [], 1)
+            if not readable:
+                continue
+            frame = self.sock.recv(2048)
+            yield time.time(), frame
+
+
+    def sightings(self):
+        """ Generator that yields a Sighting for every ARP or DHCP packet """
+        self.running = True
+        try:
+            for timestamp, frame in self.frames():
+                sighting = parse_frame(frame, timestamp)
+                if sighting != None and sighting.mac != '00:00:00:00:00:00':
+                    yield sighting
+        finally:
+            self.close()
+
+
+    def stop(self):
+        self.running = False
+
+
+    def close(self):
+        if self.sock != None:
+            try:
+                self.sock.close()
+            except Exception:
+                pass
+            self.sock = None
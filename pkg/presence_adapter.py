@@ -12,10 +12,11 @@ sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lib'))
 import json
 import time
 import socket
-import chardet
 from datetime import datetime, timedelta
+import queue
 import threading
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from gateway_addon import Adapter, Database, Action
 
 try:
@@ -26,6 +27,25 @@ except Exception as ex:
     print("Unable to load APIHandler (which is used for UI extention): " + str(ex))
 
 from .presence_device import PresenceDevice
+from .icmp_sweep import IcmpSweeper
+from .arp_sweep import ArpSweeper
+from .probe_scheduler import ProbeScheduler
+from .probe_runtime import ProbeRuntime
+from .probe_interval import AdaptiveProbeIntervals
+from .deadline_scheduler import DeadlineScheduler
+from .property_batch import PropertyUpdateBatch
+from .liveness_cache import LivenessCache
+from .passive_listener import PassiveListener
+from .avahi_browser import AvahiBrowser, parse_avahi_line
+from .name_resolver import NameResolver, parse_nbtscan_output
+from .netbios import NetbiosClient
+from .reverse_resolver import ReverseResolver
+from .identity_merger import IdentityMerger, is_randomized
+from .device_journal import DeviceJournal
+from .device_store import SqliteDeviceStore
+from .presence_history import PresenceHistory
+from .neighbor_table import NeighborTable, NeighborMonitor, PRESENT_STATES
+from .network_range import SweepRange, RollingSweep, get_interface_network, parse_target, parse_address_range, limit_network
 from .util import *
 
 
@@ -67,8 +87,22 @@ class PresenceAdapter(Adapter):
      
         #self.memory_in_weeks = 10 # How many weeks a device will be remembered as a possible device.
         self.time_window = 10 # How many minutes should a device be away before we consider it away?
+        self.minutes_ago_granularity = 1 # Beyond the time window, the minutes_ago property is only updated in steps of this many minutes
+        self.property_batch = PropertyUpdateBatch() # Property changes of a clock round are sent together, and only if they actually changed
 
         self.own_ip = None # We scan only scan if the device itself has an IP address.
+        self.target_network = None # The network that is scanned. Derived from the interface's address and prefix, or from the Target IP setting.
+        self.target_network_from_settings = None
+        self.sweep_range = None
+        self.sweep_chunk_size = 256 # Larger networks are scanned in chunks of this many addresses
+        self.brute_force_time_budget = 300 # A brute force scan stops after this many seconds. The next one continues where it stopped.
+        
+        self.use_rolling_sweep = True # Every clock tick a small slice of the network is swept, so new devices are discovered without a full brute force scan
+        self.rolling_sweep = None
+        self.rolling_sweep_slice_size = 64
+        self.rolling_sweep_executor = ThreadPoolExecutor(max_workers=1) # A slice can take several seconds, so it is swept outside of the clock thread
+        self.rolling_sweep_future = None
+        self.dhcp_pool = None # Optional (first, last) address range from the settings. Addresses in the DHCP pool are swept first.
         
         self.prefered_interface = "eth0"
         self.selected_interface = "eth0"
@@ -76,21 +110,58 @@ class PresenceAdapter(Adapter):
         self.busy_doing_light_scan = False
         self.devices_excluding_arping = ""
         
+        self.icmp_sweeper = IcmpSweeper(self.selected_interface) # Pings many addresses from a single socket. If that is not allowed, the ping command is used instead.
+        self.icmp_sweep_timeout = 1 # How many seconds to wait for replies after the last ping of a sweep was sent
+        self.arp_sweeper = ArpSweeper(self.selected_interface) # Sends ARP requests for the whole range at once. Needs CAP_NET_RAW, otherwise arping is used instead.
+        self.netbios_client = NetbiosClient() # Asks the whole network for NetBIOS names from a single socket, instead of running nbtscan
+        self.netbios_timeout = 2 # How many seconds to wait for NetBIOS replies after the last request was sent
+        self.netbios_range = None
+        self.netbios_chunk_size = 64 # Besides the known and recently seen hosts, each NetBIOS sweep asks this many other addresses. The next sweep continues where it stopped.
+        self.netbios_future = None
+        self.neighbor_table = NeighborTable() # Reads the kernel's ARP table directly, instead of calling arp or ip neighbor
+        self.use_neighbor_events = True # The kernel reports when a neighbor becomes reachable. This lets devices be marked as present right away.
+        self.neighbor_monitor = None
+        self.discovery_queue = queue.Queue() # (ip, mac, name) of unknown devices that were spotted outside of a scan. The clock thread passes them to parse_found_device.
+        self.event_queue = queue.Queue() # (handler, event) of neighbor events and passive sightings. They are handled on the clock thread, which owns previously_found.
+        
+        self.use_passive_detection = False # Listen for ARP and DHCP packets that devices send by themselves
+        self.passive_listener = None
+        self.last_passive_sighting = {} # _id -> time of the last ARP or DHCP packet from that device
+        self.dhcp_identities = {} # mac -> DHCP client id and vendor class of an unknown device, until parse_found_device has handled it
+        
         self.use_brute_force_scan = False; # was used for continuous brute force scanning. This has been deprecated.
         self.should_brute_force_scan = True
         self.busy_doing_brute_force_scan = False
         self.last_brute_force_scan_time = 0             # Allows the add-on to start a brute force scan right away.
         self.seconds_between_brute_force_scans = 1800  #1800  # 30 minutes     
-
+        self.last_brute_force_scan_duration = None
+        
+        self.scan_concurrency = 8 # How many addresses may be probed at the same time during a brute force scan
+        self.scan_packets_per_second = 100 # Limits how many probes per second are sent, to avoid flooding the (wifi) network
+        self.probe_scheduler = ProbeScheduler(self.scan_concurrency, self.scan_packets_per_second)
+        self.probe_runtime = ProbeRuntime(max_concurrent=32) # Runs ping, arping, arp, etc. commands from an asyncio loop, instead of a thread and shell per command
+        self.probe_intervals = AdaptiveProbeIntervals(base_interval=60, max_interval=600) # Things that are stably present or away are probed less often than once a minute
+        self.deadlines = DeadlineScheduler() # When each thing should be probed next, when its properties change, etc. The clock thread sleeps until the earliest one.
+        self.liveness_cache = LivenessCache(ttl=60) # Addresses that responded, or were seen, in the last minute are not probed again
+
+        # QUICK SCAN
+        # The sources of the quick scan run at the same time. Each has its own timeout, and the quick scan as a whole stops waiting after quick_scan_timeout seconds.
+        self.quick_scan_timeout = 30
+        self.quick_scan_source_timeouts = {'netbios':30, 'avahi-browse':20, 'neighbor table':5}
+        self.quick_scan_executor = ThreadPoolExecutor(max_workers=3)
+        
         # AVAHI
+        self.use_avahi_browser = True # Keep avahi-browse running, so the mDNS names are always up to date and a scan doesn't have to wait for a fresh browse
+        self.avahi_browser = None
         self.last_avahi_scan_time = 0
         self.raw_avahi_scan_result = ""
-        self.avahi_lookup_table = {}
+        self.name_resolver = NameResolver() # The names that avahi, NetBIOS, DHCP, etc. reported for each IP address
+        self.use_reverse_lookups = True # Ask the local DNS server (PTR) and the device itself (LLMNR) for the names of devices that avahi and NetBIOS don't know
+        self.reverse_resolver = ReverseResolver(callback=self.handle_reverse_name, max_outstanding=16)
+        self.identities = IdentityMerger() # Links the randomized (private) mac addresses of phones to the device they belong to
         self.candle_controllers_ip_list = set()
         self.ignore_candle_controllers = True
         
-        self.nbtscan_results = ""
-        
         self.running = True
         self.accepted_as_things = []
         self.not_seen_since = {} # used to determine if a device hasn't responded for a long time
@@ -102,33 +173,46 @@ class PresenceAdapter(Adapter):
             print("self.persistence_file_path = " + str(self.persistence_file_path)) # debug will never be true here unless set in the code above
         
         self.should_save = False
+        self.use_device_database = False # Store the found devices in an SQLite database instead of the json file
+        
+        time.sleep(.3) # avoid swamping the sqlite database
+        
+        self.add_from_config() # Here we get data from the settings in the Gateway interface. This decides where the devices are stored.
         
         
         self.saved_devices_from_controller = {} # holds devices that the controller says it has already accepted
         self.previous_data = {} # will hold data loaded from persistence file
         self.previously_found = {} # will hold the previously found devices recovered from persistence data
         
+        self.persistence = None
+        if self.use_device_database:
+            try:
+                # On first start the devices are copied over from the json file
+                self.persistence = SqliteDeviceStore(os.path.join(self.user_profile['dataDir'], self.addon_name, 'devices.sqlite'), migrate_from=self.persistence_file_path)
+            except Exception as ex:
+                print("Could not open the device database, using the json file instead: " + str(ex))
+        if self.persistence == None:
+            self.persistence = DeviceJournal(self.persistence_file_path) # Only the devices that changed are written, to a journal next to the json file
         try:
-            with open(self.persistence_file_path) as file_object:
-                #print("Loading json..")
-                try:
-                    self.previous_data = json.load(file_object)
-                    if 'mayor_version' in self.previous_data:
-                        #if self.DEBUG:
-                        #print("Persistent data was loaded succesfully") # debug will never be true here unless set in the code above
-                        if 'devices' in self.previous_data:
-                            #pass
-                            self.previously_found = self.previous_data['devices']
-                        else:
-                            #pass
-                            self.previously_found = self.previous_data
+            self.previous_data = self.persistence.load() # The json file, with the changes from the journal applied
+            #print("Loading json..")
+            try:
+                if 'mayor_version' in self.previous_data:
+                    #if self.DEBUG:
+                    #print("Persistent data was loaded succesfully") # debug will never be true here unless set in the code above
+                    if 'devices' in self.previous_data:
+                        #pass
+                        self.previously_found = self.previous_data['devices']
                     else:
-                        print("loaded json was from version 1.0, clearing incompatible persistent data")
-                        
-                except:
-                    #print("Empty json file")
-                    self.previously_found = {}
-                #print("Previously found items: = " + str(self.previously_found))
+                        #pass
+                        self.previously_found = self.previous_data
+                else:
+                    print("loaded json was from version 1.0, clearing incompatible persistent data")
+                    
+            except:
+                #print("Empty json file")
+                self.previously_found = {}
+            #print("Previously found items: = " + str(self.previously_found))
 
         except (IOError, ValueError):
             self.previously_found = {}
@@ -140,6 +224,19 @@ class PresenceAdapter(Adapter):
                 print("failed to create empty persistence file: " + str(ex))
         
         self.previous_found_devices_length = len(self.previously_found)
+        
+        self.presence_history = None # Which things were present in each minute of the last week. Needs NumPy.
+        self.presence_history_save_interval = 600
+        self.last_presence_history_save = time.time()
+        self.last_presence_history_time = None # when the history was last updated
+        self.present_in_history = set() # the things that were present at that time
+        try:
+            self.presence_history = PresenceHistory(os.path.join(self.user_profile['dataDir'], self.addon_name, 'presence_history.npz'), days=7)
+        except ImportError as ex:
+            print("Presence history is not available: " + str(ex))
+        except Exception as ex:
+            print("Error starting presence history: " + str(ex))
+        self.identities.load(self.previously_found)
 
         # Reset all the last_seen data from the persistence file, since it could be out of date.
         for _id in self.previously_found:
@@ -150,10 +247,6 @@ class PresenceAdapter(Adapter):
             except Exception as ex:
                 print("Error setting last_seen of previously_found devices from persistence to None: " + str(ex))
         
-        time.sleep(.3) # avoid swamping the sqlite database
-        
-        self.add_from_config() # Here we get data from the settings in the Gateway interface.
-
         try:
             if self.DEBUG:
                 print("starting api handler")
@@ -178,6 +271,18 @@ class PresenceAdapter(Adapter):
         if self.DEBUG:
             print("selected interface = " + str(self.selected_interface))
         
+        self.icmp_sweeper.DEBUG = self.DEBUG
+        self.arp_sweeper.DEBUG = self.DEBUG
+        self.netbios_client.DEBUG = self.DEBUG
+        self.reverse_resolver.DEBUG = self.DEBUG
+        self.identities.DEBUG = self.DEBUG
+        self.persistence.DEBUG = self.DEBUG
+        self.neighbor_table.DEBUG = self.DEBUG
+        self.probe_intervals.DEBUG = self.DEBUG
+        if self.icmp_sweeper.is_available():
+            if self.DEBUG:
+                print("ICMP sweeps are possible, will not need to call the ping command")
+        
         #self.DEBUG = False
            
         try:
@@ -187,6 +292,16 @@ class PresenceAdapter(Adapter):
             if self.DEBUG:
                 print("Error, could not get actual own IP address")
         
+        self.update_target_network()
+        
+        if self.use_avahi_browser:
+            try:
+                self.avahi_browser = AvahiBrowser(callback=self.handle_avahi_record, debug=self.DEBUG)
+                self.avahi_browser.start()
+            except Exception as ex:
+                if self.DEBUG:
+                    print("Error starting the avahi browser: " + str(ex))
+        
         # First scan
         time.sleep(2) # wait a bit before doing the quick scan. The gateway will pre-populate based on the 'handle-device-saved' method.
 
@@ -204,6 +319,26 @@ class PresenceAdapter(Adapter):
             if self.DEBUG:
                 print("Error starting the continous light scan thread")
         
+        if self.use_neighbor_events:
+            try:
+                self.neighbor_monitor = NeighborMonitor(debug=self.DEBUG)
+                n = threading.Thread(target=self.listen_to_neighbor_events, args=(self.neighbor_monitor,))
+                n.daemon = True
+                n.start()
+            except Exception as ex:
+                if self.DEBUG:
+                    print("Error starting the neighbor events thread: " + str(ex))
+        
+        if self.use_passive_detection:
+            try:
+                self.passive_listener = PassiveListener(self.selected_interface, debug=self.DEBUG)
+                p = threading.Thread(target=self.listen_passively, args=(self.passive_listener,))
+                p.daemon = True
+                p.start()
+            except Exception as ex:
+                if self.DEBUG:
+                    print("Error starting the passive detection thread: " + str(ex))
+        
         #done = self.brute_force_scan()
         
         self.ready = True
@@ -261,16 +396,20 @@ class PresenceAdapter(Adapter):
             # Can be used to override normal behaviour (which is to scan the controller's neighbours), and target a very different group of IP addresses.
             if 'Target IP' in config:
                 try:
-                    potential_ip = str(config['Target IP'])
+                    potential_ip = str(config['Target IP']).strip()
                     if potential_ip != "":
-                        if valid_ip(potential_ip):
+                        if '/' in potential_ip and parse_target(potential_ip) != None:
+                            self.target_network_from_settings = parse_target(potential_ip)
+                            print("Using target network from addon settings: " + str(self.target_network_from_settings))
+                        elif valid_ip(potential_ip):
                             self.own_ip = potential_ip
+                            self.target_network_from_settings = parse_target(potential_ip)
                             print("Using target IP from addon settings")
                         else:
                             if self.DEBUG:
                                 print("This addon does not understand '" + str(potential_ip) + "' as a valid IP address. Go to the add-on settings page to fix this. For now, the addon will try to detect and use the system's IP address as a base instead.")
                         
-                except exception as ex:
+                except Exception as ex:
                     print("Error handling Target IP setting: " + str(ex))
             else:
                 if self.DEBUG:
@@ -294,10 +433,64 @@ class PresenceAdapter(Adapter):
                 except:
                     print("No time window preference was found in the settings. Will use default.")
 
+            if 'Minutes ago granularity' in config:
+                try:
+                    if config['Minutes ago granularity'] != None and config['Minutes ago granularity'] != '':
+                        self.minutes_ago_granularity = clamp(int(config['Minutes ago granularity']), 1, 1440)
+                        if self.DEBUG:
+                            print("Using minutes ago granularity value from settings: " + str(self.minutes_ago_granularity))
+                except:
+                    print("No valid minutes ago granularity preference was found in the settings. Will use default.")
+
+            # How fast may the brute force scan go?
+            if 'Scan concurrency' in config:
+                try:
+                    if config['Scan concurrency'] != None and config['Scan concurrency'] != '':
+                        self.scan_concurrency = clamp(int(config['Scan concurrency']), 1, 64)
+                        if self.DEBUG:
+                            print("Using scan concurrency value from settings: " + str(self.scan_concurrency))
+                except:
+                    print("No valid scan concurrency preference was found in the settings. Will use default.")
+            
+            if 'Scan packets per second' in config:
+                try:
+                    if config['Scan packets per second'] != None and config['Scan packets per second'] != '':
+                        self.scan_packets_per_second = clamp(int(config['Scan packets per second']), 1, 1000)
+                        if self.DEBUG:
+                            print("Using scan packets per second value from settings: " + str(self.scan_packets_per_second))
+                except:
+                    print("No valid scan packets per second preference was found in the settings. Will use default.")
+            
+            self.probe_scheduler.configure(self.scan_concurrency, self.scan_packets_per_second)
+            self.probe_scheduler.DEBUG = self.DEBUG
+            self.probe_runtime.DEBUG = self.DEBUG
+            self.property_batch.DEBUG = self.DEBUG
+
             # Should brute force scans be attempted?
             if 'Use brute force scanning' in config:
                 self.use_brute_force = bool(config['Use brute force scanning'])
 
+            if 'Passive detection' in config:
+                self.use_passive_detection = bool(config['Passive detection'])
+                if self.DEBUG:
+                    print("Passive detection: " + str(self.use_passive_detection))
+
+            if 'Device database' in config:
+                self.use_device_database = bool(config['Device database'])
+                if self.DEBUG:
+                    print("Device database: " + str(self.use_device_database))
+
+            if 'DHCP pool' in config:
+                try:
+                    if str(config['DHCP pool']).strip() != "":
+                        self.dhcp_pool = parse_address_range(config['DHCP pool'])
+                        if self.dhcp_pool == None:
+                            print("This addon does not understand '" + str(config['DHCP pool']) + "' as an address range. Go to the add-on settings page to fix this.")
+                        elif self.DEBUG:
+                            print("DHCP pool from settings: " + str(config['DHCP pool']))
+                except Exception as ex:
+                    print("Error handling DHCP pool setting: " + str(ex))
+
             if 'Addresses to not arping' in config:
                 try:
                     self.devices_excluding_arping = str(config['Devices excluding arping'])  
@@ -318,386 +511,762 @@ class PresenceAdapter(Adapter):
 
 
     def clock(self):
-        """ Runs continuously and scans IP addresses that the user has accepted as things """
+        """ Runs continuously. Sleeps until the earliest deadline: a thing that should be probed, a minutes_ago value that changes, or the once-a-minute housekeeping. """
         if self.DEBUG:
             print("clock thread init")
         time.sleep(5)
-        last_run = 0
-        succesfully_found = 0 # If all devices the user cares about are actually present, then no deep scan is necessary.
+        self.deadlines.schedule('clock', 'housekeeping', time.time())
         while self.running:
-            last_run = time.time()
+            due = self.deadlines.pop_due()
+            if len(due) == 0:
+                self.deadlines.wait(60)
+                continue
             
             if self.DEBUG:
-                print("Clock TICK")
+                print("Clock TICK. Due: " + str(len(due)))
             
-            if self.use_brute_force_scan:
-                try:
+            refresh_ids = []
+            probe_ids = []
+            try:
+                for key, kind in due:
+                    if kind == 'housekeeping':
+                        self.clock_housekeeping()
+                    elif kind == 'events':
+                        pass # handled below, along with any events that arrived in the meantime
+                    elif kind == 'refresh':
+                        refresh_ids.append(key)
+                    elif kind == 'probe':
+                        probe_ids.append(key)
                 
-                    if time.time() - self.last_brute_force_scan_time > self.seconds_between_brute_force_scans:
-                        if self.DEBUG:
-                            print("enough time has passed since the last brute force scan.")
-                        self.last_brute_force_scan_time = time.time()
-                        if succesfully_found != len(self.accepted_as_things): # Avoid doing a deep scan if all devices are present
-                            if self.busy_doing_brute_force_scan == False:
-                                if self.DEBUG:
-                                    print("Should brute force scan is now set to true.")
-                                self.should_brute_force_scan = True
-                                #self.brute_force_scan()
-                            else:
-                                if self.DEBUG:
-                                    print("Should brute force scan, but already doing brute force scan")
-                        else:
-                            if self.DEBUG:
-                                print("all devices present and accounted for. Will skip brute force scan.")
-                except Exception as ex:
-                    if self.DEBUG:
-                        print("Clock: error running periodic deep scan: " + str(ex))
+                self.handle_event_queue()
+                self.handle_discovery_queue()
+                
+                for _id in refresh_ids:
+                    if _id in self.previously_found:
+                        self.refresh_device(_id)
+                
+                if len(probe_ids) > 0:
+                    self.keepalive_round(probe_ids)
+                    
+            except Exception as ex:
+                if self.DEBUG:
+                    print("Clock thread error: " + str(ex))
+            
+            self.property_batch.flush()
+            
+            if self.should_save: # This is the only time the json file is stored.    
+                self.save_to_json() # also sets should_save to false again
 
-            succesfully_found = 0
+
+    def clock_housekeeping(self):
+        """ Runs once a minute. Does a rolling sweep step, and makes sure every device has its deadlines. """
+        now = time.time()
+        self.deadlines.schedule('clock', 'housekeeping', now + 60)
+        self.liveness_cache.expire(now)
+        self.refresh_avahi_names()
+        self.name_resolver.expire(now)
+        self.reverse_resolver.expire(now)
+        
+        if self.use_rolling_sweep:
             try:
-                for _id in self.previously_found:
-                    if self.DEBUG:
-                        print("")
-                        print("clock -> _id : " + str(_id))
-                        print("clock -> name: " + str(self.previously_found[_id]['name']))
-                        print("clock -> ip  : " + str(self.previously_found[_id]['ip']))
-                        print("clock -> prev_found full: " + str(self.previously_found[_id]))
-                        
-                        print("")
-                    # Update device's last seen properties
-                    try:
-                        # Make sure all devices and properties exist. Should be superfluous really.
-                        #if self.DEBUG:
-                        #    print("clock - str(_id) = " + str(_id) + " has " + str(self.previously_found[_id]))
-                        if str(_id) not in self.devices:
-                            
-                            if self.DEBUG:
-                                print(str(self.previously_found[str(_id)]) + " was not turned into an internal devices object yet.")
-                            
-                            """
-                            detail = "..."
-                            try:
-                                detail = self.previously_found[_id]['ip']
-                            except:
-                                if self.DEBUG:
-                                    print("No IP address in previously found list (yet)")
-                                continue
-                                
-                            new_name = "unnamed"
-                            try:
-                                new_name = self.previously_found[_id]['name']
-                            except:
-                                if self.DEBUG:
-                                    print("No name present in previously found list")
-                                continue
-                            
-                            if new_name == "unnamed" or new_name == "?" or new_name == "": # TODO: isn't the name "Presence - unnamed (ip address)" ?
-                                if self.DEBUG:
-                                    print("No good name found yet, skipping device generation and update")
-                                continue
-                            
-                                
-                            if self.DEBUG:
-                                print("clock: adding thing")
-                            """
-                            
-                            if self.ignore_candle_controllers and self.previously_found[_id]['candle'] == True:
-                                if self.DEBUG:
-                                    print("clock: ignoring a Candle controller")
-                                    continue
+                succesfully_found = 0 # If all devices the user cares about are actually present, then no deep scan is necessary.
+                for _id in self.accepted_as_things:
+                    if _id in self.previously_found and self.previously_found[_id].get('last_seen'):
+                        if self.presence_expiry(_id) > now:
+                            succesfully_found += 1
                 
-                            else:
-                                if self.DEBUG:
-                                    print("clock: adding a thing")
-                                self._add_device(_id, self.previously_found[_id]['name'], self.previously_found[_id]['ip']) # The device did not exist yet, so we're creating it.
-                            
-                                
-                            #self._add_device(_id, new_name, detail) # The device did not exist yet, so we're creating it.
+                if len(self.accepted_as_things) > 0 and succesfully_found == len(self.accepted_as_things): # Avoid sweeping if all devices are present
+                    if self.DEBUG:
+                        print("all devices present and accounted for. Will skip the rolling sweep.")
+                elif self.busy_doing_brute_force_scan:
+                    if self.DEBUG:
+                        print("Should do a rolling sweep, but already doing brute force scan")
+                elif not self.icmp_sweeper.is_available() and not self.arp_sweeper.is_available():
+                    if self.DEBUG:
+                        print("Skipping the rolling sweep: without raw sockets it would start a ping and arping process for every address")
+                elif self.rolling_sweep_future != None and not self.rolling_sweep_future.done():
+                    if self.DEBUG:
+                        print("Skipping the rolling sweep: the previous slice is still being swept")
+                else:
+                    history = [device['ip'] for device in self.previously_found.values() if 'ip' in device]
+                    self.rolling_sweep_future = self.rolling_sweep_executor.submit(self.rolling_sweep_step, history)
+            except Exception as ex:
+                if self.DEBUG:
+                    print("Clock: error running rolling sweep: " + str(ex))
+        
+        if self.presence_history != None:
+            try:
+                self.record_presence_history(now)
+            except Exception as ex:
+                if self.DEBUG:
+                    print("Clock: error recording presence history: " + str(ex))
+        
+        try:
+            self.clean_up_identities(now)
+        except Exception as ex:
+            if self.DEBUG:
+                print("Clock: error cleaning up randomized mac addresses: " + str(ex))
+        
+        # Devices that were added since the last housekeeping don't have deadlines yet
+        for _id in list(self.previously_found.keys()):
+            if self.deadlines.deadline(_id, 'refresh') == None:
+                self.deadlines.schedule(_id, 'refresh', now)
+        for _id in list(self.accepted_as_things):
+            if self.deadlines.deadline(_id, 'probe') == None:
+                self.deadlines.schedule(_id, 'probe', now)
+
+
+    def record_presence_history(self, now):
+        """ Marks the minutes in which the things were present. Housekeeping doesn't run exactly once a minute, so the minutes since the previous update are filled in as well.
+        A thing is present from the moment it was last seen until its time window runs out. The history is saved every few minutes. """
+        previous = self.last_presence_history_time
+        if previous == None:
+            previous = now
+        self.last_presence_history_time = now
+        window = 60 * self.time_window
+        ranges = {} # (start, end) -> ids
+        present = set()
+        for _id in list(self.accepted_as_things):
+            last_seen = self.previously_found.get(_id, {}).get('last_seen')
+            if not last_seen:
+                continue
+            if now - last_seen < window:
+                present.add(_id)
+            start = previous if _id in self.present_in_history else max(previous, last_seen) # a thing that was present last time stayed present in between
+            end = min(now, last_seen + window)
+            if end >= start:
+                ranges.setdefault((int(start // 60), int(end // 60)), []).append(_id)
+        for start, end in ranges:
+            self.presence_history.record_range(ranges[(start, end)], start * 60, end * 60)
+        self.present_in_history = present
+        if now - self.last_presence_history_save > self.presence_history_save_interval:
+            self.last_presence_history_save = now
+            self.presence_history.save()
+
+
+    def clean_up_identities(self, now):
+        """ Merges randomized devices that turned out to be the same device, and forgets the ones that are gone """
+        removed = self.identities.merge_duplicates(self.previously_found, self.accepted_as_things, now)
+        removed += self.identities.age_out(self.previously_found, self.accepted_as_things, now)
+        for _id in removed:
+            self.not_seen_since.pop(_id, None)
+            self.deadlines.cancel(_id)
+            self.probe_intervals.make_due(_id)
+        if len(removed) > 0:
+            self.should_save = True
 
-                        #
-                        #  MINUTES AGO
-                        #
 
-                        try:
-                            if self.previously_found[_id]['last_seen'] != 0 and self.previously_found[_id]['last_seen'] != None:
-                                if self.DEBUG:
-                                    print("-adding a minute to minutes_ago variable")
-                                minutes_ago = int( (time.time() - self.previously_found[_id]['last_seen']) / 60 )
-                            else:
-                                minutes_ago = None
-                                if self.DEBUG:
-                                    print("                             --> MINUTES AGO IS NONE <--")
-                                    
-                            #should_update_last_seen = True
-                            #if 'data_mute_end_time' in self.previously_found[_id]:
-                            #    if self.DEBUG:
-                            #        print("data_mute_end_time spotted")
-                            #    if self.previously_found[_id]['data_mute_end_time'] > time.time():
-                            #        if self.DEBUG:
-                            #            print("clock: skipping last_seen increment of muted device " + str(self.previously_found[_id]['name']))
-                            #        minutes_ago = None
-                                    #should_update_last_seen = False
-                            
-                                    
-                        except Exception as ex:
-                            minutes_ago = None
-                            if self.DEBUG:
-                                print("Clock: minutes ago issue: " + str(ex))
-                        
-                        
-                        if _id not in self.devices:
-                            if self.DEBUG:
-                                print("Error. clock: _id was in previously found but not in self.devices (and not an ignored Candle controller either): " + str(_id))
-                            continue
-                            
-                        try:
-                            #if should_update_last_seen:
-                            if 'minutes_ago' not in self.devices[_id].properties:
-                                if self.DEBUG:
-                                    print("+ Adding minutes ago property to presence device, with value: " + str(minutes_ago))
-                                self.devices[_id].add_integer_child("minutes_ago", "Minutes ago last seen", minutes_ago)
-                            elif minutes_ago != None:
-                                if self.DEBUG:
-                                    print("Minutes_ago of " + str(self.previously_found[_id]['name']) + " is: " + str(minutes_ago))
-                            else:
-                                if self.DEBUG:
-                                    print("eh? minutes ago fell through. It is: " + str(minutes_ago))
-                                    
-                            if self.DEBUG:
-                                print("updating minutes ago")
-                            self.devices[_id].properties["minutes_ago"].update(minutes_ago)
-                                    
-                        except Exception as ex:
-                            if self.DEBUG:
-                                print("Clock: Could not add/update minutes_ago property" + str(ex))
-                        
-                        
-                        #
-                        #  RECENTLY SPOTTED
-                        #
-                        
-                        try:
-                            recently = None
-                            if minutes_ago != None:
-                                if self.DEBUG:
-                                    print("minutes_ago was not None, it was: " + str(minutes_ago))
-                                if minutes_ago > self.time_window:
-                                    recently = False
-                                else:
-                                    recently = True
-                                    
-                            else:
-                                if self.DEBUG:
-                                    print("minutes_ago was None, so not determining recently state (will be None too)")
-                                    
-                            if 'recently1' not in self.devices[_id].properties:
-                                if self.DEBUG:
-                                    print("+ Adding recently spotted property to presence device")
-                                self.devices[_id].add_boolean_child("recently1", "Recently spotted", recently, True, "BooleanProperty") # name, title, value, readOnly, @type
-                            else:
-                                self.devices[_id].properties["recently1"].update(recently)
-                        except Exception as ex:
-                            if self.DEBUG:
-                                print("Clock: Could not add recently spotted property: " + str(ex))
+    def identity_of(self, mac_address):
+        """ Returns the id of the device a mac address belongs to. For an old randomized address, that is the id of the device it was merged into. """
+        return self.identities.resolve(mac_to_id(mac_address))
 
 
+    def reported_minutes_ago(self, minutes_ago):
+        """ Within the time window the exact value is reported. Beyond it, the value is rounded down to the granularity from the settings. """
+        if minutes_ago == None or minutes_ago <= self.time_window or self.minutes_ago_granularity <= 1:
+            return minutes_ago
+        return max(self.time_window + 1, minutes_ago - (minutes_ago % self.minutes_ago_granularity))
 
-                        #
-                        #  DATA COLLECTION
-                        #
-                        
-                        if 'data-collection' not in self.devices[_id].properties:
-                            if self.DEBUG:
-                                print("+ Adding data-collection property to presence device")
-                                
-                            data_collection_state = True
-                            if 'data-collection' in self.previously_found[_id]:
-                                if self.DEBUG:
-                                    print("+ Found a data-collection preference in the previously_found data")
-                                data_collection_state = self.previously_found[_id]['data-collection']
-                            
-                            self.devices[_id].add_boolean_child("data-collection", "Data collection", data_collection_state, False, "") # name, title, value, readOnly, @type
 
+    def next_minutes_ago_change(self, minutes_ago):
+        """ Returns after how many minutes (since last_seen) the reported minutes_ago value changes next """
+        if minutes_ago <= self.time_window or self.minutes_ago_granularity <= 1:
+            return minutes_ago + 1
+        return minutes_ago - (minutes_ago % self.minutes_ago_granularity) + self.minutes_ago_granularity
 
-                        #if 'data-temporary-mute' not in self.devices[_id].properties:
-                        #    if self.DEBUG:
-                        #        print("+ Adding recently spotted property to presence device")
-                        #    
-                        #    self.devices[_id].add_boolean_child("data-temporary-mute", "Temporary data mute", False, False, "PushedProperty") # name, title, value, readOnly, @type
-                        
-            
 
-                    except Exception as ex:
+    def schedule_refresh(self, _id):
+        """ The last_seen time of a device changed, so its properties should be updated right away """
+        self.deadlines.schedule(_id, 'refresh', time.time())
+
+
+    def refresh_device(self, _id):
+        """ Updates the minutes_ago and recently spotted properties of a device, and plans the next update """
+        next_refresh = time.time() + 60 * self.time_window # devices that have not been seen are checked once in a while
+        try:
+            if self.DEBUG:
+                print("")
+                print("clock -> _id : " + str(_id))
+                print("clock -> name: " + str(self.previously_found[_id]['name']))
+                print("clock -> ip  : " + str(self.previously_found[_id]['ip']))
+                print("clock -> prev_found full: " + str(self.previously_found[_id]))
+            
+                print("")
+            # Update device's last seen properties
+            try:
+                # Make sure all devices and properties exist. Should be superfluous really.
+                #if self.DEBUG:
+                #    print("clock - str(_id) = " + str(_id) + " has " + str(self.previously_found[_id]))
+                if str(_id) not in self.devices:
+                
+                    if self.DEBUG:
+                        print(str(self.previously_found[str(_id)]) + " was not turned into an internal devices object yet.")
+                
+                    """
+                    detail = "..."
+                    try:
+                        detail = self.previously_found[_id]['ip']
+                    except:
                         if self.DEBUG:
-                            print("Clock: Could not create or update property. Error: " + str(ex))    
+                            print("No IP address in previously found list (yet)")
+                        continue
                     
+                    new_name = "unnamed"
+                    try:
+                        new_name = self.previously_found[_id]['name']
+                    except:
+                        if self.DEBUG:
+                            print("No name present in previously found list")
+                        continue
                 
+                    if new_name == "unnamed" or new_name == "?" or new_name == "": # TODO: isn't the name "Presence - unnamed (ip address)" ?
+                        if self.DEBUG:
+                            print("No good name found yet, skipping device generation and update")
+                        continue
                 
-                if self.DEBUG:
-                    print("\n\nself.accepted_as_things: " + str(self.accepted_as_things))
                     
-                # Scan the devices the user cares about (once a minute)
-                for _id in self.accepted_as_things:
                     if self.DEBUG:
-                        print("_\n__\n___")
-                        print("clock: scanning every minute: _id in accepted_as_things: " + str(_id))
-                    
-                    if str(_id) not in self.previously_found:
+                        print("clock: adding thing")
+                    """
+                
+                    if self.ignore_candle_controllers and self.previously_found[_id]['candle'] == True:
                         if self.DEBUG:
-                            print("Saved thing was not found through scanning yet (not yet added to previously_found), skipping update attempt: " + str(_id))
-                        continue
-                        
-                    if self.DEBUG:
-                        print("clock: scanning every minute: human readable name: " + str(self.previously_found[_id]['name']))
+                            print("clock: ignoring a Candle controller")
+                            return
+    
+                    else:
+                        if self.DEBUG:
+                            print("clock: adding a thing")
+                        self._add_device(_id, self.previously_found[_id]['name'], self.previously_found[_id]['ip']) # The device did not exist yet, so we're creating it.
+                
+                    
+                    #self._add_device(_id, new_name, detail) # The device did not exist yet, so we're creating it.
 
+                #
+                #  MINUTES AGO
+                #
 
-                    #if self.DEBUG:
-                    #    print("Saved device ID " + str(_id) + " was also in previously found list. Trying scan.")
-                    
-                    # Try doing a Ping and then optionally an Arping request if there is a valid IP Address
-                    try:
-                        #if self.DEBUG:
-                        #    print("IP from previously found list: " + str(self.previously_found[_id]['ip']))
-                            
-                        #self.DEBUG = True
-                            
-                            
-                        #
-                        #  LOOKING FOR REASONS TO SKIP PINGING
-                        #
+                try:
+                    if self.previously_found[_id]['last_seen'] != 0 and self.previously_found[_id]['last_seen'] != None:
+                        if self.DEBUG:
+                            print("-adding a minute to minutes_ago variable")
+                        minutes_ago = int( (time.time() - self.previously_found[_id]['last_seen']) / 60 )
+                        # Plan the next refresh for when the reported value changes. At that moment the recently spotted state may change too.
+                        next_refresh = self.previously_found[_id]['last_seen'] + 60 * self.next_minutes_ago_change(minutes_ago)
+                    else:
+                        minutes_ago = None
+                        if self.DEBUG:
+                            print("                             --> MINUTES AGO IS NONE <--")
                         
-                        should_ping = True
+                    #should_update_last_seen = True
+                    #if 'data_mute_end_time' in self.previously_found[_id]:
+                    #    if self.DEBUG:
+                    #        print("data_mute_end_time spotted")
+                    #    if self.previously_found[_id]['data_mute_end_time'] > time.time():
+                    #        if self.DEBUG:
+                    #            print("clock: skipping last_seen increment of muted device " + str(self.previously_found[_id]['name']))
+                    #        minutes_ago = None
+                            #should_update_last_seen = False
+                
                         
-                        # Data collection disabled?
-                        if 'data-collection' in self.previously_found[_id]:
-                            if self.previously_found[_id]['data-collection'] == False:
-                                if self.DEBUG:
-                                    print("clock: skipping pinging of " + str(self.previously_found[_id]['name']) + " because data collection is disabled")
-                                should_ping = False
-                        else:
-                            if self.DEBUG:
-                                print("clock: data-collection value did not exist yet in this thing, adding it now.")
-                            self.previously_found[_id]['data-collection'] = True
-                            self.should_save = True
+                except Exception as ex:
+                    minutes_ago = None
+                    if self.DEBUG:
+                        print("Clock: minutes ago issue: " + str(ex))
+            
+            
+                if _id not in self.devices:
+                    if self.DEBUG:
+                        print("Error. clock: _id was in previously found but not in self.devices (and not an ignored Candle controller either): " + str(_id))
+                    return
+                
+                try:
+                    #if should_update_last_seen:
+                    if 'minutes_ago' not in self.devices[_id].properties:
+                        if self.DEBUG:
+                            print("+ Adding minutes ago property to presence device, with value: " + str(minutes_ago))
+                        self.devices[_id].add_integer_child("minutes_ago", "Minutes ago last seen", minutes_ago)
+                    elif minutes_ago != None:
+                        if self.DEBUG:
+                            print("Minutes_ago of " + str(self.previously_found[_id]['name']) + " is: " + str(minutes_ago))
+                    else:
+                        if self.DEBUG:
+                            print("eh? minutes ago fell through. It is: " + str(minutes_ago))
                         
-                                
-                        # Data-mute enabled?
-                        if 'data_mute_end_time' in self.previously_found[_id]:
-                            if self.DEBUG:
-                                print("data_mute_end_time: " + str(self.previously_found[_id]['data_mute_end_time']) + ". delta: " + str(self.previously_found[_id]['data_mute_end_time'] - time.time()))
-                            if self.previously_found[_id]['data_mute_end_time'] > time.time():
-                                if self.DEBUG:
-                                    print("clock: skipping pinging of muted device " + str(self.previously_found[_id]['name']))
-                                
-                                self.previously_found[_id]['last_seen'] = None
-                                self.devices[_id].properties["recently1"].update(None)
-                                should_ping = False
-                        else:
-                            if self.DEBUG:
-                                print("clock: mute_end_time value did not exist yet in this thing, adding it now.")
-                            self.previously_found[_id]['data_mute_end_time'] = 0
-                            self.should_save = True
-                            
-                                
-                        # To ping or not to ping
-                        if should_ping == True:
-                            if self.DEBUG:
-                                print("- Should ping is True. Will ping/arping now.")
-                            if 'ip' in self.previously_found[_id]:
-                                if self.ping(self.previously_found[_id]['ip'],1):
-                                    if self.DEBUG:
-                                        print("Clock: >> Ping could not find " + str(self.previously_found[_id]['name']) + " at " + str(self.previously_found[_id]['ip']) + ". Maybe Arping can.")
-                                    try:
-                                        if 'mac_address' in self.previously_found[_id]:
-                                            if not self.previously_found[_id]['ip'] in self.devices_excluding_arping and not self.previously_found[_id]['mac_address'] in self.devices_excluding_arping and self.arping(self.previously_found[_id]['ip'], 1) == 0:
-                                                self.previously_found[_id]['last_seen'] = int(time.time())
-                                                if self.DEBUG:
-                                                    print("Clock: >> Arping found it. last_seen updated.")
-                                                succesfully_found += 1
-                                                self.not_seen_since[_id] = None
-                                            else:
-                                                if self.DEBUG:
-                                                    print("Clock: >> Arping also could not find the device.")
-                                                if _id not in self.not_seen_since:
-                                                    if self.DEBUG:
-                                                        print("--adding first not_seen_since time")
-                                                    self.not_seen_since[_id] = int(time.time())
-                                            
-                                                if self.not_seen_since[_id] == None:
-                                                    if self.DEBUG:
-                                                        print("--not_seen_since time was None. Setting current time instead.")
-                                                    self.not_seen_since[_id] = int(time.time())
-                                                    if self.DEBUG:
-                                                        print("- Clock: Remembering fresh not-seen-since time")
-                                                elif self.not_seen_since[_id] + (60 * (self.time_window + 1)) < time.time():
-                                                    if self.DEBUG:
-                                                        print("NOT SPOTTED AT ALL DURATION IS NOW LONGER THAN THE TIME WINDOW!")
-                                                    recently = False
-                                                    if _id in self.devices:
-                                                        if 'recently1' not in self.devices[_id].properties:
-                                                            if self.DEBUG:
-                                                                print("+ Clock: Adding recently spotted property to presence device")
-                                                            self.devices[_id].add_boolean_child("recently1", "Recently spotted", recently, True, "BooleanProperty") # name, title, value, readOnly, @type
-                                                        else:
-                                                            if self.DEBUG:
-                                                                print("+ Clock: updating recently spotted property")
-                                                            self.devices[_id].properties["recently1"].update(recently)
-                                                    else:
-                                                        if self.DEBUG:
-                                                            print("warning, that is was not yet in self.devices?")
-                                        else:
-                                            if self.DEBUG:
-                                                print("Should arping, but missing mac address: " + str(self.previously_found[_id]))
-                                                
-                                                
-                                    except Exception as ex:
-                                        if self.DEBUG:
-                                            print("Error trying last_seen arping: " + str(ex))
-                                else:
-                                    if self.DEBUG:
-                                        print(">> Ping found device")
-                                    self.previously_found[_id]['last_seen'] = int(time.time())
-                                    succesfully_found += 1
-                                    self.not_seen_since[_id] = None
-                            else:
-                                if self.DEBUG:
-                                    print("- Should ping, but no IP: " + str(self.previously_found[_id]))
-                                    
+                    if self.DEBUG:
+                        print("updating minutes ago")
+                    self.property_batch.add(self.devices[_id].properties["minutes_ago"], self.reported_minutes_ago(minutes_ago))
+                        
+                except Exception as ex:
+                    if self.DEBUG:
+                        print("Clock: Could not add/update minutes_ago property" + str(ex))
+            
+            
+                #
+                #  RECENTLY SPOTTED
+                #
+            
+                try:
+                    recently = None
+                    if minutes_ago != None:
+                        if self.DEBUG:
+                            print("minutes_ago was not None, it was: " + str(minutes_ago))
+                        if minutes_ago > self.time_window:
+                            recently = False
                         else:
-                            if self.DEBUG:
-                                print("-data-collection is not allowed for " + str(self.previously_found[_id]['name']) + ", skipping ping.")
-                                        
+                            recently = True
                         
+                    else:
+                        if self.DEBUG:
+                            print("minutes_ago was None, so not determining recently state (will be None too)")
                         
-                    except Exception as ex:
+                    if 'recently1' not in self.devices[_id].properties:
                         if self.DEBUG:
-                            print("Error while scanning device from accepted_as_things list: " + str(ex))
-                    
-                    #self.DEBUG = False
+                            print("+ Adding recently spotted property to presence device")
+                        self.devices[_id].add_boolean_child("recently1", "Recently spotted", recently, True, "BooleanProperty") # name, title, value, readOnly, @type
+                    else:
+                        self.property_batch.add(self.devices[_id].properties["recently1"], recently)
+                except Exception as ex:
+                    if self.DEBUG:
+                        print("Clock: Could not add recently spotted property: " + str(ex))
+
+
+
+                #
+                #  DATA COLLECTION
+                #
+            
+                if 'data-collection' not in self.devices[_id].properties:
+                    if self.DEBUG:
+                        print("+ Adding data-collection property to presence device")
                     
+                    data_collection_state = True
+                    if 'data-collection' in self.previously_found[_id]:
+                        if self.DEBUG:
+                            print("+ Found a data-collection preference in the previously_found data")
+                        data_collection_state = self.previously_found[_id]['data-collection']
+                
+                    self.devices[_id].add_boolean_child("data-collection", "Data collection", data_collection_state, False, "") # name, title, value, readOnly, @type
+
+
+                #if 'data-temporary-mute' not in self.devices[_id].properties:
+                #    if self.DEBUG:
+                #        print("+ Adding recently spotted property to presence device")
+                #    
+                #    self.devices[_id].add_boolean_child("data-temporary-mute", "Temporary data mute", False, False, "PushedProperty") # name, title, value, readOnly, @type
+            
+
+
             except Exception as ex:
                 if self.DEBUG:
-                    print("Clock thread error: " + str(ex))
-            
+                    print("Clock: Could not create or update property. Error: " + str(ex))
+        finally:
+            self.deadlines.schedule(_id, 'refresh', next_refresh)
+
+
+    def keepalive_round(self, ids):
+        """ Probes the things that are due, all at the same time """
+        if self.DEBUG:
+            print("\n\nkeepalive round for: " + str(ids))
             
-            if self.should_save: # This is the only time the json file is stored.    
-                self.save_to_json() # also sets should_save to false again
+        keepalive_targets = {} # _id -> (ip address, whether arping is allowed)
+        for _id in ids:
+            if _id not in self.accepted_as_things:
+                continue
+            if self.DEBUG:
+                print("_\n__\n___")
+                print("clock: scanning every minute: _id in accepted_as_things: " + str(_id))
+        
+            if str(_id) not in self.previously_found:
+                if self.DEBUG:
+                    print("Saved thing was not found through scanning yet (not yet added to previously_found), skipping update attempt: " + str(_id))
+                continue
             
-            accepted_as_things_count = len(self.accepted_as_things)
-            scan_time_delta = time.time() - last_run
             if self.DEBUG:
-                print("pinging all " + str(accepted_as_things_count) + " devices took " + str(scan_time_delta) + " seconds.")
+                print("clock: scanning every minute: human readable name: " + str(self.previously_found[_id]['name']))
+
+
+            #if self.DEBUG:
+            #    print("Saved device ID " + str(_id) + " was also in previously found list. Trying scan.")
+        
+            # Try doing a Ping and then optionally an Arping request if there is a valid IP Address
+            try:
+                #if self.DEBUG:
+                #    print("IP from previously found list: " + str(self.previously_found[_id]['ip']))
+                
+                #self.DEBUG = True
+                
                 
-            if scan_time_delta < 55:
+                #
+                #  LOOKING FOR REASONS TO SKIP PINGING
+                #
+            
+                should_ping = True
+            
+                # Data collection disabled?
+                if 'data-collection' in self.previously_found[_id]:
+                    if self.previously_found[_id]['data-collection'] == False:
+                        if self.DEBUG:
+                            print("clock: skipping pinging of " + str(self.previously_found[_id]['name']) + " because data collection is disabled")
+                        should_ping = False
+                else:
+                    if self.DEBUG:
+                        print("clock: data-collection value did not exist yet in this thing, adding it now.")
+                    self.previously_found[_id]['data-collection'] = True
+                    self.should_save = True
+            
+                    
+                # Data-mute enabled?
+                if 'data_mute_end_time' in self.previously_found[_id]:
+                    if self.DEBUG:
+                        print("data_mute_end_time: " + str(self.previously_found[_id]['data_mute_end_time']) + ". delta: " + str(self.previously_found[_id]['data_mute_end_time'] - time.time()))
+                    if self.previously_found[_id]['data_mute_end_time'] > time.time():
+                        if self.DEBUG:
+                            print("clock: skipping pinging of muted device " + str(self.previously_found[_id]['name']))
+                    
+                        self.previously_found[_id]['last_seen'] = None
+                        self.property_batch.add(self.devices[_id].properties["recently1"], None)
+                        should_ping = False
+                        self.schedule_refresh(_id)
+                else:
+                    if self.DEBUG:
+                        print("clock: mute_end_time value did not exist yet in this thing, adding it now.")
+                    self.previously_found[_id]['data_mute_end_time'] = 0
+                    self.should_save = True
+                
+                    
+                # Passive sighting within the time window?
+                if should_ping and _id in self.last_passive_sighting:
+                    if time.time() - self.last_passive_sighting[_id] < self.time_window * 60:
+                        if self.DEBUG:
+                            print("clock: skipping pinging of " + str(self.previously_found[_id]['name']) + " because it was passively spotted " + str(int(time.time() - self.last_passive_sighting[_id])) + " seconds ago")
+                        should_ping = False
+            
+                # Not due for a probe yet?
+                if should_ping and not self.probe_intervals.is_due(_id):
+                    if self.DEBUG:
+                        print("clock: skipping pinging of " + str(self.previously_found[_id]['name']) + ", it is not due for a probe yet")
+                    should_ping = False
+            
+                # To ping or not to ping. The probes of all things are done together, after this loop.
+                if should_ping == True:
+                    if 'ip' in self.previously_found[_id]:
+                        may_arping = False
+                        if 'mac_address' in self.previously_found[_id]:
+                            if not self.previously_found[_id]['ip'] in self.devices_excluding_arping and not self.previously_found[_id]['mac_address'] in self.devices_excluding_arping:
+                                may_arping = True
+                        else:
+                            if self.DEBUG:
+                                print("Should arping, but missing mac address: " + str(self.previously_found[_id]))
+                        keepalive_targets[_id] = (self.previously_found[_id]['ip'], may_arping)
+                    else:
+                        if self.DEBUG:
+                            print("- Should ping, but no IP: " + str(self.previously_found[_id]))
+                        
+                else:
+                    if self.DEBUG:
+                        print("-data-collection is not allowed for " + str(self.previously_found[_id]['name']) + ", skipping ping.")
+                            
+            
+            
+            except Exception as ex:
                 if self.DEBUG:
-                    print("clock: scan took less than a minute. Will wait " + str(scan_time_delta + 5 ) + " seconds before starting the next round")
-                delay = 55 - scan_time_delta
-                time.sleep(delay)
-            time.sleep(5)
+                    print("Error while scanning device from accepted_as_things list: " + str(ex))
+        
+            #self.DEBUG = False
+        
+        # Probe all the things at the same time, and then handle the results in one go
+        keepalive_results = self.keepalive_probe(keepalive_targets)
+        for _id in keepalive_results:
+            try:
+                found = self.apply_keepalive_result(_id, keepalive_results[_id])
+                self.probe_intervals.record(_id, found, self.presence_expiry(_id))
+            except Exception as ex:
+                if self.DEBUG:
+                    print("Error while handling keepalive result of " + str(_id) + ": " + str(ex))
+        
+        # Plan the next probe of every thing in this round
+        now = time.time()
+        for _id in ids:
+            if _id not in self.accepted_as_things:
+                continue
+            when = max(self.probe_intervals.next_probe.get(_id, 0), now + self.probe_intervals.base_interval)
+            if _id in self.previously_found and self.previously_found[_id].get('data_mute_end_time', 0) > when:
+                when = self.previously_found[_id]['data_mute_end_time']
+            self.deadlines.schedule(_id, 'probe', when)
+
+
+
+    def keepalive_probe(self, targets):
+        """ Probes all the given things at the same time.
+        targets -- dictionary of _id -> (ip address, whether arping is allowed)
+        Returns a dictionary of _id -> True if the thing responded, otherwise False. """
+        ip_addresses = set(ip_address for ip_address, may_arping in targets.values())
+        if len(ip_addresses) == 0:
+            return {}
+        
+        # Addresses that were confirmed alive very recently (e.g. by a scan or a neighbor event) don't need to be probed again
+        cached_alive = set(ip_address for ip_address in ip_addresses if self.liveness_cache.is_alive(ip_address))
+        ip_addresses -= cached_alive
+        
+        # Ping them all. From a single socket if possible, otherwise the ping commands all run concurrently in the probe runtime.
+        ping_alive = None
+        if len(ip_addresses) == 0:
+            ping_alive = set()
+        elif self.icmp_sweeper.is_available():
+            try:
+                ping_alive = self.icmp_sweeper.sweep(ip_addresses, self.icmp_sweep_timeout)
+            except Exception as ex:
+                if self.DEBUG:
+                    print("keepalive: ICMP sweep failed, falling back to ping: " + str(ex))
+        if ping_alive == None:
+            futures = dict((ip_address, self.probe_runtime.submit(self.ping_command(ip_address, 1), _TIMEOUT + 1)) for ip_address in ip_addresses)
+            ping_alive = set(ip_address for ip_address in futures if self.probe_succeeded(futures[ip_address]))
+        for ip_address in ping_alive:
+            self.liveness_cache.record(ip_address, source='ping')
+        ping_alive |= cached_alive
+        
+        # Arping the ones that did not respond to the ping
+        arping_addresses = set(ip_address for ip_address, may_arping in targets.values() if may_arping and ip_address not in ping_alive)
+        arping_alive = set()
+        if len(arping_addresses) > 0:
+            if self.DEBUG:
+                print("keepalive: ping could not find " + str(arping_addresses) + ". Maybe Arping can.")
+            done = False
+            if self.arp_sweeper.is_available():
+                try:
+                    arping_alive = set(self.arp_sweeper.sweep(arping_addresses, self.icmp_sweep_timeout).keys())
+                    done = True
+                except Exception as ex:
+                    if self.DEBUG:
+                        print("keepalive: ARP sweep failed, falling back to arping: " + str(ex))
+            if not done:
+                futures = dict((ip_address, self.probe_runtime.submit(self.arping_command(ip_address, 1), _TIMEOUT + 1)) for ip_address in arping_addresses)
+                arping_alive = set(ip_address for ip_address in futures if self.probe_succeeded(futures[ip_address]))
+            for ip_address in arping_alive:
+                self.liveness_cache.record(ip_address, source='arping')
+        
+        results = {}
+        for _id in targets:
+            ip_address, may_arping = targets[_id]
+            results[_id] = ip_address in ping_alive or (may_arping and ip_address in arping_alive)
+        return results
+
+
+    def presence_expiry(self, _id):
+        """ Returns the time at which a thing will change state by itself if nothing is heard from it, or None """
+        if self.previously_found[_id].get('last_seen'):
+            return self.previously_found[_id]['last_seen'] + (60 * self.time_window)
+        if self.not_seen_since.get(_id) != None:
+            return self.not_seen_since[_id] + (60 * (self.time_window + 1))
+        return None
+
+
+    def probe_succeeded(self, future):
+        try:
+            return bool(future.result())
+        except Exception as ex:
+            if self.DEBUG:
+                print("probe error: " + str(ex))
+            return False
 
+
+    def apply_keepalive_result(self, _id, found):
+        """ Updates a thing after it was probed. Returns True if it was found. """
+        if found:
+            if self.DEBUG:
+                print("Clock: >> Ping or Arping found " + str(self.previously_found[_id]['name']) + ". last_seen updated.")
+            self.previously_found[_id]['last_seen'] = int(time.time())
+            self.not_seen_since[_id] = None
+            self.schedule_refresh(_id)
+            return True
         
+        if self.DEBUG:
+            print("Clock: >> Ping and Arping could not find " + str(self.previously_found[_id]['name']) + " at " + str(self.previously_found[_id]['ip']))
+        if 'mac_address' not in self.previously_found[_id]:
+            return False
         
+        if _id not in self.not_seen_since:
+            if self.DEBUG:
+                print("--adding first not_seen_since time")
+            self.not_seen_since[_id] = int(time.time())
+    
+        if self.not_seen_since[_id] == None:
+            if self.DEBUG:
+                print("--not_seen_since time was None. Setting current time instead.")
+            self.not_seen_since[_id] = int(time.time())
+            if self.DEBUG:
+                print("- Clock: Remembering fresh not-seen-since time")
+        elif self.not_seen_since[_id] + (60 * (self.time_window + 1)) < time.time():
+            if self.DEBUG:
+                print("NOT SPOTTED AT ALL DURATION IS NOW LONGER THAN THE TIME WINDOW!")
+            recently = False
+            if _id in self.devices:
+                if 'recently1' not in self.devices[_id].properties:
+                    if self.DEBUG:
+                        print("+ Clock: Adding recently spotted property to presence device")
+                    self.devices[_id].add_boolean_child("recently1", "Recently spotted", recently, True, "BooleanProperty") # name, title, value, readOnly, @type
+                else:
+                    if self.DEBUG:
+                        print("+ Clock: updating recently spotted property")
+                    self.property_batch.add(self.devices[_id].properties["recently1"], recently)
+            else:
+                if self.DEBUG:
+                    print("warning, that is was not yet in self.devices?")
+        return False
+
+
+
+#
+#  NEIGHBOR EVENTS
+#
+
+    def listen_to_neighbor_events(self, monitor):
+        """ Runs in its own thread. Handles every neighbor change the kernel reports. """
+        if self.DEBUG:
+            print("neighbor events thread init")
+        try:
+            for neighbor in monitor.events():
+                if not self.running:
+                    break
+                self.queue_event(self.handle_neighbor_event, neighbor)
+        except Exception as ex:
+            if self.DEBUG:
+                print("Neighbor events thread stopped: " + str(ex))
+
+
+    def queue_event(self, handler, event):
+        """ Hands an event from the netlink or passive listener thread to the clock thread, and wakes it up """
+        self.event_queue.put((handler, event))
+        self.deadlines.schedule('clock', 'events', time.time())
+
+
+    def handle_event_queue(self):
+        """ Runs on the clock thread """
+        while True:
+            try:
+                handler, event = self.event_queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                handler(event)
+            except Exception as ex:
+                if self.DEBUG:
+                    print("Error handling " + str(event) + ": " + str(ex))
+
+
+    def handle_neighbor_event(self, neighbor):
+        """ A neighbor entry was added or changed. If it was confirmed reachable, the device is present. Runs on the clock thread. """
+        if neighbor.mac == None or not valid_ip(neighbor.ip) or neighbor.ip == self.own_ip:
+            return
+        if neighbor.interface != self.selected_interface:
+            return
+        if self.DEBUG:
+            print("neighbor event: " + str(neighbor))
+        if neighbor.state in ('REACHABLE', 'DELAY'):
+            self.liveness_cache.record(neighbor.ip, neighbor.mac, source='neighbor')
         
+        _id = self.identity_of(neighbor.mac)
+        if _id in self.previously_found:
+            if neighbor.state not in ('REACHABLE', 'DELAY'): # a STALE or FAILED entry is not proof that the device is there, the time window handles those
+                return
+            if self.previously_found[_id].get('data-collection') == False:
+                return
+            if self.previously_found[_id].get('data_mute_end_time', 0) > time.time():
+                return
+            self.previously_found[_id]['last_seen'] = int(time.time())
+            self.previously_found[_id]['ip'] = neighbor.ip
+            self.not_seen_since[_id] = None
+            self.probe_intervals.record(_id, True, self.presence_expiry(_id))
+            self.schedule_refresh(_id)
+            try:
+                if _id in self.devices and 'recently1' in self.devices[_id].properties:
+                    self.property_batch.add(self.devices[_id].properties['recently1'], True)
+            except Exception as ex:
+                if self.DEBUG:
+                    print("neighbor event: could not update recently spotted property: " + str(ex))
+        
+        elif neighbor.state in PRESENT_STATES and valid_mac(neighbor.mac):
+            self.discovery_queue.put((neighbor.ip, neighbor.mac, 'unnamed'))
+
+
+    def handle_discovery_queue(self):
+        """ Adds devices that were spotted outside of a scan """
+        while True:
+            try:
+                ip_address, mac_address, found_device_name = self.discovery_queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                if self.identity_of(mac_address) not in self.previously_found:
+                    if self.DEBUG:
+                        print("new device spotted outside of a scan: " + str(ip_address) + ", " + str(mac_address))
+                    self.parse_found_device(ip_address, found_device_name, mac_address)
+                    self.should_save = True
+            except Exception as ex:
+                if self.DEBUG:
+                    print("Error handling discovery queue: " + str(ex))
+
+
+
+#
+#  PASSIVE DETECTION
+#
+
+    def listen_passively(self, listener):
+        """ Runs in its own thread. Every ARP or DHCP packet a device sends counts as a sighting. """
+        if self.DEBUG:
+            print("passive detection thread init")
+        try:
+            for sighting in listener.sightings():
+                if not self.running:
+                    break
+                self.queue_event(self.handle_sighting, sighting)
+        except Exception as ex:
+            print("Passive detection stopped. It needs permission to capture packets (CAP_NET_RAW). Error: " + str(ex))
+
+
+    def handle_sighting(self, sighting):
+        """ A device sent an ARP or DHCP packet, so it is present. Runs on the clock thread. """
+        if sighting.ip != None and (not valid_ip(sighting.ip) or sighting.ip == self.own_ip):
+            return
+        self.liveness_cache.record(sighting.ip, sighting.mac, source=sighting.kind, when=sighting.time)
+        if sighting.hostname and sighting.ip != None:
+            self.name_resolver.set(sighting.ip, sighting.hostname, 'dhcp', when=sighting.time)
+        
+        _id = self.identity_of(sighting.mac)
+        dhcp = None
+        if sighting.client_id or sighting.vendor_class:
+            dhcp = {'client_id':sighting.client_id, 'vendor_class':sighting.vendor_class}
+        if _id in self.previously_found:
+            if dhcp != None:
+                for key in dhcp:
+                    if dhcp[key] and self.previously_found[_id].get('dhcp_' + key) != dhcp[key]:
+                        self.previously_found[_id]['dhcp_' + key] = dhcp[key]
+                        self.should_save = True
+            if self.previously_found[_id].get('data-collection') == False:
+                return
+            if self.previously_found[_id].get('data_mute_end_time', 0) > time.time():
+                return
+            if self.DEBUG:
+                print("passive sighting of " + str(self.previously_found[_id].get('name')) + " via " + str(sighting.kind))
+            self.last_passive_sighting[_id] = sighting.time
+            self.previously_found[_id]['last_seen'] = int(sighting.time)
+            if sighting.ip != None:
+                self.previously_found[_id]['ip'] = sighting.ip
+            self.not_seen_since[_id] = None
+            self.probe_intervals.record(_id, True, self.presence_expiry(_id))
+            self.schedule_refresh(_id)
+        
+        elif sighting.ip != None and valid_mac(sighting.mac):
+            found_device_name = 'unnamed'
+            if sighting.hostname:
+                found_device_name = sighting.hostname
+            if dhcp != None:
+                self.dhcp_identities[str(sighting.mac).lower()] = dhcp
+            self.discovery_queue.put((sighting.ip, sighting.mac, found_device_name))
+
+
 
 #
 #  BRUTE FORCE SCAN
@@ -732,30 +1301,24 @@ class PresenceAdapter(Adapter):
                     #while True:
                     #def split_processing(items, num_splits=4):
                     old_previous_found_count = len(self.previously_found)
-                    thread_count = 3 #2 #5
-                    split_size = 85 #127 #51
-                    threads = []
-                    for i in range(thread_count):
-                        # determine the indices of the list this thread will handle
-                        start = i * split_size
-                        if self.DEBUG:
-                            print("thread start = " + str(start))
-                        # special case on the last chunk to account for uneven splits
-                        end = 255 if i+1 == thread_count else (i+1) * split_size
-                        if self.DEBUG:
-                            print("thread end = " + str(end))
-                        # Create the thread
-                        threads.append(
-                            threading.Thread(target=self.scan, args=(start, end)))
-                        threads[-1].daemon = True
-                        threads[-1].start() # start the thread we just created
-
-                    # Wait for all threads to finish
-                    for t in threads:
-                        t.join()
-                        
+                    
+                    self.update_target_network()
+                    if self.sweep_range == None or self.sweep_range.network != self.target_network:
+                        self.sweep_range = SweepRange(self.target_network, self.sweep_chunk_size)
+                    
+                    # Addresses where devices were found before are checked first. Larger networks are scanned in chunks, until the time budget runs out. The next scan continues where this one stopped.
+                    priority_addresses = [self.previously_found[_id]['ip'] for _id in list(self.previously_found.keys()) if 'ip' in self.previously_found[_id]]
+                    scan_start_time = time.time()
+                    for addresses in self.sweep_range.chunks(priority_addresses, [self.own_ip]):
+                        self.brute_force_scan_chunk(addresses)
+                        if time.time() - scan_start_time > self.brute_force_time_budget:
+                            if self.DEBUG:
+                                print("Brute force scan: time budget has run out. The next scan will continue from " + str(self.sweep_range.cursor) + " of " + str(self.sweep_range.size))
+                            break
+                    
+                    self.last_brute_force_scan_duration = time.time() - scan_start_time
                     if self.DEBUG:
-                        print("Brute force scan: all threads are done")
+                        print("Brute force scan: done. It took " + str(self.last_brute_force_scan_duration) + " seconds.")
                     # If new devices were found, save the JSON file.
                     if len(self.previously_found) != old_previous_found_count:
                         self.should_save = True
@@ -803,93 +1366,218 @@ class PresenceAdapter(Adapter):
                 
 
 
-    def scan(self, start, end):
-        """Part of the brute force scanning function, which splits out the scanning over multiple threads."""
-        #self.should_save = False # We only save found devices to a file if new devices have been found during this scan.
+    def brute_force_scan_chunk(self, addresses):
+        """ Checks which of the addresses are in use, and handles the devices that are found """
+        if self.DEBUG:
+            print("Brute force scan: scanning " + str(len(addresses)) + " addresses, from " + str(addresses[0]) + " to " + str(addresses[-1]))
+        
+        responded, alive, arp_results = self.probe_chunk(addresses)
+        self.probe_scheduler.run(responded, lambda ip_address: self.scan(ip_address, alive, arp_results))
+        return responded
 
-        # skip broadcast addresses
-        if start == 0:
-            start = 1
-        if end == 255:
-            end = 254
-            
-        for ip_byte4 in range(start, end):
 
-            ip_address = str(self.own_ip[:self.own_ip.rfind(".")]) + "." + str(ip_byte4)
+    def probe_chunk(self, addresses):
+        """ Checks which of the addresses are in use. Only probes, previously_found is not touched. Returns the addresses that responded, the set of alive addresses, and a dictionary of ip -> mac (or None). """
+        # Ping the entire chunk in one go from a single socket.
+        alive = None
+        if self.icmp_sweeper.is_available():
+            try:
+                alive = self.icmp_sweeper.sweep(addresses, self.icmp_sweep_timeout, self.probe_scheduler.pace)
+                if self.DEBUG:
+                    print("Brute force scan: ICMP sweep found these addresses: " + str(alive))
+                for ip_address in alive:
+                    self.liveness_cache.record(ip_address, source='ping')
+            except Exception as ex:
+                if self.DEBUG:
+                    print("Brute force scan: ICMP sweep failed, falling back to ping: " + str(ex))
+                alive = None
+        
+        # Ask the entire chunk who-has in one burst. This also gives us the mac addresses, so the arp command doesn't have to be called either.
+        arp_results = None
+        if self.arp_sweeper.is_available():
+            try:
+                arp_results = self.arp_sweeper.sweep(addresses, self.icmp_sweep_timeout, self.probe_scheduler.pace)
+                if self.DEBUG:
+                    print("Brute force scan: ARP sweep found these addresses: " + str(arp_results))
+                for ip_address in arp_results:
+                    self.liveness_cache.record(ip_address, arp_results[ip_address], source='arp')
+            except Exception as ex:
+                if self.DEBUG:
+                    print("Brute force scan: ARP sweep failed, falling back to arping: " + str(ex))
+                arp_results = None
+        
+        # If a sweep was not possible, the ping and arping commands are submitted to the probe runtime instead, within the concurrency limit and packet budget.
+        # Addresses that were confirmed alive very recently are not probed with a command again.
+        if alive == None:
+            alive = set(ip_address for ip_address in addresses if self.liveness_cache.is_alive(ip_address))
+            to_ping = [ip_address for ip_address in addresses if ip_address not in alive]
+            ping_results = self.probe_scheduler.run_futures(to_ping, lambda ip_address: self.probe_runtime.submit(self.ping_command(ip_address, 1), _TIMEOUT + 1))
+            for ip_address in ping_results:
+                if ping_results[ip_address]:
+                    alive.add(ip_address)
+                    self.liveness_cache.record(ip_address, source='ping')
+        
+        if arp_results == None:
+            not_alive = [ip_address for ip_address in addresses if ip_address not in alive and ip_address != self.own_ip]
+            arping_results = self.probe_scheduler.run_futures(not_alive, lambda ip_address: self.probe_runtime.submit(self.arping_command(ip_address, 1), _TIMEOUT + 1))
+            for ip_address in arping_results:
+                if arping_results[ip_address]:
+                    alive.add(ip_address)
+                    self.liveness_cache.record(ip_address, source='arping')
+        
+        # Handle every address that responded.
+        responded = [ip_address for ip_address in addresses if ip_address in alive or (arp_results != None and ip_address in arp_results)]
+        
+        if arp_results == None:
+            # The ping and arping commands have filled the kernel's neighbor table, so the mac addresses can be read from it in one go.
+            try:
+                arp_results = {}
+                for neighbor in self.neighbor_table.read(interface=self.selected_interface):
+                    if neighbor.mac != None and neighbor.state in PRESENT_STATES:
+                        arp_results[neighbor.ip] = neighbor.mac
+            except Exception as ex:
+                if self.DEBUG:
+                    print("Brute force scan: could not read neighbor table: " + str(ex))
+                arp_results = None
+        
+        return responded, alive, arp_results
+
+
+    def rolling_sweep_step(self, history):
+        """ Sweeps the next slice of the network. Runs on the rolling sweep executor, once per housekeeping.
+        Only the probing happens here. The addresses that responded are handed to the clock thread, which owns previously_found.
+        history -- the IP addresses of the known devices """
+        if self.target_network == None:
+            return
+        try:
+            if self.rolling_sweep == None or self.rolling_sweep.network != self.target_network:
+                self.rolling_sweep = RollingSweep(self.target_network)
+            self.rolling_sweep.set_dhcp_pool(self.dhcp_pool)
+            self.rolling_sweep.set_history(history)
+        
+            addresses, blocks = self.rolling_sweep.next_slice(self.rolling_sweep_slice_size, [self.own_ip])
+            if len(addresses) == 0:
+                return
+        
+            responded, alive, arp_results = self.probe_chunk(addresses)
+            self.rolling_sweep.record_results(blocks, responded)
+            if self.DEBUG:
+                print("rolling sweep: round " + str(self.rolling_sweep.round) + ", swept " + str(len(addresses)) + " addresses, " + str(len(responded)) + " responded")
+            
+            found = []
+            for ip_address in responded:
+                if ip_address == self.own_ip:
+                    continue
+                mac_address = None
+                if arp_results != None:
+                    mac_address = arp_results.get(ip_address)
+                if mac_address == None:
+                    neighbor = self.arp(ip_address)
+                    if neighbor != None:
+                        mac_address = neighbor.mac
+                if mac_address != None:
+                    found.append((ip_address, mac_address))
+            if len(found) > 0:
+                self.queue_event(self.handle_rolling_sweep_results, found)
+        except Exception as ex:
             if self.DEBUG:
-                print(ip_address)
+                print("rolling sweep: error: " + str(ex))
 
-            # Skip our own IP address.
-            if ip_address == self.own_ip:
-                continue
 
-            ping_count = 1
+    def handle_rolling_sweep_results(self, found):
+        """ Runs on the clock thread. found is a list of (ip, mac) of the addresses that responded to a rolling sweep slice. """
+        old_previous_found_count = len(self.previously_found)
+        for ip_address, mac_address in found:
+            self.handle_found_address(ip_address, mac_address)
+        if len(self.previously_found) != old_previous_found_count:
+            self.should_save = True
 
-            alive = False   # holds whether we got any response.
-            if self.ping(ip_address, ping_count) == 0: # 0 means everything went ok, so a device was found.
-                alive = True
-            else:
-                try:
-                    if self.DEBUG:
-                        print("brute force: ping failed, trying arping")
-                    if self.arping(ip_address, ping_count) == 0: # 0 means everything went ok, so a device was found.
-                        alive = True
-                except Exception as ex:
-                    if self.DEBUG:
-                        print("Error trying Arping: " + str(ex))
-                
-            # If either ping or arping found a device:
-            try:
-                if alive:
-                    output = self.arp(ip_address)
-                    if self.DEBUG:
-                        print(str(ip_address) + " IS ALIVE: " + str(output))
-                    mac_addresses = re.findall(r'(([0-9a-fA-F]{1,2}:){5}[0-9a-fA-F]{1,2})', output)
 
-                    now = int(time.time())
 
-                    if len(mac_addresses) > 0:
-                        mac_address = mac_addresses[0][0]
-                        mac_address = ':'.join([ '0' * (2 - len(x)) + x for x in mac_address.split(':') ])
-                        
-                        
+    def scan(self, ip_address, alive_addresses=None, arp_results=None):
+        """Part of the brute force scanning function. Checks if a single IP address is in use, and if so, handles the device. Returns True if a device was found.
+        alive_addresses -- set of addresses that already responded to an ICMP sweep. If None, the address is pinged individually.
+        arp_results -- dictionary of ip -> mac from an ARP sweep. If None, an address that does not respond to a ping is arpinged individually."""
+        #self.should_save = False # We only save found devices to a file if new devices have been found during this scan.
+
+        if self.DEBUG:
+            print(ip_address)
+
+        # Skip our own IP address.
+        if ip_address == self.own_ip:
+            return False
 
-                        if not valid_mac(mac_address):
-                            if self.DEBUG:
-                                print("Deep scan: MAC address was not valid")
-                            continue
+        ping_count = 1
 
-                        _id = mac_to_id(mac_address) #mac_address.replace(":", "")
-                        
+        alive = False   # holds whether we got any response.
+        mac_address = None
+        if arp_results != None and ip_address in arp_results:
+            alive = True
+            mac_address = arp_results[ip_address]
+        elif alive_addresses != None:
+            if ip_address in alive_addresses:
+                alive = True
+        elif self.ping(ip_address, ping_count) == 0: # 0 means everything went ok, so a device was found.
+            alive = True
 
-                        # Get the basic variables
-                        found_device_name = output.split(' ')[0]
-                        if self.DEBUG:
-                            print("Deep scan: early found device name = " + found_device_name)
-                        
-                        self.parse_found_device(ip_address, found_device_name, mac_address)
-                        
-                        
-                        if _id in self.previously_found:
-                            if self.DEBUG:
-                                print("Deep scan: updating ip and last_seen")
-                            # update
-                            #self.previously_found[_id]['first_seen'] = now # creation time
-                            #self.previously_found[_id]['mac_address'] = mac_address
-                     
-                            self.previously_found[_id]['last_seen'] = now    
-                            #self.previously_found[_id]['name'] = str(possible_name) # The name may be better, or it may have changed.
-                            self.previously_found[_id]['ip'] = ip_address
-                        
-                        
-                
-                    
+        if not alive and alive_addresses == None and arp_results == None:
+            try:
+                if self.DEBUG:
+                    print("brute force: ping failed, trying arping")
+                if self.arping(ip_address, ping_count) == 0: # 0 means everything went ok, so a device was found.
+                    alive = True
             except Exception as ex:
                 if self.DEBUG:
-                    print("Brute force scan: scan: error updating items in the previously_found dictionary: " + str(ex))
+                    print("Error trying Arping: " + str(ex))
             
+        # If either ping or arping found a device:
+        try:
+            if alive:
+                if mac_address == None:
+                    neighbor = self.arp(ip_address)
+                    if neighbor != None:
+                        mac_address = neighbor.mac
+                if self.DEBUG:
+                    print(str(ip_address) + " IS ALIVE: " + str(mac_address))
+
+                if mac_address != None:
+                    if not self.handle_found_address(ip_address, mac_address):
+                        return False
+                
+        except Exception as ex:
+            if self.DEBUG:
+                print("Brute force scan: scan: error updating items in the previously_found dictionary: " + str(ex))
+        
+        return alive
+
+
+    def handle_found_address(self, ip_address, mac_address):
+        """ An address responded to a scan. Adds the device if it is new, and updates its ip and last_seen. Returns False if the mac address was not valid. """
+        now = int(time.time())
+        mac_address = ':'.join([ '0' * (2 - len(x)) + x for x in mac_address.split(':') ])
+        
+        if not valid_mac(mac_address):
+            if self.DEBUG:
+                print("Deep scan: MAC address was not valid")
+            return False
 
-            time.sleep(5)
+        _id = self.identity_of(mac_address) #mac_address.replace(":", "")
+        
+        # There is no hostname at this point, so the name will be looked up later
+        found_device_name = str(ip_address)
+        if self.DEBUG:
+            print("Deep scan: early found device name = " + found_device_name)
+        
+        self.parse_found_device(ip_address, found_device_name, mac_address)
+        
+        if _id in self.previously_found:
+            if self.DEBUG:
+                print("Deep scan: updating ip and last_seen")
+            self.previously_found[_id]['last_seen'] = now
+            self.schedule_refresh(_id)
+            #self.previously_found[_id]['name'] = str(possible_name) # The name may be better, or it may have changed.
+            self.previously_found[_id]['ip'] = ip_address
+        return True
 
 
 
@@ -919,36 +1607,35 @@ class PresenceAdapter(Adapter):
     #  IP neighbour is yet another list, this time from the OS
     
     
-    def get_avahi_lines(self):
+    def get_avahi_records(self, timeout=None):
+        """ Returns an AvahiRecord for every resolved service """
         if self.DEBUG:
-            print("in get_avahi_lines")
-        avahi_lines = []
+            print("in get_avahi_records")
+        
+        # The avahi browser already knows all the services, so there's no need to wait for a fresh browse
+        if self.avahi_browser != None and self.avahi_browser.is_warmed_up():
+            return self.avahi_browser.snapshot()
+        
+        avahi_records = []
         avahi_browse_command = ["avahi-browse","-p","-l","-a","-r","-k","-t"] # avahi-browse -p -l -a -r -k -t
         
         try:
-            avahi_scan_result = subprocess.check_output(avahi_browse_command) #.decode()) # , universal_newlines=True, stdout=subprocess.PIPE
-            avahi_encoding = 'latin1'
-            try:
-                avahi_encoding = chardet.detect(avahi_scan_result)['encoding']
-                if self.DEBUG:
-                    print("detected avahi output encoding: " + str(avahi_encoding))
-            except Exception as ex:
-                print("error getting avahi output encoding: " + str(ex))
-                
-            avahi_scan_result = avahi_scan_result.decode(avahi_encoding)
-            for line in avahi_scan_result.split('\n'):
-                # replace ascii codes in the string. E.g. /032 is a space
-                for x in range(127):
-                    anomaly = "\\" + str(x).zfill(3)
-                    if anomaly in line:
-                        line = line.replace(anomaly,chr(x))
-                avahi_lines.append(line)
+            avahi_scan_result = subprocess.check_output(avahi_browse_command, timeout=timeout) #.decode()) # , universal_newlines=True, stdout=subprocess.PIPE
+            for raw_line in avahi_scan_result.split(b'\n'):
+                record = parse_avahi_line(raw_line) # also replaces the escaped characters. E.g. \032 is a space
+                if record != None and record.event == '=':
+                    avahi_records.append(record)
         
         except Exception as ex:
             if self.DEBUG:
-                print("Error in get_avahi_lines: " + str(ex))
+                print("Error in get_avahi_records: " + str(ex))
                 
-        return avahi_lines
+        return avahi_records
+        
+        
+    def get_avahi_lines(self, timeout=None):
+        """ Returns the resolved services as unescaped avahi-browse lines, for the UI """
+        return [record.line for record in self.get_avahi_records(timeout)]
         
         
     
@@ -961,17 +1648,27 @@ class PresenceAdapter(Adapter):
         if self.busy_doing_light_scan == False:
             self.busy_doing_light_scan = True
             
-            nbtscan_results = ""
+            # Start all the sources at the same time. A slow source (e.g. NetBIOS on a big network) no longer holds up the others.
+            started = time.time()
+            deadline = started + self.quick_scan_timeout
+            timeouts = self.quick_scan_source_timeouts
+            
+            netbios_future = None
+            netbios_cancel = threading.Event()
             try:
-                nbtscan_command = 'nbtscan -q -e ' + str(self.own_ip) + '/24'
-                nbtscan_results = subprocess.run(nbtscan_command, shell=True, universal_newlines=True, stdout=subprocess.PIPE) #.decode())
-                self.nbtscan_results = str(nbtscan_results.stdout)
-                if self.DEBUG:
-                    print("nbtscan_results: \n" + str(nbtscan_results.stdout))
+                netbios_future = self.netbios_scan(netbios_cancel)
             except Exception as ex:
                 if self.DEBUG:
-                    print("quick scan: error running nbtscan command: " + str(ex))
-            #os.system('nbtscan -q ' + str(self.own_ip))
+                    print("quick scan: error starting NetBIOS scan: " + str(ex))
+            avahi_future = self.quick_scan_executor.submit(self.get_avahi_records, timeouts['avahi-browse'])
+            neighbors_future = self.quick_scan_executor.submit(self.neighbor_table.read)
+            neighbors_future.add_done_callback(self.request_reverse_names) # the lookups run while waiting for the other sources
+            
+            netbios_names = self.quick_scan_result('netbios', netbios_future, min(deadline, started + timeouts['netbios']), {})
+            netbios_cancel.set() # a sweep that is still running stops sending
+            self.name_resolver.set_many(netbios_names, 'netbios')
+            if self.DEBUG:
+                print("netbios names: " + str(netbios_names))
             
             try:
                 if self.DEBUG:
@@ -979,84 +1676,57 @@ class PresenceAdapter(Adapter):
             
                 try:
              
-                    avahi_lines = self.get_avahi_lines()
+                    avahi_records = self.quick_scan_result('avahi-browse', avahi_future, min(deadline, started + timeouts['avahi-browse']), [])
                     
-                    for line in avahi_lines:
+                    # The fields are read from the parsed records. A name may contain an escaped ';', so splitting the unescaped line again could shift the columns.
+                    for record in avahi_records:
                     
                         try:
-                            ip_address_list = re.findall(r'(?:\d{1,3}\.)+(?:\d{1,3})', str(line))
-                            #if self.DEBUG:
-                            #    print("ip_address_list = " + str(ip_address_list))
-                            if len(ip_address_list) > 0:
-                                #if self.DEBUG:
-                                #    print("avahi line with ip: " + str(line))
-                                ip_address = str(ip_address_list[0])
-                                if valid_ip(ip_address):
+                            ip_address = record.address
+                            if ip_address != None and valid_ip(ip_address):
                                 
-                                    if self.DEBUG:
-                                        print("avahi-browse line with valid IP: " + str(line))
-                                    
-                                    #if ip_address not in avahi_network_devices_ip_list:
-                                    #    avahi_network_devices_ip_list.append(ip_address)
+                                if self.DEBUG:
+                                    print("avahi-browse service with valid IP: " + str(record.line))
                                 
-                                    # Check if it's a Candle device
-                                    if  "IPv4;CandleMQTT-" in line:
+                                # Check if it's a Candle device
+                                if record.protocol == 'IPv4' and record.name.startswith('CandleMQTT-'):
                                 
-                                        if ip_address not in self.candle_controllers_ip_list:
-                                            if self.DEBUG:
-                                                print("-avahi: IPv4;CandleMQTT spotted, it's a candle controller. Adding IP to list.")
-                                            self.candle_controllers_ip_list.add(ip_address)
-                                        
+                                    if ip_address not in self.candle_controllers_ip_list:
+                                        if self.DEBUG:
+                                            print("-avahi: IPv4;CandleMQTT spotted, it's a candle controller. Adding IP to list.")
+                                        self.candle_controllers_ip_list.add(ip_address)
                                     
-                                        # get name
-                                        try:
-                                            before = 'IPv4;CandleMQTT-'
-                                            after = ';_mqtt._tcp;'
-                                            found_device_name = "Candle " + line[line.find(before)+16 : line.find(after)]
-                                        except Exception as ex:
-                                            if self.DEBUG:
-                                                print("parse_found_device: avahi: invalid name: " + str(ex))
-                                            found_device_name = "Candle controller"
-                                        
-                                    else:
-                                        line_parts = line.split(';')
-                                        found_device_name = line_parts[3]
+                                    found_device_name = "Candle " + record.name[len('CandleMQTT-'):]
+                                    
+                                else:
+                                    found_device_name = record.name
                                 
-                                    # Deal with possible escaped characters
-                                    #found_device_name = found_device_name.replace('\\032',' ')
-                                    #found_device_name = found_device_name.replace('\\064','-')
-                                    if '\\' in found_device_name:
-                                        found_device_name = found_device_name.split('\\')[0]
+                                if self.DEBUG:
+                                    print("quick scan: avahi: adding/updating to self.avahi_network_devices. IP: " + str(ip_address) + ", found_device_name: " + str(found_device_name))
+                                self.name_resolver.set(ip_address, found_device_name, 'avahi')
+                                    
                                 
-                                    #if ip_address not in self.avahi_network_devices:
-                                    if self.DEBUG:
-                                        print("quick scan: avahi: adding/updating to self.avahi_network_devices. IP: " + str(ip_address) + ", found_device_name: " + str(found_device_name))
-                                    self.avahi_lookup_table[ip_address] = found_device_name
+                                try:
+                                    mac_address_list = re.findall(r'(([0-9a-fA-F]{1,2}:){5}[0-9a-fA-F]{1,2})', str(record.line))[0]
+                                    #if self.DEBUG:
+                                    #    print("avahi line: mac_address_list: " + str(mac_address_list))
+                                    if len(mac_address_list) > 0:
                                         
-                                    
-                                    try:
-                                        mac_address_list = re.findall(r'(([0-9a-fA-F]{1,2}:){5}[0-9a-fA-F]{1,2})', str(line))[0]
-                                        #if self.DEBUG:
-                                        #    print("avahi line: mac_address_list: " + str(mac_address_list))
-                                        if len(mac_address_list) > 0:
-                                            
-                                            mac_address = str(mac_address_list[0])
-                                            if self.DEBUG:
-                                                print("mac in avahi line: " + str(mac_address))
-                                            #print(str(mac_address))
-                                            
-                                            self.parse_found_device(ip_address, found_device_name, mac_address)
-                                            
-                                            #_id = mac_to_id(mac_address)
-                                        else:
-                                            if self.DEBUG:
-                                                print("no mac address in avahi line (zero length)")
-                                            continue
-                                    except Exception as ex:
-                                        #if self.DEBUG:
-                                        #    print("getting mac from avahi line failed: " + str(ex))
-                                        continue
+                                        mac_address = str(mac_address_list[0])
+                                        if self.DEBUG:
+                                            print("mac in avahi line: " + str(mac_address))
+                                        
+                                        self.parse_found_device(ip_address, found_device_name, mac_address)
                                         
+                                    else:
+                                        if self.DEBUG:
+                                            print("no mac address in avahi line (zero length)")
+                                        continue
+                                except Exception as ex:
+                                    #if self.DEBUG:
+                                    #    print("getting mac from avahi line failed: " + str(ex))
+                                    continue
+                                    
                                 
                         except Exception as ex:
                             if self.DEBUG:
@@ -1085,266 +1755,41 @@ class PresenceAdapter(Adapter):
             
             
             
+            # The kernel's neighbor table (what 'arp -a' and 'ip neighbor' show) is read directly.
             try:
-                command = "arp -a"
-                result = subprocess.run(command, shell=True, universal_newlines=True, stdout=subprocess.PIPE) #.decode())
-                
+                neighbors = self.quick_scan_result('neighbor table', neighbors_future, min(deadline, started + timeouts['neighbor table']), [])
                 if self.DEBUG:
-                    print("arp -a results: \n" + str(result.stdout))
+                    print("neighbor table: \n" + str(neighbors))
                 
-                for line in result.stdout.split('\n'):
-                    #print("arp -a line: " + str(line))
-                    if not "<incomplete>" in line and len(line) > 10:
+                for neighbor in neighbors:
+                    if neighbor.state not in PRESENT_STATES or neighbor.mac == None:
+                        continue
+                    
+                    ip_address = neighbor.ip
+                    mac_address = neighbor.mac
+                    if ip_address == self.own_ip:
                         if self.DEBUG:
-                            print("quick scan: arp -a: checking line: " + str(line))
-                        #found_device_name = "?"
-                        mac_short = ""
-                        found_device_name = "unnamed"
-                        #possible_name = "Presence - unnamed"
-                        
-                        try:
-                            mac_address_list = re.findall(r'(([0-9a-fA-F]{1,2}:){5}[0-9a-fA-F]{1,2})', str(line))[0]
-                            if self.DEBUG:
-                                print("quick scan: arp -a: mac_address_list" + str(mac_address_list))
-                            if len(mac_address_list) > 0:
-                                mac_address = str(mac_address_list[0])
-                                if self.DEBUG:
-                                    print("quick scan: arp -a: mac_address from arp line: " + str(mac_address))
-                                #mac_short = mac_to_hash(mac_address) #str(mac_address.replace(":", ""))
-                                #_id = 'presence-{}'.format(mac_short)
-                            else:
-                                if self.DEBUG:
-                                    print("quick scan: arp -a: no mac address in arp line, skipping")
-                                continue
-                        except Exception as ex:
-                            if self.DEBUG:
-                                print("quick scan: arp -a: getting mac from arp -a line failed: " + str(ex))
+                            print("quick scan: neighbor was own IP address, skipping")
+                        continue
                     
-                        try:
-                            ip_address_list = re.findall(r'(?:\d{1,3}\.)+(?:\d{1,3})', str(line))
-                            if self.DEBUG:
-                                print("quick scan: arp -a: ip_address_list from arp line: " + str(ip_address_list))
-                            ip_address = str(ip_address_list[0])
-                            if valid_ip(ip_address):
-                                if self.DEBUG:
-                                    print("quick scan: arp -a: valid ip")
-                            else:
-                                if self.DEBUG:
-                                    print("quick scan: arp -a: Error: not a valid IP address?")
-                                continue
-                            #found_device_name = 'unnamed'
-                        except Exception as ex:
-                            if self.DEBUG:
-                                print("quick scan: arp -a: Error getting IP address from line: " + str(ex))
-                            continue
-                        
-                        if valid_mac(mac_address):
-                            if self.DEBUG:
-                                print("quick scan: arp -a: mac and ip ok")
-                            
-                            
-                            try:
-                                # FIND NAME
-                                if ip_address in self.avahi_lookup_table: # It could be that the name was found by Avahi, but it did not find the mac, which arp might find instead
-                                    if self.DEBUG:
-                                        print("quick scan: arp -a: spotted name in avahi lookup table")
-                                    found_device_name = str(self.avahi_lookup_table[ip_address])
-                                    #possible_name = found_device_name #self.parse_found_device(ip_address, found_device_name, mac_address)
-
-                                # If not in avahi, maybe the NBT scan found it
-                                elif ip_address in nbtscan_results.stdout:
-                                    if self.DEBUG:
-                                        print("quick scan: arp -a: spotted IP address in nbtscan_results, so extracting name form there")
-                                    try:
-                                        for nbtscan_line in nbtscan_results.stdout.split('\n'):
-                                            if ip_address in nbtscan_line:
-                                                #line = line.replace("#PRE","")
-                                                nbtscan_line = nbtscan_line.rstrip()
-                                                nbtscan_parts = nbtscan_line.split("\t")
-                                                if len(nbtscan_parts) > 0:
-                                                    found_device_name = str(nbtscan_parts[1])
-                                                    #possible_name =self.parse_found_device(ip_address, nbtscan_parts[1], mac_address)
-                                                    if self.DEBUG:
-                                                        print("quick scan: arp -a: name extracted from nbtscan_result: " + str(found_device_name))
-                                    except Exception as ex:
-                                        if self.DEBUG:
-                                            print("quick scan: arp -a: Error getting nice name from nbtscan_results: " + str(ex))
-
-                                # if not, get the name from the arp -a line
-                                elif ' (' in line:
-                                    found_device_name = str(line.split(' (')[0])
-                                    if self.DEBUG:
-                                        print("quick scan: arp -a: remove part after ( from line")
-                                else:
-                                    if self.DEBUG:
-                                        print("quick scan: arp -a: no name?")
-                                        
-                            except Exception as ex:
-                                if self.DEBUG:
-                                    print("quick scan: arp -a: Error getting name from line: " + str(ex))
-                            
-                            self.parse_found_device(ip_address, found_device_name, mac_address)
-                        
-                        
-                            
-                        
-                        
-                        """
-                        if _id not in device_dict:
-                        
-                            # Now that IP and Mac are known, try to get the name (found_device_name)
-                            try:
-                            
-                            
-                            
-                                # maybe the device is already known
-                                if _id in self.previously_found:
-                                    if 'name' in self.previously_found[_id]:
-                                        #found_device_name = self.previously_found[_id]['name']
-                                        self.previously_found[_id]['ip'] = ip_address
-                                        if self.DEBUG:
-                                            print("quick scan: arp -a: id was already in previously_found. Name: " + str(self.previously_found[_id]['name']))
-                                        
-                                        
-                                    else:
-                                        if self.DEBUG:
-                                            print("quick scan: arp -a: Error, no name attribute in previously_found?")
-                                
-                                    continue
-                                
-                                # if not, maybe the name is in the Avahi-browse lookup table
-                                elif ip_address in self.avahi_lookup_table: # It could be that the name was found by Avahi, but it did not find the mac, which arp might find instead
-                                    if self.DEBUG:
-                                        print("quick scan: arp -a: spotted name in avahi lookup table")
-                                    found_device_name = str(self.avahi_lookup_table[ip_address])
-                                    #possible_name = found_device_name #self.parse_found_device(ip_address, found_device_name, mac_address)
-                            
-                                # If not in avahi, maybe the NBT scan found it
-                                elif ip_address in nbtscan_results.stdout:
-                                    if self.DEBUG:
-                                        print("quick scan: arp -a: spotted IP address in nbtscan_results, so extracting name form there")
-                                    try:
-                                        for nbtscan_line in nbtscan_results.stdout.split('\n'):
-                                            if ip_address in nbtscan_line:
-                                                #line = line.replace("#PRE","")
-                                                nbtscan_line = nbtscan_line.rstrip()
-                                                nbtscan_parts = nbtscan_line.split("\t")
-                                                if len(nbtscan_parts) > 0:
-                                                    found_device_name = str(nbtscan_parts[1])
-                                                    #possible_name =self.parse_found_device(ip_address, nbtscan_parts[1], mac_address)
-                                                    if self.DEBUG:
-                                                        print("quick scan: arp -a: name extracted from nbtscan_result: " + str(found_device_name))
-                                    except Exception as ex:
-                                        if self.DEBUG:
-                                            print("quick scan: arp -a: Error getting nice name from nbtscan_results: " + str(ex))
-                            
-                                # if not, get the name from the arp -a line
-                                elif ' (' in line:
-                                    found_device_name = str(line.split(' (')[0])
-                                    if self.DEBUG:
-                                        print("quick scan: arp -a: remove part after ( from line")
-                                else:
-                                    if self.DEBUG:
-                                        print("quick scan: arp -a: no name?")
-                        
-                            except Exception as ex:
-                                if self.DEBUG:
-                                    print("Error: quick scan: arp -a: could not get name from arp -a line: " + str(ex))
-                        
-                        
-                            if self.DEBUG:
-                                print("quick scan: arp -a: found_device_name: " + str(found_device_name))
-                        
-                            
-                            try:
-                                # Add the device to the dictionary of found devices
-                                possible_name = self.parse_found_device(ip_address, found_device_name, mac_address)
-                            
-                                if self.DEBUG:
-                                    print("quick scan: arp -a: possible_name: " + str(possible_name))
-                            
-                                if self.ignore_candle_controllers and ip_address in self.candle_controllers_ip_list:
-                                    if self.DEBUG:
-                                        print("quick scan: arp -a: ignoring a Candle controller")
-                                    continue
-                                else:
-                                    if self.DEBUG:
-                                        print("quick scan: arp -a: adding device to found devices list\n")
-                                    device_dict[_id] = {'ip':ip_address,'mac_address':mac_address,'name':possible_name,'first_seen':int(time.time()),'last_seen':None}
-                            
-                            
-                            
-                            except Exception as ex:
-                                if self.DEBUG:
-                                    print("Error: quick scan: arp -a: could not get name from arp -a line: " + str(ex))
-                        
-                        
-                            #if mac_short != "" and found_device_name != 'unknown':
-                                #print("util: arp: mac in line: " + line)
-                                #item = {'ip':ip_address,'mac':mac_address,'name':name, 'mac_short':mac_address.replace(":", "")}
-                                #return str(line)
-                            
-                                                        #else:
-                            #    if self.DEBUG:
-                            #        print("Skipping an arp -a result because of missing mac or name")
-                                #print("device_dict = " + str(device_dict))
-                            
-                        """
-                #return str(result.stdout)
-
-            except Exception as ex:
-                if self.DEBUG:
-                    print("general error in quick scan with Arp -a: " + str(ex))
-                #result = 'error'
-            
-            
-            # This is a little tacked-on here, but it can give some more quick results
-            try:
-                if self.DEBUG:
-                    print("\n\nneighbour scan:")
-            
-                # Also try getting IPv6 addresses from "ip neighbour"
-            
-                ip_neighbor_output = subprocess.check_output(['ip', 'neighbor']).decode('utf-8')
-                if self.DEBUG:
-                    print("ip_neighbor_output: " + str(ip_neighbor_output))
-                    print("")
-                for line in ip_neighbor_output.splitlines():
-                    if line.endswith("REACHABLE") or line.endswith("STALE") or line.endswith("DELAY"):
+                    if not valid_mac(mac_address) or not valid_ip(ip_address):
                         if self.DEBUG:
-                            print("stale, delay or reachable in line:  "+ str(line))
-                        try:
-                            mac_address = extract_mac(line)
-                            if self.DEBUG:
-                                print("mac_address: " + str(mac_address))
-                            ip_address = line.split(" ", 1)[0]
-                            if self.DEBUG:
-                                print("ip_address: " + str(ip_address))
-                            #possible_name = "unknown"
-                
-                            if ip_address == self.own_ip:
-                                if self.DEBUG:
-                                    print("ip neighbor was own IP address, skipping")
-                                continue
-                
-                            if self.DEBUG:
-                                print("neighbor mac: " + str(mac_address) + ", and ip: " + str(ip_address))
-                            if valid_mac(mac_address) and valid_ip(ip_address):
+                            print("quick scan: skipping neighbor with invalid mac or ip: " + str(neighbor))
+                        continue
                     
-                                self.parse_found_device(ip_address, 'unnamed', mac_address)
+                    if neighbor.state == 'REACHABLE':
+                        self.liveness_cache.record(ip_address, mac_address, source='neighbor')
                     
-                        except Exception as ex:
-                            if self.DEBUG:
-                                print("error getting mac from ip neighbour line: " + str(ex))
-                #o = run("python q2.py",capture_output=True,text=True)
-                #print(o.stdout)
-            
-                #if self.DEBUG:
-                #    print("\narpa scan found devices list: " + str(device_dict))
+                    # It could be that the name was found by Avahi or NetBIOS, but they did not find the mac, which the neighbor table has instead
+                    found_device_name = self.name_resolver.lookup(ip_address) or "unnamed"
+                    if self.DEBUG and found_device_name != "unnamed":
+                        print("quick scan: neighbor: name from the name resolver: " + str(found_device_name))
+                    
+                    self.parse_found_device(ip_address, found_device_name, mac_address)
             
             except Exception as ex:
                 if self.DEBUG:
-                    print("quick scan: error while doing ip neighbour scan: " + str(ex))
+                    print("quick scan: error while reading the neighbor table: " + str(ex))
             
             """
             try:
@@ -1397,7 +1842,7 @@ class PresenceAdapter(Adapter):
             self.should_save = True
             
             if self.DEBUG:
-                print("\nQUICK SCAN COMPLETE\n")
+                print("\nQUICK SCAN COMPLETE in " + str(round(time.time() - started, 1)) + " seconds\n")
                 
         else:
             if self.DEBUG:
@@ -1414,6 +1859,119 @@ class PresenceAdapter(Adapter):
 
 
 
+    def handle_avahi_record(self, record, previous):
+        """ Called by the avahi browser when a service is resolved or removed. Keeps the avahi lookup table up to date. """
+        if record.event == '=':
+            if record.protocol != 'IPv4' or not valid_ip(record.address):
+                return
+            found_device_name = record.name
+            if record.name.startswith('CandleMQTT-') and record.service_type == '_mqtt._tcp':
+                found_device_name = "Candle " + record.name[len('CandleMQTT-'):]
+                self.candle_controllers_ip_list.add(record.address)
+            if self.DEBUG:
+                print("avahi browser: " + str(record.address) + " is " + str(found_device_name))
+            self.name_resolver.set(record.address, found_device_name, 'avahi')
+        
+        elif previous != None and previous.address != None:
+            # only forget the name if no other service still points to that address
+            if not any(other.address == previous.address for other in self.avahi_browser.snapshot()):
+                if self.DEBUG:
+                    print("avahi browser: " + str(previous.address) + " no longer has any services")
+                self.name_resolver.remove(previous.address, 'avahi')
+
+
+    def refresh_avahi_names(self):
+        """ The names of services that the avahi browser still has resolved don't expire. They are only forgotten when avahi reports the service is gone. """
+        if self.avahi_browser == None or not self.avahi_browser.running:
+            return
+        try:
+            for record in self.avahi_browser.snapshot():
+                self.handle_avahi_record(record, None)
+        except Exception as ex:
+            if self.DEBUG:
+                print("Error refreshing the avahi names: " + str(ex))
+
+
+    def handle_reverse_name(self, ip_address, name, source):
+        """ Called by the reverse resolver (from its own thread) when a PTR or LLMNR query found a name """
+        self.name_resolver.set(ip_address, name, source)
+
+
+    def request_reverse_names(self, neighbors_future):
+        """ Starts reverse lookups for the neighbors that no other source has a name for. Does not wait for the answers. """
+        if not self.use_reverse_lookups:
+            return
+        try:
+            for neighbor in neighbors_future.result():
+                if neighbor.state in PRESENT_STATES and neighbor.ip != self.own_ip and valid_ip(neighbor.ip) and self.name_resolver.lookup(neighbor.ip) == None:
+                    self.reverse_resolver.request(neighbor.ip)
+        except Exception as ex:
+            if self.DEBUG:
+                print("Error requesting reverse lookups: " + str(ex))
+
+
+    def netbios_scan(self, cancel=None):
+        """ Starts asking the network for NetBIOS names. Returns a future with a dictionary of ip -> name.
+        Uses the native client, or nbtscan if no UDP socket can be opened. A sweep that is still running from a previous quick scan is not started again. """
+        if self.target_network == None:
+            return None
+        if self.netbios_future != None and not self.netbios_future.done():
+            if self.DEBUG:
+                print("netbios: the previous sweep is still running")
+            return None
+        if not self.netbios_client.is_available():
+            nbtscan_command = ['nbtscan','-q','-e', str(self.target_network)]
+            nbtscan_future = self.probe_runtime.submit(nbtscan_command, self.quick_scan_source_timeouts['netbios'])
+            self.netbios_future = self.quick_scan_executor.submit(lambda: parse_nbtscan_output(nbtscan_future.result().stdout))
+        else:
+            self.netbios_future = self.quick_scan_executor.submit(self.netbios_sweep, cancel)
+        return self.netbios_future
+
+
+    def netbios_addresses(self):
+        """ Returns the known and recently seen hosts, plus the next chunk of the rest of the target network. A whole network is only covered over many sweeps. """
+        if self.netbios_range == None or self.netbios_range.network != self.target_network:
+            self.netbios_range = SweepRange(self.target_network, self.netbios_chunk_size)
+        addresses = []
+        for _id in list(self.previously_found.keys()):
+            ip_address = self.previously_found.get(_id, {}).get('ip')
+            if ip_address != None and ip_address != self.own_ip and ip_address in self.netbios_range and ip_address not in addresses:
+                addresses.append(ip_address)
+        for ip_address in self.liveness_cache.recent_addresses():
+            if ip_address != self.own_ip and ip_address in self.netbios_range and ip_address not in addresses:
+                addresses.append(ip_address)
+        addresses += next(self.netbios_range.chunks((), addresses + [self.own_ip]), [])
+        return addresses
+
+
+    def netbios_sweep(self, cancel=None):
+        """ Sends a node status request to the hosts from netbios_addresses, and waits for the replies. Stops early if cancel is set. """
+        addresses = self.netbios_addresses()
+        results = self.netbios_client.sweep(addresses, self.netbios_timeout, self.probe_scheduler.pace, cancel)
+        names = {}
+        for ip_address in results:
+            status = results[ip_address]
+            self.liveness_cache.record(ip_address, status.mac, 'netbios')
+            if status.name != None:
+                names[ip_address] = status.name
+        return names
+
+
+    def quick_scan_result(self, name, future, deadline, default):
+        """ Waits until the deadline for the result of one of the quick scan sources. Returns the default if the source failed or took too long. """
+        if future == None:
+            return default
+        try:
+            return future.result(timeout=max(0, deadline - time.time()))
+        except FutureTimeoutError:
+            if self.DEBUG:
+                print("quick scan: " + str(name) + " took too long, continuing without it")
+        except Exception as ex:
+            if self.DEBUG:
+                print("quick scan: " + str(name) + " failed: " + str(ex))
+        return default
+
+
     def parse_found_device(self,ip_address,found_device_name="unnamed",mac_address=""):
         if self.DEBUG:
             print("\nin parse_found_device")
@@ -1422,7 +1980,19 @@ class PresenceAdapter(Adapter):
         possible_name = found_device_name
         abort_adding = False
         
-        _id = mac_to_id(mac_address) #mac_address.replace(":", "")
+        _id = self.identity_of(mac_address) #mac_address.replace(":", "")
+        
+        # A randomized mac address that is not known yet could be the new address of a known device
+        hostname = None
+        dhcp = self.dhcp_identities.pop(str(mac_address).lower(), None)
+        if is_randomized(mac_address):
+            hostname = self.name_resolver.lookup(ip_address)
+            if _id not in self.previously_found:
+                existing_id = self.identities.find_identity(self.previously_found, mac_address, ip_address, hostname, dhcp=dhcp, protected=self.accepted_as_things)
+                if existing_id != None:
+                    self.identities.merge(self.previously_found, existing_id, mac_address)
+                    self.should_save = True
+                    _id = existing_id
         
         if self.DEBUG:
             print("__ mac               = " + str(mac_address))
@@ -1443,7 +2013,7 @@ class PresenceAdapter(Adapter):
         if _id not in self.previously_found:
             if self.DEBUG:
                 print("\n\n\n!? NEW ?!\n\nparse_found_device: _id NOT already in previously_found: " + str(_id) + ", ip: " + str(ip_address))
-                print("self.avahi_lookup_table: " + str(self.avahi_lookup_table))
+                print("self.name_resolver: " + str(self.name_resolver.statistics()))
                 print("self.candle_controllers_ip_list: " + str(self.candle_controllers_ip_list))
                 print("")
             
@@ -1457,32 +2027,16 @@ class PresenceAdapter(Adapter):
                 # if unnamed, try looking it up
                 if found_device_name == 'unnamed':
                     try:
-                        if ip_address in self.avahi_lookup_table:
+                        name_entry = self.name_resolver.lookup_entry(ip_address)
+                        if name_entry != None:
                             if self.DEBUG:
-                                print("parse_found_device: ip address was in avahi lookup table")
-                            found_device_name = str(self.avahi_lookup_table[ip_address]) # + ' (' + str(ip_address) + ')'
-        
-                        else:
-                            # Try to get hostname via NBT
-                            try:
-                                if ip_address in self.nbtscan_results:
-                                    if self.DEBUG:
-                                        print("parse_found_device: spotted IP address in nbtscan_results, so extracting name from there")
-                
-                                    for nbtscan_line in self.nbtscan_results.split('\n'):
-                                        if ip_address in nbtscan_line:
-                                            #line = line.replace("#PRE","")
-                                            nbtscan_line = nbtscan_line.rstrip()
-                                            nbtscan_parts = nbtscan_line.split("\t")
-                                            if len(nbtscan_parts) > 0:
-                                                #possible_name = "Presence - " + str(nbtscan_parts[1])
-                                                found_device_name = str(nbtscan_parts[1])
-                                                if self.DEBUG:
-                                                    print("name extracted from nbtscan_result: " + str(found_device_name))
-
-                            except Exception as ex:
-                                if self.DEBUG:
-                                    print("Error while getting name via nbtscan " + str(ex))
+                                print("parse_found_device: name from " + str(name_entry.source) + ": " + str(name_entry.name))
+                            found_device_name = name_entry.name
+                        elif self.use_reverse_lookups:
+                            # Only a cached answer is used here. If there is none, a lookup is started for the next scan.
+                            reverse_name = self.reverse_resolver.request(ip_address)
+                            if reverse_name != None:
+                                found_device_name = reverse_name
             
                             #try:
                                 #nmb_result = socket.gethostbyaddr(ip_address)
@@ -1685,6 +2239,16 @@ class PresenceAdapter(Adapter):
                 print("- name in previously found: " + str(self.previously_found[_id]['name']))
                 print("- adding/updating ip")
             self.previously_found[_id]['ip'] = ip_address
+            
+            if is_randomized(mac_address):
+                self.previously_found[_id]['randomized'] = True
+                self.previously_found[_id]['last_active'] = int(time.time())
+                if hostname != None:
+                    self.previously_found[_id]['hostname'] = hostname
+                if dhcp != None:
+                    for key in dhcp:
+                        if dhcp[key]:
+                            self.previously_found[_id]['dhcp_' + key] = dhcp[key]
         
             if self.DEBUG:
                 print("- adding/updating candle device boolean")
@@ -1762,6 +2326,7 @@ class PresenceAdapter(Adapter):
                     #self.accepted_as_things.append({device_id:{'name':original_title}})
                     self.accepted_as_things.append(device_id)
                     self.saved_devices_from_controller[device_id] = device
+                    self.deadlines.schedule(device_id, 'probe', time.time())
                     
                     """
                     
@@ -1846,6 +2411,10 @@ class PresenceAdapter(Adapter):
         try:
             #print("THING TO REMOVE:" + str(self.devices[device_id]))
             del self.previously_found[device_id]
+            self.deadlines.cancel(device_id)
+            if self.presence_history != None:
+                self.presence_history.forget(device_id)
+            self.probe_intervals.make_due(device_id)
             #print("2")
             obj = self.get_device(device_id)
             #print("3")
@@ -1898,57 +2467,83 @@ class PresenceAdapter(Adapter):
             if self.DEBUG:
                 print("Error in select_interface: " + str(ex))
             self.selected_interface = "wlan0"
+        self.icmp_sweeper.interface = self.selected_interface
+        self.arp_sweeper.interface = self.selected_interface
+
+
+    def update_target_network(self):
+        """ Figures out which network should be scanned """
+        if self.target_network_from_settings != None:
+            self.target_network = self.target_network_from_settings
+        else:
+            try:
+                interface_network = get_interface_network(self.selected_interface)
+                self.target_network = limit_network(interface_network.network, interface_network.ip)
+            except Exception as ex:
+                if self.DEBUG:
+                    print("Could not get the network of " + str(self.selected_interface) + ", will assume a /24 network: " + str(ex))
+                if valid_ip(self.own_ip):
+                    self.target_network = parse_target(self.own_ip)
+        if self.DEBUG:
+            print("target network: " + str(self.target_network))
         
             
     def ping(self, ip_address, count):
-        param = '-n' if platform.system().lower() == 'windows' else '-c'
-        #command = ["ping", param, count, "-i", 1, str(ip_address)]
-        command = "ping -I " + str(self.selected_interface) + " " + str(param) + " " + str(count) + " -i 0.5 " + str(ip_address)
-        #print("command: " + str(command))
-        #return str(subprocess.check_output(command, shell=True).decode())
-        try:
-            result = subprocess.run(command, shell=True, universal_newlines=True, stdout=subprocess.DEVNULL) #.decode())
-            #print("ping done")
-            return result.returncode
-        except Exception as ex:
-            if self.DEBUG:
-                print("error pinging! Error: " + str(ex))
+        if self.liveness_cache.is_alive(ip_address):
+            return 0
+        
+        if self.icmp_sweeper.is_available():
+            try:
+                if str(ip_address) in self.icmp_sweeper.sweep([ip_address], self.icmp_sweep_timeout * count):
+                    self.liveness_cache.record(ip_address, source='ping')
+                    return 0
+                return 1
+            except Exception as ex:
+                if self.DEBUG:
+                    print("ICMP ping failed, will use the ping command instead. Error: " + str(ex))
+        
+        result = self.probe_runtime.run(self.ping_command(ip_address, count), _TIMEOUT + count)
+        if result.returncode == None: # deadline passed
             return 1
+        if result.returncode == 0:
+            self.liveness_cache.record(ip_address, source='ping')
+        return result.returncode
 
 
-    def arping(self, ip_address, count):
+    def ping_command(self, ip_address, count):
         param = '-n' if platform.system().lower() == 'windows' else '-c'
-        command = "sudo arping -i " + str(self.selected_interface) + " " + str(param) + " " + str(count) + " " + str(ip_address)
+        return ["ping", "-I", str(self.selected_interface), param, str(count), "-i", "0.5", str(ip_address)]
+
+
+    def arping(self, ip_address, count):
+        if self.liveness_cache.is_alive(ip_address):
+            return 0
+        
+        command = self.arping_command(ip_address, count)
         if self.DEBUG:
             print("arping command: " + str(command))
-        try:
-            result = subprocess.run(command, shell=True, universal_newlines=True, stdout=subprocess.DEVNULL) #.decode())
-            return result.returncode
-        except Exception as ex:
-            if self.DEBUG:
-                print("error arpinging! Error: " + str(ex))
+        result = self.probe_runtime.run(command, _TIMEOUT + count)
+        if result.returncode == None: # deadline passed
             return 1
+        if result.returncode == 0:
+            self.liveness_cache.record(ip_address, source='arping')
+        return result.returncode
+
+
+    def arping_command(self, ip_address, count):
+        param = '-n' if platform.system().lower() == 'windows' else '-c'
+        return ["sudo", "arping", "-i", str(self.selected_interface), param, str(count), str(ip_address)]
 
 
     def arp(self, ip_address):
+        """ Returns the neighbor table entry (ip, mac, interface, state) for an IP address on the selected interface, or None """
         if valid_ip(ip_address):
-            command = "arp -i " + str(self.selected_interface) + " " + str(ip_address)
             try:
-                result = subprocess.run(command, shell=True, universal_newlines=True, stdout=subprocess.PIPE) #.decode())
-                for line in result.stdout.split('\n'):
-                    mac_addresses = re.findall(r'(([0-9a-fA-F]{1,2}:){5}[0-9a-fA-F]{1,2})', str(line))
-                    if len(mac_addresses):
-                        #print("util: arp: mac in line: " + line)
-                        return str(line)
-                
-                return str(result.stdout)
-
+                return self.neighbor_table.lookup(ip_address, self.selected_interface)
             except Exception as ex:
                 if self.DEBUG:
                     print("Arp error: " + str(ex))
-                result = 'error'
-            return result
-            #return str(subprocess.check_output(command, shell=True).decode())
+        return None
         
     
     
@@ -1962,15 +2557,11 @@ class PresenceAdapter(Adapter):
             #with open(self.persistence_file_path, 'w') as fp:
                 #json.dump(self.previously_found, fp)
             
-            data_to_write = {'devices':self.previously_found,
-                            'mayor_version':self.mayor_version,
-                            'meso_version':self.meso_version
+            # Only the devices that changed since the last save are appended to the journal. Once in a while the json file is rewritten as a whole.
+            metadata = {'mayor_version':self.mayor_version,
+                        'meso_version':self.meso_version
                     }
-                
-            j = json.dumps(data_to_write, indent=4) # Pretty printing to the file
-            f = open(self.persistence_file_path, 'w')
-            print(j, file=f)
-            f.close()
+            self.persistence.save(self.previously_found, metadata)
                 
         except Exception as ex:
             print("Saving to json file failed: " + str(ex))
@@ -1996,6 +2587,24 @@ class PresenceAdapter(Adapter):
             print("Network presence detector is being unloaded")
         self.save_to_json()
         self.running = False
+        self.deadlines.wake()
+        self.probe_runtime.stop()
+        self.quick_scan_executor.shutdown(wait=False)
+        self.rolling_sweep_executor.shutdown(wait=False)
+        self.reverse_resolver.stop()
+        if self.avahi_browser != None:
+            self.avahi_browser.stop()
+        if self.neighbor_monitor != None:
+            self.neighbor_monitor.stop()
+        if self.passive_listener != None:
+            self.passive_listener.stop()
+        if isinstance(self.persistence, SqliteDeviceStore):
+            self.persistence.close()
+        if self.presence_history != None:
+            try:
+                self.presence_history.save()
+            except Exception as ex:
+                print("Error saving presence history: " + str(ex))
         
         
         
@@ -3,12 +3,13 @@
 import os
 import re
 import json
-#import time
+import time
 #from time import sleep
 #import socket
 import requests
 import subprocess
 #from .util import *
+from .presence_history import parse_time_range
 
 #from .util import valid_ip, arpa_detect_gateways
 
@@ -68,6 +69,25 @@ class NetworkPresenceAPIHandler(APIHandler):
 #  HANDLE REQUEST
 #
 
+    def thing_names(self, ids):
+        names = {}
+        for _id in ids:
+            if _id in self.adapter.previously_found:
+                names[_id] = self.adapter.previously_found[_id].get('name')
+        return names
+
+
+    def history_unavailable(self):
+        return APIResponse(
+          status=200,
+          content_type='application/json',
+          content=json.dumps({'state':'error',
+                              'message':'The presence history is not available, because NumPy is not installed',
+                              'debug':self.adapter.DEBUG
+                          }),
+        )
+
+
     def handle_request(self, request):
         """
         Handle a new API request for this handler.
@@ -105,6 +125,64 @@ class NetworkPresenceAPIHandler(APIHandler):
                                           }),
                         )
                         
+                    elif action == 'progress':
+                        return APIResponse(
+                          status=200,
+                          content_type='application/json',
+                          content=json.dumps({'state':'ok',
+                                              'brute_force_scan':self.adapter.probe_scheduler.progress(),
+                                              'busy_doing_brute_force_scan':self.adapter.busy_doing_brute_force_scan,
+                                              'last_brute_force_scan_duration':self.adapter.last_brute_force_scan_duration,
+                                              'probe_intervals':self.adapter.probe_intervals.statistics(),
+                                              'property_updates':self.adapter.property_batch.statistics(),
+                                              'liveness_cache':self.adapter.liveness_cache.statistics(),
+                                              'names':self.adapter.name_resolver.statistics(),
+                                              'reverse_lookups':self.adapter.reverse_resolver.statistics(),
+                                              'identities':self.adapter.identities.statistics(),
+                                              'persistence':self.adapter.persistence.statistics(),
+                                              'presence_history':self.adapter.presence_history.statistics() if self.adapter.presence_history != None else None,
+                                              'debug':self.adapter.DEBUG
+                                          }),
+                        )
+                        
+                    elif action == 'uptime':
+                        # How many minutes each thing was present on each of the last days
+                        if self.adapter.presence_history == None:
+                            return self.history_unavailable()
+                        days = min(max(int(request.body.get('days', 1)), 1), 7)
+                        day_starts, uptime = self.adapter.presence_history.uptime_per_day(days)
+                        
+                        return APIResponse(
+                          status=200,
+                          content_type='application/json',
+                          content=json.dumps({'state':'ok',
+                                              'days':day_starts,
+                                              'uptime':uptime,
+                                              'names':self.thing_names(uptime.keys()),
+                                              'debug':self.adapter.DEBUG
+                                          }),
+                        )
+                    
+                    elif action == 'anyone_home':
+                        # Was anyone home between two times? The times can be timestamps or clock times like '02:00'.
+                        if self.adapter.presence_history == None:
+                            return self.history_unavailable()
+                        start, end = parse_time_range(request.body.get('start', time.time() - 3600), request.body.get('end', time.time()))
+                        result = self.adapter.presence_history.anyone_present(start, end, request.body.get('things'))
+                        result['uptime'] = self.adapter.presence_history.uptime(start, end, result['devices'])
+                        
+                        return APIResponse(
+                          status=200,
+                          content_type='application/json',
+                          content=json.dumps({'state':'ok',
+                                              'start':start,
+                                              'end':end,
+                                              'result':result,
+                                              'names':self.thing_names(result['devices']),
+                                              'debug':self.adapter.DEBUG
+                                          }),
+                        )
+                        
                     elif action == 'scan':
                         state = 'error'
                         
@@ -137,6 +137,7 @@ class PresenceDevice(Device):
                 # remember when the last request to add mute time happened
                 self.adapter.previously_found[self._id]['last_data_mute_request_time'] = timestamp
                 self.adapter.should_save = True
+                self.adapter.deadlines.schedule(self._id, 'probe', time.time()) # the next keepalive round applies the mute
                 
         except Exception as ex:
             if self.adapter.DEBUG:
@@ -0,0 +1,223 @@
+"""Presence history. Remembers for every device, for every minute of the last days, whether it was present. One bit per device per minute, in a NumPy ring buffer that is saved to disk."""
+
+import os
+import time
+import threading
+
+try:
+    import numpy as np
+except ImportError:
+    np = None # The history is not available without NumPy
+
+
+
+def local_midnight(timestamp):
+    """ Returns the timestamp of the start of the (local) day """
+    parts = time.localtime(timestamp)
+    return time.mktime((parts.tm_year, parts.tm_mon, parts.tm_mday, 0, 0, 0, 0, 0, -1))
+
+
+def parse_time_range(start, end, now=None):
+    """ Turns a start and end into timestamps. They can be timestamps, or clock times like '02:00'.
+    Clock times refer to the most recent time that range ended, so '02:00' to '04:00' at 03:00 means yesterday night. """
+    if now == None:
+        now = time.time()
+
+    def clock_time(value, day):
+        hours, minutes = str(value).strip().split(':')
+        return day + int(hours) * 3600 + int(minutes) * 60
+
+    if ':' not in str(start) and ':' not in str(end):
+        return float(start), float(end)
+    day = local_midnight(now)
+    start_time = clock_time(start, day)
+    end_time = clock_time(end, day)
+    if end_time <= start_time:
+        start_time -= 86400 # e.g. 22:00 to 06:00
+    if end_time > now:
+        start_time -= 86400
+        end_time -= 86400
+    return start_time, end_time
+
+
+
+class PresenceHistory:
+    """ A (devices x minutes) bit array, packed 8 minutes per byte. The column of a minute is its number since the epoch, modulo the number of minutes that are kept.
+    When time moves on, the columns of the minutes that were skipped are cleared, since they hold data from the previous lap around the ring. """
+
+    def __init__(self, path=None, days=7, debug=False):
+        if np == None:
+            raise ImportError('the presence history needs NumPy')
+        self.DEBUG = debug
+        self.path = path
+        self.minutes = days * 1440
+        self.lock = threading.Lock()
+        self.rows = {} # device id -> row
+        self.bits = np.zeros((16, self.minutes // 8), dtype=np.uint8)
+        self.last_minute = None # the most recent minute that the ring holds
+
+        if path != None and os.path.isfile(path):
+            self.load()
+
+
+    def advance(self, minute):
+        """ Moves the ring forward to a minute, clearing the columns that are reused """
+        if self.last_minute != None and minute <= self.last_minute:
+            return
+        if self.last_minute == None or minute - self.last_minute >= self.minutes:
+            self.bits[:] = 0
+        else:
+            columns = np.arange(self.last_minute + 1, minute + 1) % self.minutes
+            mask = np.zeros(self.minutes, dtype=np.uint8)
+            mask[columns] = 1
+            self.bits &= ~np.packbits(mask)
+        self.last_minute = minute
+
+
+    def row(self, _id):
+        if _id not in self.rows:
+            if len(self.rows) == self.bits.shape[0]:
+                self.bits = np.vstack((self.bits, np.zeros_like(self.bits)))
+            self.rows[_id] = len(self.rows)
+        return self.rows[_id]
+
+
+    def record(self, ids, when=None):
+        """ Marks the devices as present in the minute of `when` """
+        if when == None:
+            when = time.time()
+        minute = int(when // 60)
+        with self.lock:
+            self.advance(minute)
+            if minute <= self.last_minute - self.minutes:
+                return # too old to be kept
+            column = minute % self.minutes
+            rows = [self.row(_id) for _id in ids]
+            if len(rows) > 0:
+                self.bits[rows, column >> 3] |= np.uint8(0x80 >> (column & 7))
+
+
+    def record_range(self, ids, start, end):
+        """ Marks the devices as present in every minute from the minute of `start` up to and including the minute of `end` """
+        first = int(start // 60)
+        last = int(end // 60)
+        if last < first:
+            return
+        with self.lock:
+            self.advance(last)
+            first = max(first, self.last_minute - self.minutes + 1) # older minutes are not kept
+            if last < first:
+                return
+            rows = [self.row(_id) for _id in ids]
+            if len(rows) > 0:
+                mask = np.zeros(self.minutes, dtype=np.uint8)
+                mask[np.arange(first, last + 1) % self.minutes] = 1
+                self.bits[rows] |= np.packbits(mask)
+
+
+    def forget(self, _id):
+        """ Removes a device. Its row is reused by the next new device. """
+        with self.lock:
+            if _id not in self.rows:
+                return
+            row = self.rows.pop(_id)
+            last = len(self.rows)
+            if row != last:
+                # move the last row into the gap, so the rows stay packed
+                moved_id = [other for other in self.rows if self.rows[other] == last][0]
+                self.bits[row] = self.bits[last]
+                self.rows[moved_id] = row
+            self.bits[last] = 0
+
+
+    def matrix(self, start, end, ids=None):
+        """ Returns (device ids, bool array of devices x minutes) for the minutes from start up to end. Minutes that are not kept (any more) count as absent. """
+        first = int(start // 60)
+        last = int(end // 60) # not included
+        with self.lock:
+            if ids == None:
+                ids = list(self.rows.keys())
+            ids = [_id for _id in ids if _id in self.rows]
+            if last <= first or self.last_minute == None or len(ids) == 0:
+                return ids, np.zeros((len(ids), max(0, last - first)), dtype=bool)
+            minutes = np.arange(first, last)
+            kept = (minutes <= self.last_minute) & (minutes > self.last_minute - self.minutes)
+            present = np.unpackbits(self.bits[[self.rows[_id] for _id in ids]], axis=1)[:, minutes % self.minutes].astype(bool)
+            present[:, ~kept] = False
+            return ids, present
+
+
+    def uptime(self, start, end, ids=None):
+        """ Returns a dictionary of device id -> minutes present between start and end """
+        ids, present = self.matrix(start, end, ids)
+        totals = present.sum(axis=1)
+        return {_id: int(totals[index]) for index, _id in enumerate(ids)}
+
+
+    def uptime_per_day(self, days=7, now=None, ids=None):
+        """ Returns the start of each of the last days (oldest first), and a dictionary of device id -> minutes present on each of those days """
+        if now == None:
+            now = time.time()
+        starts = []
+        day = local_midnight(now)
+        for _ in range(days):
+            starts.insert(0, day)
+            day = local_midnight(day - 1)
+        ids, present = self.matrix(starts[0], now, ids)
+        # the minutes where each day starts, relative to the first one. Days with a daylight saving change are not 1440 minutes long.
+        boundaries = [int(start // 60) - int(starts[0] // 60) for start in starts]
+        if present.shape[1] == 0:
+            per_day = np.zeros((len(ids), days), dtype=int)
+        else:
+            per_day = np.add.reduceat(present.astype(np.int32), [min(boundary, present.shape[1] - 1) for boundary in boundaries], axis=1)
+            per_day[:, [boundary >= present.shape[1] for boundary in boundaries]] = 0
+        return starts, {_id: [int(minutes) for minutes in per_day[index]] for index, _id in enumerate(ids)}
+
+
+    def anyone_present(self, start, end, ids=None):
+        """ Returns which devices were present at some point between start and end, and in how many minutes at least one of them was """
+        ids, present = self.matrix(start, end, ids)
+        return {'anyone':bool(present.any()),
+                'minutes_with_anyone':int(present.any(axis=0).sum()),
+                'devices':[_id for index, _id in enumerate(ids) if present[index].any()]
+                }
+
+
+    def save(self):
+        """ Writes the history to disk. The file is replaced atomically. """
+        if self.path == None:
+            return
+        with self.lock:
+            ids = sorted(self.rows, key=lambda _id: self.rows[_id])
+            temporary_path = self.path + '.tmp'
+            with open(temporary_path, 'wb') as file:
+                np.savez(file, bits=self.bits[:len(ids)], ids=np.array(ids, dtype=str), last_minute=np.array(self.last_minute if self.last_minute != None else -1), minutes=np.array(self.minutes))
+            os.replace(temporary_path, self.path)
+
+
+    def load(self):
+        try:
+            with np.load(self.path) as data:
+                if int(data['minutes']) != self.minutes:
+                    print("presence history: the saved history covers a different number of days, starting over")
+                    return
+                ids = [str(_id) for _id in data['ids']]
+                bits = data['bits']
+                last_minute = int(data['last_minute'])
+            with self.lock:
+                self.bits = np.zeros((max(16, len(ids) * 2), self.minutes // 8), dtype=np.uint8)
+                self.bits[:len(ids)] = bits
+                self.rows = {_id: row for row, _id in enumerate(ids)}
+                self.last_minute = last_minute if last_minute >= 0 else None
+            if self.DEBUG:
+                print("presence history: loaded the history of " + str(len(ids)) + " devices")
+        except Exception as ex:
+            print("presence history: could not load " + str(self.path) + ": " + str(ex))
+
+
+    def statistics(self):
+        with self.lock:
+            return {'devices':len(self.rows),
+                    'minutes':self.minutes,
+                    'bytes':int(self.bits.nbytes)
+                    }
@@ -1,5 +1,6 @@
 """Network presence adapter for WebThings Gateway."""
 
+import time
 from gateway_addon import Property
 
 class PresenceProperty(Property):
@@ -51,6 +52,8 @@ class PresenceProperty(Property):
                 #print("self.device._id = " + str(self.device._id))
                 #print("prev found keys: " + str( self.device.adapter.previously_found.keys() ))
                 self.device.adapter.previously_found[self.device._id]['data-collection'] = bool(value)
+                self.device.adapter.probe_intervals.make_due(self.device._id)
+                self.device.adapter.deadlines.schedule(self.device._id, 'probe', time.time())
                 #self.update(value)
                 self.set_cached_value(value)
                 self.device.notify_property_changed(self)
@@ -0,0 +1,76 @@
+"""Adaptive probe intervals. Devices that stay present (or stay away) are probed less and less often, devices that just changed, or are about to expire, are probed every round."""
+
+import time
+import threading
+
+
+
+class AdaptiveProbeIntervals:
+    """ Keeps track of when each device should be probed next.
+    Every probe with the same outcome as the one before doubles the device's interval, up to max_interval. A different outcome resets it to base_interval.
+    The next probe is never planned later than shortly before the moment the device's state would change by itself (its expiry). """
+
+    def __init__(self, base_interval=60, max_interval=600, debug=False):
+        self.DEBUG = debug
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self.lock = threading.Lock()
+
+        self.interval = {}      # _id -> current interval in seconds
+        self.next_probe = {}    # _id -> time at which the device should be probed again
+        self.last_result = {}   # _id -> outcome of the last probe (or sighting)
+
+        self.probes_due = 0     # how often a device was probed because it was due
+        self.probes_skipped = 0 # how often a probe was skipped because the device was not due yet
+
+
+    def is_due(self, _id, now=None):
+        """ Returns True if the device should be probed now. Also counts the probes that are skipped. """
+        if now == None:
+            now = time.time()
+        with self.lock:
+            if now >= self.next_probe.get(_id, 0):
+                self.probes_due += 1
+                return True
+            self.probes_skipped += 1
+            return False
+
+
+    def record(self, _id, found, expiry=None, now=None):
+        """ Plans the next probe of a device.
+        found -- the outcome of the probe
+        expiry -- optional time at which the device would change state if nothing more is heard from it (e.g. the end of its time window). An expiry in the past (a device that is already away) is ignored. """
+        if now == None:
+            now = time.time()
+        with self.lock:
+            if _id in self.last_result and self.last_result[_id] == found:
+                interval = min(self.interval.get(_id, self.base_interval) * 2, self.max_interval)
+            else:
+                interval = self.base_interval # the state just changed, so keep a close eye on it
+            self.interval[_id] = interval
+            self.last_result[_id] = found
+
+            next_probe = now + interval
+            if expiry != None and expiry > now:
+                # probe one round before the device would expire, so that a single missed reply does not make it look away
+                next_probe = min(next_probe, expiry - 2 * self.base_interval)
+            self.next_probe[_id] = max(next_probe, now + self.base_interval)
+
+        if self.DEBUG:
+            print("probe interval of " + str(_id) + " is now " + str(interval) + " seconds, next probe in " + str(int(self.next_probe[_id] - now)) + " seconds")
+
+
+    def make_due(self, _id):
+        """ Makes sure the device is probed in the next round, e.g. because its settings changed """
+        with self.lock:
+            self.next_probe.pop(_id, None)
+            self.interval.pop(_id, None)
+            self.last_result.pop(_id, None)
+
+
+    def statistics(self):
+        with self.lock:
+            return {'due':self.probes_due,
+                    'skipped':self.probes_skipped,
+                    'intervals':dict(self.interval)
+                    }
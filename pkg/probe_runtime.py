@@ -0,0 +1,107 @@
+"""Asyncio probe runtime. Runs probe commands (ping, arping, arp, etc) without a shell, with bounded concurrency and a deadline per probe."""
+
+import asyncio
+import threading
+import subprocess
+from collections import namedtuple
+
+
+
+class ProbeResult(namedtuple('ProbeResult', ['returncode', 'stdout', 'timed_out'])):
+    """ The outcome of a probe command. A result is truthy when the command succeeded (exit code 0). """
+    __slots__ = ()
+
+    def __bool__(self):
+        return self.returncode == 0
+
+
+FAILED = ProbeResult(1, '', False)
+
+
+
+class ProbeRuntime:
+    """ Owns an asyncio event loop in a background thread. Other threads submit probe commands to it and get concurrent.futures.Future objects back. """
+
+    def __init__(self, max_concurrent=32, debug=False):
+        self.DEBUG = debug
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.loop = None
+        self.thread = None
+        self.semaphore = None
+        self.running = False
+        self.start_lock = threading.Lock()
+
+
+    def start(self):
+        with self.start_lock:
+            if self.running:
+                return
+            self.loop = asyncio.new_event_loop()
+            self.thread = threading.Thread(target=self._run_loop, name='probe-runtime')
+            self.thread.daemon = True
+            self.thread.start()
+            # the semaphore has to be created inside the loop on older versions of Python
+            asyncio.run_coroutine_threadsafe(self._create_semaphore(), self.loop).result()
+            self.running = True
+
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+
+    async def _create_semaphore(self):
+        self.semaphore = asyncio.Semaphore(self.max_concurrent)
+
+
+    def stop(self):
+        if not self.running:
+            return
+        self.running = False
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(2)
+
+
+    async def _probe(self, command, timeout):
+        async with self.semaphore:
+            try:
+                process = await asyncio.create_subprocess_exec(*command,
+                                                               stdin=subprocess.DEVNULL,
+                                                               stdout=subprocess.PIPE,
+                                                               stderr=subprocess.DEVNULL)
+            except Exception as ex:
+                if self.DEBUG:
+                    print("probe runtime: could not start " + str(command[0]) + ": " + str(ex))
+                return FAILED
+
+            try:
+                stdout, _ = await asyncio.wait_for(process.communicate(), timeout)
+            except asyncio.TimeoutError:
+                if self.DEBUG:
+                    print("probe runtime: deadline passed for: " + ' '.join(command))
+                try:
+                    process.kill()
+                except ProcessLookupError:
+                    pass
+                await process.wait()
+                return ProbeResult(None, '', True)
+
+            return ProbeResult(process.returncode, stdout.decode('utf-8', errors='replace'), False)
+
+
+    def submit(self, command, timeout=10):
+        """ Schedules a command (a list of arguments) and returns a concurrent.futures.Future with its ProbeResult """
+        if not self.running:
+            self.start()
+        command = [str(part) for part in command]
+        return asyncio.run_coroutine_threadsafe(self._probe(command, timeout), self.loop)
+
+
+    def run(self, command, timeout=10):
+        """ Runs a command and blocks until its ProbeResult is available """
+        try:
+            return self.submit(command, timeout).result()
+        except Exception as ex:
+            if self.DEBUG:
+                print("probe runtime: error running " + str(command) + ": " + str(ex))
+            return FAILED
@@ -0,0 +1,165 @@
+"""Probe scheduler. Runs network probes with a concurrency limit and a packets-per-second budget."""
+
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+
+class ProbeScheduler:
+    """ Spreads probes over a limited number of workers, and paces them with a token bucket so the network isn't flooded """
+
+    def __init__(self, concurrency=8, packets_per_second=100, debug=False):
+        self.DEBUG = debug
+        self.concurrency = 8
+        self.packets_per_second = 100
+        self.configure(concurrency, packets_per_second)
+
+        self.lock = threading.Lock()
+        self.tokens = float(self.packets_per_second)
+        self.last_refill = time.time()
+
+        # progress of the current (or last) run
+        self.total = 0
+        self.done = 0
+        self.found = 0
+        self.started = None
+        self.finished = None
+
+
+    def configure(self, concurrency=None, packets_per_second=None):
+        if concurrency != None:
+            self.concurrency = max(1, int(concurrency))
+        if packets_per_second != None:
+            self.packets_per_second = max(1, int(packets_per_second))
+
+
+    def pace(self):
+        """ Blocks until the packet budget allows another packet to be sent """
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(float(self.packets_per_second), self.tokens + (now - self.last_refill) * self.packets_per_second)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.packets_per_second
+            time.sleep(wait)
+
+
+    def run(self, targets, probe, progress_callback=None):
+        """ Calls probe(target) for every target, at most `concurrency` at a time, and returns a dictionary of target -> result.
+        A probe that returns something truthy counts as found.
+        progress_callback -- optional function that is called with the progress dictionary after every probe """
+        targets = list(targets)
+        results = {}
+        self._begin(len(targets))
+
+        def paced_probe(target):
+            self.pace()
+            try:
+                result = probe(target)
+            except Exception as ex:
+                if self.DEBUG:
+                    print("probe scheduler: probe of " + str(target) + " failed: " + str(ex))
+                result = None
+            self._record(results, target, result, progress_callback)
+            return result
+
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            list(executor.map(paced_probe, targets))
+
+        self._end()
+        return results
+
+
+    def run_futures(self, targets, submit, progress_callback=None):
+        """ Like run(), but submit(target) starts the probe and returns a concurrent.futures.Future (e.g. from the probe runtime).
+        No worker threads are needed, the concurrency limit is enforced by not submitting more than `concurrency` probes at a time. """
+        targets = list(targets)
+        results = {}
+        self._begin(len(targets))
+        slots = threading.BoundedSemaphore(self.concurrency)
+        futures = []
+
+        def make_callback(target):
+            def callback(future):
+                try:
+                    result = future.result()
+                except Exception as ex:
+                    if self.DEBUG:
+                        print("probe scheduler: probe of " + str(target) + " failed: " + str(ex))
+                    result = None
+                self._record(results, target, result, progress_callback)
+                slots.release()
+            return callback
+
+        for target in targets:
+            slots.acquire()
+            self.pace()
+            try:
+                future = submit(target)
+            except Exception as ex:
+                if self.DEBUG:
+                    print("probe scheduler: could not submit probe of " + str(target) + ": " + str(ex))
+                self._record(results, target, None, progress_callback)
+                slots.release()
+                continue
+            futures.append(future)
+            future.add_done_callback(make_callback(target))
+
+        wait(futures)
+        # the done callbacks may still be running
+        for _ in range(self.concurrency):
+            slots.acquire()
+        for _ in range(self.concurrency):
+            slots.release()
+
+        self._end()
+        return results
+
+
+    def _begin(self, total):
+        with self.lock:
+            self.total = total
+            self.done = 0
+            self.found = 0
+            self.started = time.time()
+            self.finished = None
+
+
+    def _record(self, results, target, result, progress_callback):
+        with self.lock:
+            results[target] = result
+            self.done += 1
+            if result:
+                self.found += 1
+        if progress_callback != None:
+            try:
+                progress_callback(self.progress())
+            except Exception as ex:
+                if self.DEBUG:
+                    print("probe scheduler: progress callback error: " + str(ex))
+
+
+    def _end(self):
+        with self.lock:
+            self.finished = time.time()
+        if self.DEBUG:
+            print("probe scheduler: " + str(self.total) + " probes done in " + str(round(self.finished - self.started, 1)) + " seconds, " + str(self.found) + " found")
+
+
+    def progress(self):
+        """ Returns a dictionary describing the progress of the current or last run """
+        duration = None
+        if self.started != None:
+            duration = (self.finished or time.time()) - self.started
+        return {'total':self.total,
+                'done':self.done,
+                'found':self.found,
+                'busy':self.started != None and self.finished == None,
+                'started':self.started,
+                'finished':self.finished,
+                'duration':duration
+                }
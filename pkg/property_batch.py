@@ -0,0 +1,55 @@
+"""Property update batch. Collects the property changes of a clock round, drops the ones that don't change anything, and sends the rest in one go."""
+
+import threading
+
+
+
+class PropertyUpdateBatch:
+    """ Holds the latest value for every property until flush() is called. Setting the same property twice in one round only sends the last value.
+    Values that are the same as what the gateway already has are not sent at all. """
+
+    def __init__(self, debug=False):
+        self.DEBUG = debug
+        self.lock = threading.Lock()
+        self.pending = {} # (device id, property name) -> (property, value)
+
+        self.requested = 0 # how many updates were asked for
+        self.sent = 0      # how many notifications were actually sent to the gateway
+
+
+    def add(self, prop, value):
+        with self.lock:
+            self.requested += 1
+            self.pending[(prop.device.id, prop.name)] = (prop, value)
+
+
+    def flush(self):
+        """ Sends the changed values to the gateway. Returns how many were sent. """
+        with self.lock:
+            pending = list(self.pending.values())
+            self.pending = {}
+
+        sent = 0
+        for prop, value in pending:
+            try:
+                if value != prop.value:
+                    prop.set_cached_value(value)
+                    prop.device.notify_property_changed(prop)
+                    sent += 1
+            except Exception as ex:
+                if self.DEBUG:
+                    print("property batch: could not update " + str(prop.name) + ": " + str(ex))
+
+        with self.lock:
+            self.sent += sent
+        if self.DEBUG and len(pending) > 0:
+            print("property batch: sent " + str(sent) + " of " + str(len(pending)) + " property updates")
+        return sent
+
+
+    def statistics(self):
+        with self.lock:
+            return {'requested':self.requested,
+                    'sent':self.sent,
+                    'saved':self.requested - self.sent - len(self.pending)
+                    }
@@ -0,0 +1,358 @@
+"""Reverse resolver. Looks up the names of IP addresses with PTR queries to the local DNS server and with LLMNR, in the background, from a single UDP socket."""
+
+import time
+import random
+import select
+import socket
+import struct
+import threading
+from collections import deque, namedtuple
+
+
+DNS_PORT = 53
+LLMNR_PORT = 5355
+
+TYPE_PTR = 12
+CLASS_IN = 1
+
+FLAG_RESPONSE = 0x8000
+FLAG_RECURSION_DESIRED = 0x0100
+RCODE_MASK = 0x000f
+
+HEADER = struct.Struct('!HHHHHH') # transaction id, flags, questions, answers, authority records, additional records
+
+CachedName = namedtuple('CachedName', ['name', 'source', 'expires'])
+
+
+
+def read_nameservers(path='/etc/resolv.conf'):
+    """ Returns the IPv4 nameservers from resolv.conf """
+    nameservers = []
+    try:
+        with open(path) as file:
+            for line in file:
+                parts = line.split()
+                if len(parts) > 1 and parts[0] == 'nameserver' and parts[1].count('.') == 3:
+                    nameservers.append(parts[1])
+    except Exception:
+        pass
+    return nameservers
+
+
+def reverse_name(ip_address):
+    """ 192.168.1.5 -> 5.1.168.192.in-addr.arpa """
+    return '.'.join(reversed(str(ip_address).split('.'))) + '.in-addr.arpa'
+
+
+def encode_name(name):
+    encoded = b''
+    for label in name.strip('.').split('.'):
+        label = label.encode('utf-8')
+        encoded += bytes([len(label)]) + label
+    return encoded + b'\x00'
+
+
+def build_ptr_query(transaction_id, ip_address, recursion=True):
+    """ Returns a PTR query for the name of an IP address. LLMNR queries must not ask for recursion. """
+    flags = FLAG_RECURSION_DESIRED if recursion else 0
+    return HEADER.pack(transaction_id & 0xffff, flags, 1, 0, 0, 0) + encode_name(reverse_name(ip_address)) + struct.pack('!HH', TYPE_PTR, CLASS_IN)
+
+
+def read_name(data, offset):
+    """ Reads a (possibly compressed) domain name. Returns the name and the offset just after it. """
+    labels = []
+    end = None
+    jumps = 0
+    while True:
+        length = data[offset]
+        if length == 0:
+            offset += 1
+            break
+        if length & 0xc0 == 0xc0:
+            if end == None:
+                end = offset + 2
+            offset = ((length & 0x3f) << 8) | data[offset + 1]
+            jumps += 1
+            if jumps > 32:
+                raise ValueError('too many compression pointers')
+            continue
+        labels.append(data[offset + 1:offset + 1 + length].decode('utf-8', errors='replace'))
+        offset += 1 + length
+    if end == None:
+        end = offset
+    return '.'.join(labels), end
+
+
+def parse_ptr_response(data):
+    """ Returns (transaction id, response code, list of (name, ttl)) of a PTR response, or None if it isn't a response """
+    try:
+        if len(data) < HEADER.size:
+            return None
+        transaction_id, flags, questions, answers, authority, additional = HEADER.unpack_from(data, 0)
+        if not flags & FLAG_RESPONSE:
+            return None
+        offset = HEADER.size
+        for _ in range(questions):
+            offset = read_name(data, offset)[1] + 4
+        names = []
+        for _ in range(answers):
+            offset = read_name(data, offset)[1]
+            record_type, record_class, ttl, length = struct.unpack_from('!HHIH', data, offset)
+            offset += 10
+            if record_type == TYPE_PTR:
+                names.append((read_name(data, offset)[0], ttl))
+            offset += length
+        return transaction_id, flags & RCODE_MASK, names
+    except Exception:
+        return None
+
+
+def build_ptr_response(query, name=None, ttl=3600):
+    """ Builds the answer a DNS server would give to a PTR query. Without a name, the answer is 'no such name'. Can be used as a stub server. """
+    transaction_id, flags = struct.unpack_from('!HH', query, 0)
+    question_end = read_name(query, HEADER.size)[1] + 4
+    question = query[HEADER.size:question_end]
+    if name == None:
+        return HEADER.pack(transaction_id, FLAG_RESPONSE | (flags & FLAG_RECURSION_DESIRED) | 0x0080 | 3, 1, 0, 0, 0) + question
+    rdata = encode_name(name)
+    answer = struct.pack('!H', 0xc000 | HEADER.size) + struct.pack('!HHIH', TYPE_PTR, CLASS_IN, ttl, len(rdata)) + rdata
+    return HEADER.pack(transaction_id, FLAG_RESPONSE | (flags & FLAG_RECURSION_DESIRED) | 0x0080, 1, 1, 0, 0) + question + answer
+
+
+def hostname_label(name):
+    """ laptop.fritz.box. -> laptop """
+    return str(name).strip('.').split('.')[0]
+
+
+
+class ReverseResolver:
+    """ Looks up names in a background thread. request() never blocks: it returns a cached name (or None), and queues a lookup if nothing is cached.
+    Every address is asked from the DNS server(s) and, with LLMNR, from the device itself. At most `max_outstanding` addresses are looked up at the same time.
+    Names that were found are cached for their TTL (at most positive_ttl). Addresses without a name are remembered for negative_ttl seconds, so they are not asked again and again.
+    callback -- optional function that is called with (ip, name, source) for every name that is found. The source is 'dns' or 'llmnr'. """
+
+    def __init__(self, callback=None, nameservers=None, use_llmnr=True, max_outstanding=16, timeout=2, positive_ttl=3600, negative_ttl=600, dns_port=DNS_PORT, llmnr_port=LLMNR_PORT, debug=False):
+        self.DEBUG = debug
+        self.callback = callback
+        self.nameservers = read_nameservers() if nameservers == None else list(nameservers)
+        self.use_llmnr = use_llmnr
+        self.max_outstanding = max_outstanding
+        self.timeout = timeout
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.dns_port = dns_port
+        self.llmnr_port = llmnr_port
+
+        self.lock = threading.Condition()
+        self.cache = {}       # ip -> CachedName. The name is None for addresses that have no name.
+        self.queue = deque()  # addresses that are waiting for their turn
+        self.queued = set()   # addresses that are queued or being looked up
+        self.lookups = {}     # ip -> [started, number of unanswered queries, found a name]
+        self.queries = {}     # transaction id -> (ip, address the reply should come from, source)
+        self.next_id = random.randint(0, 0xffff)
+        self.sock = None
+        self.thread = None
+        self.running = False
+
+        self.requests = 0
+        self.hits = 0
+        self.found = 0
+        self.not_found = 0
+
+
+    def request(self, ip_address, now=None):
+        """ Returns the cached name of an address, or None. If the cache has no answer, a lookup is started in the background. """
+        if now == None:
+            now = time.time()
+        ip_address = str(ip_address)
+        with self.lock:
+            self.requests += 1
+            entry = self.cache.get(ip_address)
+            if entry != None and entry.expires > now:
+                self.hits += 1
+                return entry.name
+            if ip_address not in self.queued:
+                self.queued.add(ip_address)
+                self.queue.append(ip_address)
+                self.lock.notify()
+        self.start()
+        return None
+
+
+    def lookup(self, ip_address, now=None):
+        """ Returns the cached name of an address, or None. Does not start a lookup. """
+        if now == None:
+            now = time.time()
+        with self.lock:
+            entry = self.cache.get(str(ip_address))
+            if entry != None and entry.expires > now:
+                return entry.name
+        return None
+
+
+    def start(self):
+        """ Starts the lookup thread, unless it is already running. request() calls this from any thread. """
+        with self.lock:
+            if self.running:
+                return
+            self.running = True
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+
+    def run(self):
+        try:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.bind(('', 0))
+            self.sock.setblocking(False)
+        except Exception as ex:
+            if self.DEBUG:
+                print("reverse resolver: could not open a UDP socket: " + str(ex))
+            with self.lock:
+                self.running = False
+            return
+
+        try:
+            while self.running:
+                with self.lock:
+                    while self.running and len(self.queue) == 0 and len(self.lookups) == 0:
+                        self.lock.wait()
+                    if not self.running:
+                        break
+                    to_send = []
+                    while len(self.queue) > 0 and len(self.lookups) < self.max_outstanding:
+                        ip_address = self.queue.popleft()
+                        self.lookups[ip_address] = [time.time(), 0, False]
+                        to_send.append(ip_address)
+
+                for ip_address in to_send:
+                    self.send_queries(ip_address)
+
+                readable, _, _ = select.select([self.sock], [], [], 0.1)
+                if readable:
+                    self.receive()
+                self.expire_lookups()
+        finally:
+            self.sock.close()
+            self.sock = None
+
+
+    def send_queries(self, ip_address):
+        destinations = [(nameserver, self.dns_port, 'dns') for nameserver in self.nameservers]
+        if self.use_llmnr:
+            destinations.append((ip_address, self.llmnr_port, 'llmnr'))
+        sent = 0
+        for host, port, source in destinations:
+            with self.lock:
+                transaction_id = self.next_id
+                self.next_id = (self.next_id + 1) & 0xffff
+                self.queries[transaction_id] = (ip_address, (host, port), source)
+            try:
+                self.sock.sendto(build_ptr_query(transaction_id, ip_address, recursion=(source == 'dns')), (host, port))
+                sent += 1
+            except OSError as ex:
+                if self.DEBUG:
+                    print("reverse resolver: could not send " + str(source) + " query for " + str(ip_address) + ": " + str(ex))
+                with self.lock:
+                    self.queries.pop(transaction_id, None)
+        with self.lock:
+            self.lookups[ip_address][1] = sent
+        if sent == 0:
+            self.finish(ip_address)
+
+
+    def receive(self):
+        while True:
+            try:
+                data, source_address = self.sock.recvfrom(4096)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return
+            response = parse_ptr_response(data)
+            if response == None:
+                continue
+            transaction_id, response_code, names = response
+            with self.lock:
+                query = self.queries.get(transaction_id)
+                if query == None or query[1] != source_address:
+                    continue
+                del self.queries[transaction_id]
+                ip_address, _, source = query
+                lookup = self.lookups.get(ip_address)
+                if lookup == None:
+                    continue
+                lookup[1] -= 1
+                if response_code == 0 and len(names) > 0:
+                    name = hostname_label(names[0][0])
+                    ttl = min(max(names[0][1], 60), self.positive_ttl)
+                    # DNS is preferred over LLMNR
+                    previous = self.cache.get(ip_address)
+                    if not lookup[2] or source == 'dns' or previous == None or previous.name == None:
+                        self.cache[ip_address] = CachedName(name, source, time.time() + ttl)
+                    if not lookup[2]:
+                        self.found += 1
+                    lookup[2] = True
+                else:
+                    name = None
+                done = lookup[1] <= 0
+            if name != None:
+                if self.DEBUG:
+                    print("reverse resolver: " + str(ip_address) + " is " + str(name) + " according to " + str(source))
+                if self.callback != None:
+                    try:
+                        self.callback(ip_address, name, source)
+                    except Exception as ex:
+                        if self.DEBUG:
+                            print("reverse resolver: callback error: " + str(ex))
+            if done:
+                self.finish(ip_address)
+
+
+    def expire_lookups(self):
+        """ Gives up on the queries that were not answered in time """
+        now = time.time()
+        with self.lock:
+            expired = [ip_address for ip_address in self.lookups if now - self.lookups[ip_address][0] > self.timeout]
+            if len(expired) > 0:
+                for transaction_id in [transaction_id for transaction_id in self.queries if self.queries[transaction_id][0] in expired]:
+                    del self.queries[transaction_id]
+        for ip_address in expired:
+            self.finish(ip_address)
+
+
+    def finish(self, ip_address):
+        with self.lock:
+            lookup = self.lookups.pop(ip_address, None)
+            self.queued.discard(ip_address)
+            if lookup != None and not lookup[2]:
+                self.cache[ip_address] = CachedName(None, None, time.time() + self.negative_ttl)
+                self.not_found += 1
+
+
+    def expire(self, now=None):
+        """ Removes the cached answers that are no longer valid """
+        if now == None:
+            now = time.time()
+        with self.lock:
+            for ip_address in [ip_address for ip_address in self.cache if self.cache[ip_address].expires <= now]:
+                del self.cache[ip_address]
+
+
+    def stop(self):
+        with self.lock:
+            self.running = False
+            self.lock.notify_all()
+
+
+    def statistics(self):
+        with self.lock:
+            return {'requests':self.requests,
+                    'hits':self.hits,
+                    'found':self.found,
+                    'not_found':self.not_found,
+                    'pending':len(self.queued),
+                    'cached':len(self.cache)
+                    }
+
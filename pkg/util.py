@@ -9,6 +9,9 @@ import hashlib      # For hashing mac addresses
 import platform     # For getting the operating system name
 import subprocess   # For executing a shell command
 
+from .netbios import NetbiosClient # For asking a device for its NetBIOS name
+from .oui_index import get_oui_index # For looking up the vendor of a mac address
+
 
 
 def valid_ip(ip):
@@ -75,25 +78,15 @@ def get_own_ip():
 
 
 
-# I couldn't get the import to work, so I just copied some of the code here:
-# It was made by Victor Oliveira (victor.oliveira@gmx.com)
-
-
-OUI_FILE = 'oui.txt'
+OUI_FILES = ('oui.csv', 'mam.csv', 'oui36.csv') # The IEEE MA-L, MA-M and MA-S registries. Only oui.csv is required.
+OUI_INDEX_FILE = 'oui.index'
 SEPARATORS = ('-', ':')
-BUFFER_SIZE = 1024 * 8
 
 __location__ = os.path.realpath(
     os.path.join(os.getcwd(), os.path.dirname(__file__)))
 
-def get_vendor(mac, oui_file=OUI_FILE):
-    
-    
-    # TODO: this could be replaced with a shell call:
-    # #!/bin/bash
-    # OUI=$(ip addr list|grep -w 'link'|awk '{print $2}'|grep -P '^(?!00:00:00)'| grep -P '^(?!fe80)' | tr -d ':' | head -c 6)
-    #curl -sS "http://standards-oui.ieee.org/oui.txt" | grep -i "$OUI" | cut -d')' -f2 | tr -d '\t'
-    
+def get_vendor(mac, oui_files=OUI_FILES):
+    """ Returns the organization that the mac address is registered to, or None. The lookup uses a memory-mapped index of the registry files, which is built on first use. """
     mac_clean = mac
     for separator in SEPARATORS:
         mac_clean = ''.join(mac_clean.split(separator))
@@ -107,56 +100,30 @@ def get_vendor(mac, oui_file=OUI_FILE):
     if mac_size > 12 or mac_size < 6:
         raise ValueError('Invalid MAC address.')
 
-    mac_half = mac_clean[0:6]
-    mac_half_upper = mac_half.upper()
+    addon_path = os.path.dirname(__location__)
+    index = get_oui_index([os.path.join(addon_path, oui_file) for oui_file in oui_files], os.path.join(addon_path, OUI_INDEX_FILE))
+    return index.lookup(mac_clean)
 
-    
-    #vendor_command = "grep -i " + str(mac_half_upper) + " " + str(os.path.join(__location__, oui_file)) + " | cut -d')' -f2 | tr -d '\t'"
-    #result = subprocess.run(vendor_command, shell=True, universal_newlines=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE) #.decode())
-    #vendor_alt = result.stdout.split('\n')[0]
-    #print("VENDOR_ALT FROM GREP: " + str(vendor_alt))
 
-    with open(os.path.join(__location__, oui_file)) as file:
-        #mac_half = mac_clean[0:6]
-        #mac_half_upper = mac_half.upper()
-        while True:
-            line = file.readline()
-            if line:
-                if line.startswith(mac_half_upper):
-                    vendor = line.strip().split('\t')[-1]
-                    return vendor
-            else:
-                break
+def get_vendors(macs, oui_files=OUI_FILES):
+    """ Returns a dictionary of mac -> organization (or None) """
+    addon_path = os.path.dirname(__location__)
+    index = get_oui_index([os.path.join(addon_path, oui_file) for oui_file in oui_files], os.path.join(addon_path, OUI_INDEX_FILE))
+    return index.lookup_many(macs)
 
 
 
 def nmblookup(ip_address):
-    # This can sometimes find the hostname.
-    #print("in NMB lookup helper function")
+    # This can sometimes find the hostname. Asks the device for its NetBIOS name directly, instead of running nmblookup -A.
     if valid_ip(ip_address):
-        command = "nmblookup -A " + str(ip_address)
-        #print("NMB command = " + str(command))
         try:
-            result = subprocess.run(command, shell=True, universal_newlines=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE) #.decode())
-            name = ""
-            for line in result.stdout.split('\n'):
-                
-                #print("NMB LINE = " + str(line))
-                if line.endswith(ip_address) or line.endswith('not found'): # Skip the first line, or if nmblookup is not installed.
-                    continue
-                name = str(line.split('<')[0])
-                name = name.strip()
-                #print("lookup name = " + str(name))
-                
-                return name
-                
-            #return str(result.stdout)
-
+            status = NetbiosClient().node_status(ip_address)
+            if status != None and status.name != None:
+                return status.name
         except Exception as ex:
             pass
-            #print("Nmblookup error: " + str(ex))
-        return ""
-        #return str(subprocess.check_output(command, shell=True).decode())
+            #print("NetBIOS lookup error: " + str(ex))
+    return ""
     
     
 #def hostname_lookup(addr):
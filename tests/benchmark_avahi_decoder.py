@@ -0,0 +1,52 @@
+"""Micro-benchmark of the avahi output decoder, compared to the chardet detection and per-code replace loop it replaced.
+
+Run it with: python3 tests/benchmark_avahi_decoder.py"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pkg.avahi_browser import decode_avahi_output
+
+
+def legacy_decode(data):
+    """ What get_avahi_lines used to do """
+    import chardet
+    lines = []
+    for line in data.decode(chardet.detect(data)['encoding'] or 'latin1').split('\n'):
+        for x in range(127):
+            anomaly = "\\" + str(x).zfill(3)
+            if anomaly in line:
+                line = line.replace(anomaly,chr(x))
+        lines.append(line)
+    return lines
+
+
+def sample_output(count=2000):
+    """ avahi-browse -p -r output with a new and a resolved line for every service. Every tenth name has an escaped apostrophe (’ is three UTF-8 bytes). """
+    sample = []
+    for index in range(count):
+        name = 'Device\\032' + str(index) + '\\064home'
+        if index % 10 == 0:
+            name = 'Anna\\226\\128\\153s\\032Device\\032' + str(index)
+        sample.append('+;wlan0;IPv4;' + name + ';_http._tcp;local')
+        sample.append('=;wlan0;IPv4;' + name + ';_http._tcp;local;device-' + str(index) + '.local;192.168.' + str(index // 250) + '.' + str(index % 250) + ';80;"path=/"')
+    return '\n'.join(sample).encode('utf-8')
+
+
+if __name__ == '__main__':
+    data = sample_output()
+    lines = decode_avahi_output(data)
+    assert lines[1] == '=;wlan0;IPv4;Anna’s Device 0;_http._tcp;local;device-0.local;192.168.0.0;80;"path=/"'
+    assert lines[3] == '=;wlan0;IPv4;Device 1@home;_http._tcp;local;device-1.local;192.168.0.1;80;"path=/"'
+
+    rounds = 5
+    new = timeit.timeit(lambda: decode_avahi_output(data), number=rounds) / rounds
+    print("decode_avahi_output: " + str(round(new * 1000, 2)) + " ms for " + str(len(lines)) + " lines")
+    try:
+        old = timeit.timeit(lambda: legacy_decode(data), number=1)
+        print("chardet + replace loop: " + str(round(old * 1000, 2)) + " ms (" + str(round(old / new, 1)) + "x slower)")
+    except ImportError:
+        print("chardet is not installed, can't compare with the old decoder")
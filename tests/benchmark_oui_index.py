@@ -0,0 +1,79 @@
+"""Benchmark of the OUI index: lookup time and resident memory, compared to the linear scan of the registry that get_vendor used to do.
+
+Run it with: python3 tests/benchmark_oui_index.py [oui.csv mam.csv oui36.csv]"""
+
+import os
+import sys
+import time
+import random
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pkg.oui_index import OuiIndex, build_index, read_registry_csv, mac_to_int
+
+
+def resident_memory():
+    """ Resident memory of this process in kB """
+    with open('/proc/self/status') as file:
+        for line in file:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return None
+
+
+def linear_lookup(csv_paths, mac):
+    """ What get_vendor used to do: read the whole file for every lookup """
+    mac_int = mac_to_int(mac)
+    best = None
+    for path in csv_paths:
+        for bits, prefix, name in read_registry_csv(path):
+            if mac_int >> (48 - bits) == prefix and (best == None or bits > best[0]):
+                best = (bits, name)
+    return best[1] if best != None else None
+
+
+def sample_macs(csv_paths, count=1000):
+    """ Random addresses inside registered blocks, plus some that are not assigned """
+    rows = [row for path in csv_paths for row in read_registry_csv(path)]
+    macs = []
+    for bits, prefix, name in random.sample(rows, min(count, len(rows))):
+        mac_int = (prefix << (48 - bits)) | random.getrandbits(48 - bits)
+        macs.append(':'.join('{:012x}'.format(mac_int)[i:i + 2] for i in range(0, 12, 2)))
+    return macs + ['02:11:22:33:44:55'] * (count // 10)
+
+
+if __name__ == '__main__':
+    repository = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    csv_paths = sys.argv[1:] if len(sys.argv) > 1 else [os.path.join(repository, name) for name in ('oui.csv', 'mam.csv', 'oui36.csv')]
+    csv_paths = [path for path in csv_paths if os.path.isfile(path)]
+    if len(csv_paths) == 0:
+        print("no registry CSV files found")
+        sys.exit(1)
+    macs = sample_macs(csv_paths)
+
+    with tempfile.TemporaryDirectory() as directory:
+        index_path = os.path.join(directory, 'oui.index')
+        started = time.time()
+        build_index(csv_paths, index_path)
+        print("build: " + str(round((time.time() - started) * 1000)) + " ms, " + str(os.path.getsize(index_path)) + " bytes")
+
+        memory_before = resident_memory()
+        index = OuiIndex(index_path)
+        started = time.time()
+        for mac in macs:
+            index.lookup(mac)
+        single = (time.time() - started) / len(macs)
+        started = time.time()
+        index.lookup_many(macs)
+        batch = (time.time() - started) / len(macs)
+        print("index lookup: " + str(round(single * 1000000, 1)) + " us per mac, batch: " + str(round(batch * 1000000, 1)) + " us per mac")
+        print("resident memory of the index after " + str(len(macs) * 2) + " lookups: +" + str(resident_memory() - memory_before) + " kB")
+
+        memory_before = resident_memory()
+        started = time.time()
+        for mac in macs[:20]:
+            assert linear_lookup(csv_paths, mac) == index.lookup(mac)
+        linear = (time.time() - started) / 20
+        print("linear scan of the CSV: " + str(round(linear * 1000, 1)) + " ms per mac (" + str(round(linear / single)) + "x slower), resident memory: +" + str(resident_memory() - memory_before) + " kB")
+        index.close()
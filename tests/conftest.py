@@ -0,0 +1,6 @@
+"""Makes the pkg modules importable from the tests, without the gateway."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
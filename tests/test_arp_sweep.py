@@ -0,0 +1,34 @@
+"""Tests for the ARP frame encoding and decoding."""
+
+from pkg.arp_sweep import build_arp_request, bytes_to_mac, mac_to_bytes, parse_arp_reply
+
+
+# The who-has 192.168.1.23 broadcast that 192.168.1.5 (aa:bb:cc:00:00:01) sends, padded to the minimum frame size
+REQUEST = bytes.fromhex('ffffffffffffaabbcc00000108060001080006040001aabbcc000001c0a80105000000000000c0a80117000000000000000000000000000000000000')
+
+# The is-at reply from 192.168.1.23 (11:22:33:44:55:66)
+REPLY = bytes.fromhex('aabbcc00000111223344556608060001080006040002112233445566c0a80117aabbcc000001c0a80105000000000000000000000000000000000000')
+
+# An IPv4 frame from the same device
+IPV4 = bytes.fromhex('aabbcc0000011122334455660800450000540000400040010000c0a80117c0a80105')
+
+
+def test_build_arp_request():
+    frame = build_arp_request('aa:bb:cc:00:00:01', '192.168.1.5', '192.168.1.23')
+    assert frame == REQUEST
+    assert len(frame) == 60
+    assert build_arp_request(mac_to_bytes('AA-BB-CC-00-00-01'), '192.168.1.5', '192.168.1.23') == REQUEST
+
+
+def test_parse_arp_reply():
+    assert parse_arp_reply(REPLY) == ('192.168.1.23', '11:22:33:44:55:66')
+
+
+def test_parse_other_frames():
+    assert parse_arp_reply(REQUEST) == None # a request, not a reply
+    assert parse_arp_reply(IPV4) == None
+    assert parse_arp_reply(REPLY[:41]) == None
+
+
+def test_mac_conversion():
+    assert bytes_to_mac(mac_to_bytes('11:22:33:44:55:66')) == '11:22:33:44:55:66'
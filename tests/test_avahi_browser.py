@@ -0,0 +1,51 @@
+"""Tests for the avahi-browse output parsing."""
+
+from pkg.avahi_browser import AvahiBrowser, decode_avahi_output, parse_avahi_line, unescape
+
+
+# "John’s iPhone": avahi escapes every byte of the UTF-8 encoded apostrophe
+RESOLVED = b'=;wlan0;IPv4;John\\226\\128\\153s\\032iPhone;_companion-link._tcp;local;Johns-iPhone.local;192.168.1.23;49152;"rpBA=1\\05902"\n'
+REMOVED = b'-;wlan0;IPv4;John\\226\\128\\153s\\032iPhone;_companion-link._tcp;local\n'
+
+
+def test_unescape_multibyte_character():
+    assert unescape(b'John\\226\\128\\153s\\032iPhone') == 'John’s iPhone'
+    assert unescape('Kitchen\\032Speaker\\.local') == 'Kitchen Speaker.local'
+
+
+def test_unescape_invalid_utf8_is_replaced():
+    assert unescape(b'bad\\255byte') == 'bad�byte'
+
+
+def test_decode_avahi_output():
+    lines = decode_avahi_output(RESOLVED + REMOVED)
+    assert lines[0].split(';')[3] == 'John’s iPhone'
+    assert lines[1] == '-;wlan0;IPv4;John’s iPhone;_companion-link._tcp;local'
+
+
+def test_parse_avahi_line_bytes_and_text_agree():
+    record = parse_avahi_line(RESOLVED)
+    assert record.event == '='
+    assert record.name == 'John’s iPhone'
+    assert record.hostname == 'Johns-iPhone.local'
+    assert record.address == '192.168.1.23'
+    assert record.txt == '"rpBA=1;02"'
+    assert parse_avahi_line(RESOLVED.decode('utf-8')) == record
+    assert parse_avahi_line(b'Failed to resolve service\n') == None
+
+
+def test_browser_replays_raw_lines():
+    seen = []
+    browser = AvahiBrowser(callback=lambda record, previous: seen.append((record.event, record.name)), source=[RESOLVED, REMOVED])
+    browser.running = True
+    browser.run()
+    assert seen == [('=', 'John’s iPhone'), ('-', 'John’s iPhone')]
+    assert browser.snapshot() == []
+
+
+def test_escaped_semicolon_keeps_the_columns():
+    record = parse_avahi_line(b'=;eth0;IPv4;Living\\059Room;_http._tcp;local;tv.local;192.168.1.30;80;""\n')
+    assert record.name == 'Living;Room'
+    assert record.hostname == 'tv.local'
+    assert record.address == '192.168.1.30'
+    assert record.port == '80'
@@ -0,0 +1,54 @@
+"""Tests for the SQLite device store."""
+
+import json
+
+from pkg.device_store import SqliteDeviceStore
+
+
+DEVICES = {
+    'aabbcc000001':{'name':'Phone', 'mac_address':'AA:BB:CC:00:00:01', 'ip':'192.168.1.23', 'first_seen':1760000000, 'last_seen':1760003600, 'thing':True},
+    'aabbcc000002':{'name':'Printer', 'mac_address':'aa:bb:cc:00:00:02', 'ip':'192.168.1.40', 'first_seen':1760000100},
+}
+
+
+def test_migrates_the_json_file_once(tmp_path):
+    json_path = str(tmp_path / 'persistence.json')
+    with open(json_path, 'w') as file:
+        json.dump({'mayor_version':2, 'minor_version':0, 'devices':DEVICES}, file)
+    store = SqliteDeviceStore(str(tmp_path / 'devices.sqlite'), migrate_from=json_path)
+    data = store.load()
+    assert data['devices'] == DEVICES
+    assert data['mayor_version'] == 2
+    store.close()
+
+    with open(json_path, 'w') as file:
+        json.dump({'mayor_version':2, 'devices':{}}, file)
+    store = SqliteDeviceStore(str(tmp_path / 'devices.sqlite'), migrate_from=json_path)
+    assert store.load()['devices'] == DEVICES # not copied again
+    store.close()
+
+
+def test_only_changed_devices_are_written(tmp_path):
+    store = SqliteDeviceStore(str(tmp_path / 'devices.sqlite'))
+    store.load()
+    assert store.save(DEVICES) == 2
+    assert store.save(DEVICES) == 0
+    devices = json.loads(json.dumps(DEVICES))
+    devices['aabbcc000002']['name'] = 'Office printer'
+    del devices['aabbcc000001']
+    assert store.save(devices) == 2 # one changed, one removed
+    assert store.statistics()['skipped'] == 1
+    store.close()
+
+    store = SqliteDeviceStore(str(tmp_path / 'devices.sqlite'))
+    assert store.load()['devices'] == devices
+    row = store.connection.execute("SELECT mac, first_seen FROM devices WHERE id = 'aabbcc000002'").fetchone()
+    assert row == ('aa:bb:cc:00:00:02', 1760000100)
+    store.close()
+
+
+def test_indexes(tmp_path):
+    store = SqliteDeviceStore(str(tmp_path / 'devices.sqlite'))
+    indexes = set(row[0] for row in store.connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'"))
+    assert {'devices_mac', 'devices_ip', 'devices_name', 'devices_first_seen', 'devices_last_seen'} <= indexes
+    store.close()
@@ -0,0 +1,41 @@
+"""Tests for the ICMP echo encoding and decoding."""
+
+from pkg.icmp_sweep import build_echo_request, icmp_checksum, parse_echo_reply, IcmpSweeper
+
+
+# An echo request with identifier 0x1234, sequence 1 and the payload 'presence'
+REQUEST = bytes.fromhex('080047111234000170726573656e6365')
+
+# The reply to it from 192.168.1.23, as read from a raw socket (with the IPv4 header) and from a datagram socket (without it)
+RAW_REPLY = bytes.fromhex('4500001c0000400040010000c0a80117c0a8010500004f111234000170726573656e6365')
+DGRAM_REPLY = RAW_REPLY[20:]
+
+# An ICMP destination unreachable message
+UNREACHABLE = bytes.fromhex('0301fcfe00000000')
+
+
+def test_build_echo_request():
+    assert build_echo_request(0x1234, 1, b'presence') == REQUEST
+    assert icmp_checksum(REQUEST) == 0
+    assert build_echo_request(0x11234, 0x10001, b'presence') == REQUEST # identifier and sequence wrap around
+
+
+def test_parse_echo_reply():
+    assert parse_echo_reply(RAW_REPLY, has_ip_header=True) == (0x1234, 1)
+    assert parse_echo_reply(DGRAM_REPLY) == (0x1234, 1)
+    assert icmp_checksum(DGRAM_REPLY) == 0
+
+
+def test_parse_other_messages():
+    assert parse_echo_reply(REQUEST) == None
+    assert parse_echo_reply(UNREACHABLE) == None
+    assert parse_echo_reply(DGRAM_REPLY[:6]) == None
+    assert parse_echo_reply(b'', has_ip_header=True) == None
+
+
+def test_sweeper_parse_depends_on_socket_type():
+    sweeper = IcmpSweeper()
+    sweeper.raw = True
+    assert sweeper.parse(RAW_REPLY) == (0x1234, 1)
+    sweeper.raw = False
+    assert sweeper.parse(DGRAM_REPLY) == (0x1234, 1)
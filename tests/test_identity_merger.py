@@ -0,0 +1,85 @@
+"""Tests for linking randomized mac addresses to known devices."""
+
+from pkg.identity_merger import IdentityMerger, is_generic_hostname, is_randomized
+from pkg.util import mac_to_id
+
+
+NOW = 1760000000
+NEW_MAC = '06:11:22:33:44:55'
+
+
+def device(hostname, last_seen, ip='192.168.1.23', **extra):
+    data = {'name':hostname, 'hostname':hostname, 'randomized':True, 'ip':ip, 'last_seen':last_seen, 'first_seen':last_seen - 86400}
+    data.update(extra)
+    return data
+
+
+def test_is_randomized():
+    assert is_randomized('06:11:22:33:44:55')
+    assert not is_randomized('b8:27:eb:01:02:03')
+    assert not is_randomized('03:00:00:00:00:01') # multicast
+
+
+def test_generic_hostnames():
+    for hostname in ('iPhone', 'iphone-2', 'Android', 'MacBook-Pro.local', 'localhost', 'espressif', ''):
+        assert is_generic_hostname(hostname)
+    for hostname in ('Johns-iPhone', 'android-1a2b3c4d5e6f', 'kitchen-tablet'):
+        assert not is_generic_hostname(hostname)
+
+
+def test_hostname_and_recent_silence():
+    found = {'0a0000000001':device('Johns-iPhone', NOW - 3600, ip='192.168.1.50')}
+    assert IdentityMerger().find_identity(found, NEW_MAC, '192.168.1.23', 'johns-iphone.local', NOW) == '0a0000000001'
+
+
+def test_generic_hostname_is_not_enough():
+    found = {'0a0000000001':device('iPhone', NOW - 3600, ip='192.168.1.50')}
+    assert IdentityMerger().find_identity(found, NEW_MAC, '192.168.1.23', 'iPhone', NOW) == None
+
+
+def test_generic_hostname_with_the_same_lease():
+    found = {'0a0000000001':device('iPhone', NOW - 3600)}
+    assert IdentityMerger().find_identity(found, NEW_MAC, '192.168.1.23', 'iPhone', NOW) == '0a0000000001'
+
+
+def test_guest_on_the_same_lease():
+    # the guest's phone got the address that a thing had an hour ago, and neither has a name
+    found = {'0a0000000001':device(None, NOW - 3600, dhcp_client_id='01060a0b0c0d0e0f')}
+    merger = IdentityMerger()
+    assert merger.find_identity(found, NEW_MAC, '192.168.1.23', None, NOW, protected=['0a0000000001']) == None
+    assert merger.find_identity(found, NEW_MAC, '192.168.1.23', None, NOW, dhcp={'client_id':'01aabbccddeeff', 'vendor_class':None}, protected=['0a0000000001']) == None
+    assert merger.find_identity(found, NEW_MAC, '192.168.1.23', None, NOW, dhcp={'client_id':'01060a0b0c0d0e0f', 'vendor_class':None}, protected=['0a0000000001']) == '0a0000000001'
+    assert merger.find_identity(found, NEW_MAC, '192.168.1.23', None, NOW) == '0a0000000001' # not a thing
+
+
+def test_hostname_alone_is_not_enough():
+    # gone for three days, at another address
+    found = {'0a0000000001':device('Johns-iPhone', NOW - 3 * 86400, ip='192.168.1.50')}
+    merger = IdentityMerger()
+    assert merger.find_identity(found, NEW_MAC, '192.168.1.23', 'Johns-iPhone', NOW) == None
+    found['0a0000000001']['dhcp_vendor_class'] = 'android-dhcp-14'
+    assert merger.find_identity(found, NEW_MAC, '192.168.1.23', 'Johns-iPhone', NOW, dhcp={'client_id':None, 'vendor_class':'android-dhcp-14'}) == '0a0000000001'
+
+
+def test_active_devices_are_different_devices():
+    found = {'0a0000000001':device('Johns-iPhone', NOW - 10, ip='192.168.1.50')}
+    assert IdentityMerger().find_identity(found, NEW_MAC, '192.168.1.23', 'Johns-iPhone', NOW) == None
+
+
+def test_merge_keeps_the_old_address():
+    found = {'0a0000000001':device('Johns-iPhone', NOW - 3600, mac_address='0a:00:00:00:00:01')}
+    merger = IdentityMerger()
+    merger.merge(found, '0a0000000001', NEW_MAC)
+    assert found['0a0000000001']['mac_address'] == NEW_MAC
+    assert found['0a0000000001']['mac_aliases'] == ['0a:00:00:00:00:01']
+    assert merger.resolve(mac_to_id(NEW_MAC)) == '0a0000000001'
+
+
+def test_generic_duplicates_are_not_merged():
+    found = {'0a0000000001':device('iPhone', NOW - 7200, mac_address='0a:00:00:00:00:01'),
+             '0a0000000002':device('iPhone', NOW - 3600, mac_address='0a:00:00:00:00:02'),
+             '0a0000000003':device('Johns-iPhone', NOW - 7200, mac_address='0a:00:00:00:00:03'),
+             '0a0000000004':device('Johns-iPhone', NOW - 3600, mac_address='0a:00:00:00:00:04')}
+    removed = IdentityMerger().merge_duplicates(found, set(), NOW)
+    assert removed == ['0a0000000003']
+    assert found['0a0000000004']['mac_aliases'] == ['0a:00:00:00:00:03']
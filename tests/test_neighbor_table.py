@@ -0,0 +1,68 @@
+"""Tests for the netlink and /proc/net/arp neighbor table parsers."""
+
+import pytest
+
+from pkg.neighbor_table import NeighborMonitor, build_dump_request, interface_name, parse_neighbor_messages, parse_proc_arp, RTM_DELNEIGH, RTM_NEWNEIGH
+
+
+# A neighbor table dump, as read from the kernel: two RTM_NEWNEIGH messages (REACHABLE and STALE) and NLMSG_DONE. Native byte order of a little-endian host.
+DUMP = bytes.fromhex(
+    '300000001c000200070000000000000002000000010000000200000108000100c0a801170a000200aabbcc1122330000'
+    '300000001c000200070000000000000002000000010000000400000108000100c0a801280a00020002aabbccddee0000'
+    '1400000003000200070000000000000000000000')
+
+# An RTM_DELNEIGH event for 192.168.1.23
+DELETED = bytes.fromhex('300000001d000000000000000000000002000000010000000400000108000100c0a801170a000200aabbcc1122330000')
+
+# A netlink error message with error -EPERM
+ERROR = bytes.fromhex('24000000020000000700000000000000ffffffff') + bytes(16)
+
+PROC_ARP = """IP address       HW type     Flags       HW address            Mask     Device
+192.168.1.1      0x1         0x2         aa:bb:cc:00:00:01     *        wlan0
+192.168.1.50     0x1         0x0         00:00:00:00:00:00     *        wlan0
+192.168.1.60     0x1         0x6         aa:bb:cc:00:00:02     *        wlan0
+"""
+
+
+def test_parse_dump():
+    entries, done = parse_neighbor_messages(DUMP)
+    assert done
+    assert [message_type for message_type, entry in entries] == [RTM_NEWNEIGH, RTM_NEWNEIGH]
+    first = entries[0][1]
+    assert (first.ip, first.mac, first.state) == ('192.168.1.23', 'aa:bb:cc:11:22:33', 'REACHABLE')
+    assert first.interface == interface_name(1)
+    assert entries[1][1].state == 'STALE'
+
+
+def test_deleted_entry_is_failed():
+    entries, done = parse_neighbor_messages(DELETED)
+    assert not done
+    assert entries[0][0] == RTM_DELNEIGH
+    assert entries[0][1].state == 'FAILED'
+
+
+def test_error_message_raises():
+    with pytest.raises(OSError):
+        parse_neighbor_messages(ERROR)
+
+
+def test_truncated_buffer_is_ignored():
+    entries, done = parse_neighbor_messages(DUMP[:40])
+    assert entries == [] and not done
+
+
+def test_dump_request():
+    request = build_dump_request(sequence=7)
+    assert len(request) == 28
+    assert request[4:6] == bytes.fromhex('1e00') # RTM_GETNEIGH
+
+
+def test_proc_arp_is_never_reachable():
+    entries = parse_proc_arp(PROC_ARP)
+    assert [entry.state for entry in entries] == ['STALE', 'INCOMPLETE', 'PERMANENT']
+    assert entries[1].mac == None
+
+
+def test_monitor_replays_events():
+    monitor = NeighborMonitor(source=[DUMP, DELETED])
+    assert [(entry.ip, entry.state) for entry in monitor.events()] == [('192.168.1.23', 'REACHABLE'), ('192.168.1.40', 'STALE'), ('192.168.1.23', 'FAILED')]
@@ -0,0 +1,97 @@
+"""Tests for the NetBIOS node status client, against a local UDP responder."""
+
+import time
+import socket
+import struct
+import threading
+
+import pytest
+
+from pkg.netbios import NetbiosClient, build_node_status_request, parse_name_query_response, parse_node_status_response, encode_name
+
+
+# The node status request for transaction id 0x1234, and the reply of a Windows host called LAPTOP in the WORKGROUP workgroup
+REQUEST = bytes.fromhex('12340000000100000000000020434b4141414141414141414141414141414141414141414141414141414141410000210001')
+REPLY = bytes.fromhex(
+    '12348400000000010000000020434b4141414141414141414141414141414141414141414141414141414141410000210001'
+    '000000000065034c4150544f50202020202020202020000400574f524b47524f55502020202020200084004c4150544f5020'
+    '2020202020202020200400aabbccddeeff00000000000000000000000000000000000000000000000000000000000000000000000000000000')
+
+
+
+class Responder:
+    """ Answers every node status request with the recorded reply """
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(0.2)
+        self.port = self.sock.getsockname()[1]
+        self.requests = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            try:
+                data, source = self.sock.recvfrom(2048)
+            except socket.timeout:
+                continue
+            self.requests += 1
+            self.sock.sendto(data[:2] + REPLY[2:], source)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        self.sock.close()
+
+
+@pytest.fixture
+def responder():
+    responder = Responder()
+    yield responder
+    responder.stop()
+
+
+def test_request_encoding():
+    assert build_node_status_request(0x1234) == REQUEST
+    assert encode_name('LAPTOP', 0x20)[1:3] == b'EM'
+
+
+def test_parse_reply():
+    status = parse_node_status_response(REPLY, '192.168.1.30')
+    assert status.ip == '192.168.1.30'
+    assert status.name == 'LAPTOP'
+    assert status.group == 'WORKGROUP'
+    assert status.mac == 'aa:bb:cc:dd:ee:ff'
+    assert len(status.names) == 3
+
+
+def test_truncated_reply():
+    assert parse_node_status_response(REPLY[:40]) == None
+    status = parse_node_status_response(REPLY[:60]) # the answer is cut off in the middle of the first name
+    assert status.name == None and status.names == []
+    assert parse_name_query_response(REPLY[:10]) == []
+
+
+def test_node_status(responder):
+    status = NetbiosClient(port=responder.port).node_status('127.0.0.1', timeout=2)
+    assert status != None
+    assert (status.name, status.group, status.mac) == ('LAPTOP', 'WORKGROUP', 'aa:bb:cc:dd:ee:ff')
+
+
+def test_sweep_only_accepts_replies_from_the_asked_address(responder):
+    # 127.0.0.2 is never answered by the responder, which listens on 127.0.0.1 only
+    results = NetbiosClient(port=responder.port).sweep(['127.0.0.1', '127.0.0.2'], timeout=0.5)
+    assert list(results.keys()) == ['127.0.0.1']
+
+
+def test_cancelled_sweep_stops(responder):
+    cancel = threading.Event()
+    cancel.set()
+    started = time.time()
+    results = NetbiosClient(port=responder.port).sweep(['127.0.0.1'] * 10, timeout=5, cancel=cancel)
+    assert results == {}
+    assert time.time() - started < 1
+    assert responder.requests == 0
@@ -0,0 +1,68 @@
+"""Tests for the memory-mapped OUI index."""
+
+import os
+
+from pkg.oui_index import OuiIndex, build_index, mac_to_int, open_oui_index
+
+
+MA_L = '''Registry,Assignment,Organization Name,Organization Address
+MA-L,286FB9,"Nokia Shanghai Bell Co., Ltd.","No.388 Ning Qiao Road,Jin Qiao Pudong Shanghai Shanghai   CN 201206 "
+MA-L,70B3D5,IEEE Registration Authority,445 Hoes Lane Piscataway NJ US 08554
+MA-L,B827EB,Raspberry Pi Foundation,Mitchell Wood House Caldecote Cambridgeshire GB CB23 7NU
+'''
+
+MA_S = '''Registry,Assignment,Organization Name,Organization Address
+MA-S,70B3D5F2E,Wiren Board,Pushkina 12 Moscow RU 123456
+'''
+
+
+def write_registry(directory):
+    paths = []
+    for name, text in (('oui.csv', MA_L), ('oui36.csv', MA_S)):
+        path = os.path.join(str(directory), name)
+        with open(path, 'w') as file:
+            file.write(text)
+        paths.append(path)
+    return paths
+
+
+def test_mac_to_int():
+    assert mac_to_int('b8:27:eb:01:02:03') == 0xb827eb010203
+    assert mac_to_int('B8-27-EB') == 0xb827eb000000
+    assert mac_to_int('b8:27') == None
+    assert mac_to_int('not a mac') == None
+
+
+def test_lookup_prefers_the_longest_prefix(tmp_path):
+    index_path = str(tmp_path / 'oui.index')
+    build_index(write_registry(tmp_path), index_path)
+    index = OuiIndex(index_path)
+    try:
+        assert len(index) == 4
+        assert index.lookup('b8:27:eb:01:02:03') == 'Raspberry Pi Foundation'
+        assert index.lookup('28:6f:b9:00:00:00') == 'Nokia Shanghai Bell Co., Ltd.'
+        assert index.lookup('70:b3:d5:f2:e0:01') == 'Wiren Board'
+        assert index.lookup('70:b3:d5:00:00:01') == 'IEEE Registration Authority'
+        assert index.lookup('02:11:22:33:44:55') == None
+        assert index.lookup_many(['b8:27:eb:00:00:01', 'b8:27:eb:00:00:02', 'nonsense']) == {'b8:27:eb:00:00:01':'Raspberry Pi Foundation', 'b8:27:eb:00:00:02':'Raspberry Pi Foundation', 'nonsense':None}
+    finally:
+        index.close()
+
+
+def test_index_in_memory(tmp_path):
+    index = OuiIndex(data=build_index(write_registry(tmp_path)))
+    assert index.lookup('b8:27:eb:01:02:03') == 'Raspberry Pi Foundation'
+
+
+def test_index_is_rebuilt_when_the_registry_changes(tmp_path):
+    paths = write_registry(tmp_path)
+    index_path = str(tmp_path / 'oui.index')
+    open_oui_index(paths, index_path).close()
+    with open(paths[0], 'a') as file:
+        file.write('MA-L,DCA632,Raspberry Pi Trading Ltd,Maurice Wilkes Building Cambridge GB CB4 0DS\n')
+    os.utime(paths[0], (os.path.getmtime(index_path) + 10, os.path.getmtime(index_path) + 10))
+    index = open_oui_index(paths, index_path)
+    try:
+        assert index.lookup('dc:a6:32:00:00:01') == 'Raspberry Pi Trading Ltd'
+    finally:
+        index.close()
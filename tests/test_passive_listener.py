@@ -0,0 +1,92 @@
+"""Tests for the passive listener, by replaying a recorded capture."""
+
+import os
+import struct
+
+from pkg.passive_listener import ARP_DHCP_FILTER, PassiveListener, parse_frame, read_pcap
+
+
+# A phone joining the network: an ARP probe, DHCP request (with its hostname), offer and ack, an ARP reply, and a TCP packet
+CAPTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'arp_dhcp.pcap')
+
+PHONE = '02:1a:2b:3c:4d:5e'
+
+# A DHCP renewal of 192.168.1.23 with a client id, vendor class and hostname. The BOOTP server name and boot file fields are all zeros.
+RENEWAL = bytes.fromhex('aabbcc0000010611223344550800450001370000000040110000c0a80117c0a801010044004301230000'
+                        '010106003903f32700000000c0a80117' + '00' * 12 + '061122334455') + bytes(10 + 192) + \
+          bytes.fromhex('638253633501033d07010611223344553c0f616e64726f69642d646863702d31340c0b4a6f686e732d506978656cff')
+
+
+
+def run_filter(program, frame):
+    """ A minimal classic BPF interpreter, for the instructions the filter uses. Returns the number of bytes to accept. """
+    a = x = 0
+    pc = 0
+    while True:
+        code, jump_true, jump_false, k = program[pc]
+        pc += 1
+        if code == 0x28:   # ldh [k]
+            a = struct.unpack_from('!H', frame, k)[0]
+        elif code == 0x30: # ldb [k]
+            a = frame[k]
+        elif code == 0x48: # ldh [x + k]
+            a = struct.unpack_from('!H', frame, x + k)[0]
+        elif code == 0xb1: # ldxb 4 * ([k] & 0xf)
+            x = 4 * (frame[k] & 0x0f)
+        elif code == 0x15: # jeq k
+            pc += jump_true if a == k else jump_false
+        elif code == 0x45: # jset k
+            pc += jump_true if a & k else jump_false
+        elif code == 0x06: # ret k
+            return k
+        else:
+            raise ValueError('unknown instruction ' + hex(code))
+
+
+def test_read_pcap():
+    frames = list(read_pcap(CAPTURE))
+    assert len(frames) == 6
+    assert frames[1][0] == 1760000001.25
+
+
+def test_sightings():
+    sightings = [parse_frame(frame, timestamp) for timestamp, frame in read_pcap(CAPTURE)]
+    assert [(s.kind, s.ip, s.hostname) for s in sightings[:5]] == [
+        ('arp', None, None),                      # ARP probe, the address is not in use yet
+        ('dhcp', '192.168.1.23', 'Johns-iPhone'), # requested address and hostname
+        ('dhcp', None, None),                     # an offer doesn't mean the phone has the address
+        ('dhcp', '192.168.1.23', None),           # the ack does
+        ('arp', '192.168.1.23', None),
+    ]
+    assert all(s.mac == PHONE for s in sightings[:5])
+    assert sightings[5] == None
+
+
+def test_dhcp_identity():
+    sighting = parse_frame(RENEWAL, 1760000000)
+    assert (sighting.mac, sighting.ip, sighting.hostname) == ('06:11:22:33:44:55', '192.168.1.23', 'Johns-Pixel')
+    assert sighting.client_id == '01061122334455'
+    assert sighting.vendor_class == 'android-dhcp-14'
+    assert run_filter(ARP_DHCP_FILTER, RENEWAL) > 0
+
+
+def test_filter_matches_the_parser():
+    for timestamp, frame in read_pcap(CAPTURE):
+        accepted = run_filter(ARP_DHCP_FILTER, frame) > 0
+        assert accepted == (parse_frame(frame) != None)
+
+
+def test_listener_replays_capture():
+    listener = PassiveListener(source=CAPTURE)
+    sightings = list(listener.sightings())
+    assert len(sightings) == 5
+    assert sightings[-1].time == 1760000004.0
+
+
+def test_listener_stops():
+    listener = PassiveListener(source=CAPTURE)
+    seen = []
+    for sighting in listener.sightings():
+        seen.append(sighting)
+        listener.stop()
+    assert len(seen) == 1
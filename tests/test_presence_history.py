@@ -0,0 +1,53 @@
+"""Tests for the presence history ring buffer."""
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from pkg.presence_history import PresenceHistory
+
+
+DAY = 1440 * 60
+
+
+def test_record_and_uptime():
+    history = PresenceHistory(days=1)
+    start = 1000 * DAY
+    history.record(['a', 'b'], start)
+    history.record(['a'], start + 60)
+    assert history.uptime(start, start + 120) == {'a':2, 'b':1}
+
+
+def test_record_range_fills_the_gap():
+    history = PresenceHistory(days=1)
+    start = 1000 * DAY
+    history.record(['a'], start)
+    history.record_range(['a'], start + 60, start + 4 * 60 + 30) # housekeeping was late
+    assert history.uptime(start, start + 10 * 60) == {'a':5}
+    ids, present = history.matrix(start, start + 6 * 60)
+    assert present.tolist() == [[True, True, True, True, True, False]]
+
+
+def test_record_range_longer_than_the_ring():
+    history = PresenceHistory(days=1)
+    start = 1000 * DAY
+    history.record_range(['a'], start, start + 2 * DAY)
+    assert history.uptime(start + DAY, start + 2 * DAY + 60) == {'a':1440}
+
+
+def test_old_columns_are_cleared():
+    history = PresenceHistory(days=1)
+    start = 1000 * DAY
+    history.record(['a'], start)
+    history.record(['b'], start + DAY)
+    assert history.uptime(start, start + DAY + 60) == {'a':0, 'b':1}
+
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / 'history.npz')
+    history = PresenceHistory(path, days=1)
+    start = 1000 * DAY
+    history.record_range(['a'], start, start + 300)
+    history.save()
+    loaded = PresenceHistory(path, days=1)
+    assert loaded.uptime(start, start + 600) == {'a':6}
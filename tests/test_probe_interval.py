@@ -0,0 +1,34 @@
+"""Tests for the adaptive probe intervals."""
+
+from pkg.probe_interval import AdaptiveProbeIntervals
+
+
+def test_present_device_backs_off_until_expiry():
+    intervals = AdaptiveProbeIntervals(base_interval=60, max_interval=600)
+    now = 1000
+    intervals.record('a', True, expiry=now + 10000, now=now)
+    intervals.record('a', True, expiry=now + 10000, now=now)
+    assert intervals.next_probe['a'] == now + 120
+    intervals.record('a', True, expiry=now + 300, now=now)
+    assert intervals.next_probe['a'] == now + 180 # one round before the expiry
+
+
+def test_absent_device_backs_off():
+    # An absent device's expiry lies in the past. It must not pin the device to the base interval.
+    intervals = AdaptiveProbeIntervals(base_interval=60, max_interval=600)
+    now = 1000
+    expected = [60, 120, 240, 480, 600, 600]
+    for interval in expected:
+        intervals.record('b', False, expiry=now - 3600, now=now)
+        assert intervals.next_probe['b'] - now == interval
+        assert not intervals.is_due('b', now + interval - 1)
+        assert intervals.is_due('b', now + interval)
+        now += interval
+
+
+def test_changed_outcome_resets_interval():
+    intervals = AdaptiveProbeIntervals(base_interval=60, max_interval=600)
+    for _ in range(4):
+        intervals.record('c', False, now=0)
+    intervals.record('c', True, now=0)
+    assert intervals.interval['c'] == 60
@@ -0,0 +1,103 @@
+"""Tests for the reverse resolver, against a stub DNS server."""
+
+import time
+import socket
+import threading
+
+import pytest
+
+from pkg.reverse_resolver import HEADER, ReverseResolver, build_ptr_query, build_ptr_response, parse_ptr_response, read_name, reverse_name
+
+
+# The PTR query for 192.0.2.10 with transaction id 0x0102, and the answer 'laptop.lan' with a TTL of 300 seconds
+QUERY = bytes.fromhex('010201000001000000000000023130013201300331393207696e2d61646472046172706100000c0001')
+ANSWER = bytes.fromhex('010281800001000100000000023130013201300331393207696e2d61646472046172706100000c0001c00c000c00010000012c000c066c6170746f70036c616e00')
+
+
+
+class StubDnsServer:
+    """ Knows the name of 192.0.2.10, and answers 'no such name' for everything else """
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.settimeout(0.2)
+        self.port = self.sock.getsockname()[1]
+        self.known = {reverse_name('192.0.2.10'):'laptop.lan'}
+        self.queries = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while self.running:
+            try:
+                query, client = self.sock.recvfrom(512)
+            except socket.timeout:
+                continue
+            self.queries += 1
+            self.sock.sendto(build_ptr_response(query, self.known.get(read_name(query, HEADER.size)[0]), ttl=300), client)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        self.sock.close()
+
+
+@pytest.fixture
+def server():
+    server = StubDnsServer()
+    yield server
+    server.stop()
+
+
+def wait_until_idle(resolver, timeout=3):
+    deadline = time.time() + timeout
+    while resolver.statistics()['pending'] > 0 and time.time() < deadline:
+        time.sleep(0.02)
+
+
+def test_query_and_answer_encoding():
+    assert build_ptr_query(0x0102, '192.0.2.10') == QUERY
+    assert build_ptr_response(QUERY, 'laptop.lan', ttl=300) == ANSWER
+    assert parse_ptr_response(ANSWER) == (0x0102, 0, [('laptop.lan', 300)])
+    assert parse_ptr_response(QUERY) == None
+    transaction_id, response_code, names = parse_ptr_response(build_ptr_response(QUERY))
+    assert response_code == 3 and names == []
+
+
+def test_lookups_against_stub_server(server):
+    found = {}
+    resolver = ReverseResolver(callback=lambda ip, name, source: found.update({ip:(name, source)}), nameservers=['127.0.0.1'], use_llmnr=False, dns_port=server.port, max_outstanding=2)
+    try:
+        for address in ['192.0.2.10', '192.0.2.11', '192.0.2.12']:
+            assert resolver.request(address) == None
+        wait_until_idle(resolver)
+    finally:
+        resolver.stop()
+    assert found == {'192.0.2.10':('laptop', 'dns')}
+    assert resolver.request('192.0.2.10') == 'laptop'
+    assert resolver.request('192.0.2.11') == None # remembered as not found, so it is not asked again
+    statistics = resolver.statistics()
+    assert statistics['hits'] == 2 and statistics['found'] == 1 and statistics['not_found'] == 2
+    assert server.queries == 3
+
+
+def test_concurrent_requests_start_one_thread(monkeypatch):
+    started = []
+    release = threading.Event()
+    monkeypatch.setattr(ReverseResolver, 'run', lambda self: (started.append(threading.current_thread()), release.wait(2)))
+    resolver = ReverseResolver(nameservers=[], use_llmnr=False)
+    barrier = threading.Barrier(8)
+
+    def request(index):
+        barrier.wait()
+        resolver.request('192.0.2.' + str(index))
+
+    threads = [threading.Thread(target=request, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    release.set()
+    assert len(started) == 1